@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from wazo_agid.cache import Snapshot
+
+# wazo-agentd adds a row to agent_login_status when an agent logs in and
+# removes it when the agent logs off
+AGENT_STATUS_MAX_AGE = 5
+
+
+def _load(cursor):
+    cursor.query("SELECT ${columns} FROM agent_login_status", ('agent_id', 'state_interface'))
+    return dict((row['agent_id'], row['state_interface']) for row in cursor.fetchall())
+
+
+_login_status = Snapshot('agent login status', _load, max_age=AGENT_STATUS_MAX_AGE)
+
+
+def find_state_interface(cursor, agent_id):
+    """Returns the state interface of a logged agent, None when logged off."""
+    agent_id = int(agent_id)
+    state_interface = _login_status.get(cursor).get(agent_id)
+    if state_interface is None:
+        # The agent may have logged in since the last refresh
+        cursor.query("SELECT ${columns} FROM agent_login_status WHERE agent_id = %s",
+                     ('state_interface',), (agent_id,))
+        row = cursor.fetchone()
+        if row:
+            state_interface = row['state_interface']
+    return state_interface
+
+
+def invalidate():
+    _login_status.invalidate()
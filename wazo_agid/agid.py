@@ -6,13 +6,18 @@ import signal
 import logging
 import SocketServer
 
-from threading import Lock
+from threading import Event, Lock, Thread, local
 
 from xivo import agitb
 from xivo import anysql
 from xivo import moresynchro
 from xivo.BackSQL import backpostgresql  # noqa
+from wazo_agid import cache
+from wazo_agid import circuit_breaker
+from wazo_agid import dao_cache
+from wazo_agid import dispatcher
 from wazo_agid import fastagi
+from wazo_agid import http_pools
 from xivo_dao.helpers.db_utils import session_scope
 
 
@@ -20,6 +25,11 @@ logger = logging.getLogger(__name__)
 
 _server = None
 _handlers = {}
+_ready = Event()
+_request = local()
+
+MEMOIZED_RESULTS_SIZE = 1024
+MEMOIZED_RESULTS_TTL = 10
 
 
 class DBConnectionPool(object):
@@ -27,6 +37,7 @@ class DBConnectionPool(object):
         self.conns = []
         self.size = 0
         self.db_uri = None
+        self.unreachable = False
         self.lock = Lock()
 
     def reload(self, size, db_uri):
@@ -42,15 +53,23 @@ class DBConnectionPool(object):
 
     def acquire(self):
         with self.lock:
-            try:
-                conn = self.conns.pop()
+            if self.conns:
                 logger.debug("acquiring connection: got connection from pool")
-            except IndexError:
-                conn = anysql.connect_by_uri(self.db_uri)
-                logger.debug("acquiring connection: pool empty, created new connection")
+                return self.conns.pop()
 
+        # Outside of the lock, connecting may be slow while the database is
+        # unreachable
+        conn = self._connect()
+        logger.debug("acquiring connection: pool empty, created new connection")
         return conn
 
+    def discard(self, conn):
+        try:
+            conn.close()
+        except cache.DB_CONNECTION_ERRORS:
+            pass
+        logger.debug("discarding connection: connection to the database failed")
+
     def release(self, conn):
         with self.lock:
             if len(self.conns) < self.size:
@@ -60,6 +79,20 @@ class DBConnectionPool(object):
                 conn.close()
                 logger.debug("releasing connection: pool full, connection closed")
 
+    def _connect(self):
+        try:
+            conn = anysql.connect_by_uri(self.db_uri)
+        except cache.DB_CONNECTION_ERRORS as e:
+            if not self.unreachable:
+                self.unreachable = True
+                logger.warning("database unreachable, handling requests in degraded mode: %s", e)
+            raise
+
+        if self.unreachable:
+            self.unreachable = False
+            logger.warning("database reachable again")
+        return conn
+
 
 class FastAGIRequestHandler(SocketServer.StreamRequestHandler):
 
@@ -70,21 +103,39 @@ class FastAGIRequestHandler(SocketServer.StreamRequestHandler):
             fagi = fastagi.FastAGI(self.rfile, self.wfile, self.config)
             except_hook = agitb.Hook(agi=fagi)
 
-            conn = self.server.db_conn_pool.acquire()
+            handler_name = fagi.env['agi_network_script']
             try:
-                cursor = conn.cursor()
+                conn = self.server.db_conn_pool.acquire()
+            except cache.DB_CONNECTION_ERRORS as e:
+                logger.debug("handling %r without database: %s", handler_name, e)
+                self._handle_without_database(fagi, handler_name, e)
+                return
 
-                handler_name = fagi.env['agi_network_script']
+            cursor = _TrackingCursor(conn.cursor())
+            try:
                 logger.debug("delegating request handling %r", handler_name)
 
+                dao_cache.start_request()
                 _handlers[handler_name].handle(fagi, cursor, fagi.args)
+                logger.debug("%r DAO calls: %s", handler_name, dao_cache.request_statistics())
 
-                conn.commit()
+                if cursor.connection_failed:
+                    # The handler recovered, e.g. from a stale snapshot, but
+                    # the connection is dead: there is nothing to commit
+                    logger.debug("%r handled on a failed connection, not committing", handler_name)
+                else:
+                    conn.commit()
 
                 fagi.verbose('AGI handler %r successfully executed' % handler_name)
                 logger.debug("request successfully handled")
+            except cache.DB_CONNECTION_ERRORS:
+                cursor.connection_failed = True
+                raise
             finally:
-                self.server.db_conn_pool.release(conn)
+                if cursor.connection_failed:
+                    self.server.db_conn_pool.discard(conn)
+                else:
+                    self.server.db_conn_pool.release(conn)
 
         # Attempt to relay errors to Asterisk, but if it fails, we
         # just give up.
@@ -113,6 +164,55 @@ class FastAGIRequestHandler(SocketServer.StreamRequestHandler):
             except Exception:
                 pass
 
+    def _handle_without_database(self, fagi, handler_name, error):
+        # Snapshots and last known results are served, other queries fail
+        # with the connection error and writes are skipped
+        _request.database_available = False
+        try:
+            dao_cache.start_request()
+            _handlers[handler_name].handle(fagi, _UnavailableCursor(error), fagi.args)
+        finally:
+            _request.database_available = True
+
+        fagi.verbose('AGI handler %r executed without database' % handler_name)
+        logger.debug("request handled without database")
+
+
+class _TrackingCursor(object):
+    """Forwards to a cursor, recording whether the connection failed.
+
+    Such errors may be handled by the caller, e.g. by serving a stale
+    snapshot, but the connection must not be used again.
+    """
+
+    def __init__(self, cursor):
+        self.connection_failed = False
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        attribute = getattr(self._cursor, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            try:
+                return attribute(*args, **kwargs)
+            except cache.DB_CONNECTION_ERRORS:
+                self.connection_failed = True
+                raise
+        return call
+
+
+class _UnavailableCursor(object):
+    """Cursor of a request handled while the database cannot be reached:
+    using it raises the connection error."""
+
+    def __init__(self, error):
+        self._error = error
+
+    def __getattr__(self, name):
+        raise self._error
+
 
 class AGID(SocketServer.ThreadingTCPServer):
     allow_reuse_address = True
@@ -150,10 +250,14 @@ class AGID(SocketServer.ThreadingTCPServer):
 
 
 class Handler(object):
-    def __init__(self, handler_name, setup_fn, handle_fn):
+    def __init__(self, handler_name, setup_fn, handle_fn, memoize=None):
         self.handler_name = handler_name
         self.setup_fn = setup_fn
         self.handle_fn = handle_fn
+        self.memoize = memoize
+        self.results = None
+        if memoize is not None:
+            self.results = cache.LRUCache(MEMOIZED_RESULTS_SIZE, ttl=MEMOIZED_RESULTS_TTL)
         self.lock = moresynchro.RWLock()
 
     def setup(self, cursor):
@@ -161,6 +265,11 @@ class Handler(object):
             self.setup_fn(cursor)
 
     def reload(self, cursor):
+        if self.results is not None:
+            logger.info('handler %r memoized results: %s hits, %s misses',
+                        self.handler_name, self.results.hits, self.results.misses)
+            self.results.clear()
+
         if self.setup_fn:
             if not self.lock.acquire_write():
                 logger.error("deadlock detected and avoided for %r", self.handler_name)
@@ -176,18 +285,84 @@ class Handler(object):
         self.lock.acquire_read()
         try:
             with session_scope():
-                self.handle_fn(agi, cursor, args)
+                if self.results is None:
+                    self.handle_fn(agi, cursor, args)
+                else:
+                    self._handle_memoized(agi, cursor, args)
         finally:
             self.lock.release()
 
-
-def register(handle_fn, setup_fn=None):
+    def _handle_memoized(self, agi, cursor, args):
+        values = tuple(agi.get_variable(name) for name in self.memoize)
+        key = (tuple(args), values)
+
+        outputs = self.results.get(key)
+        if outputs is not None:
+            for name, value in outputs:
+                agi.set_variable(name, value)
+            return
+
+        recorder = _RecordingAGI(agi, dict(zip(self.memoize, values)))
+        self.handle_fn(recorder, cursor, args)
+        if recorder.replayable:
+            self.results.set(key, recorder.outputs)
+        else:
+            logger.debug('handler %r result not memoized: %s', self.handler_name, recorder.reason)
+
+
+class _RecordingAGI(object):
+    """Forwards to an AGI, recording the variables set by a handler.
+
+    The outputs can be replayed only if the handler read no channel variable
+    other than its declared inputs, nothing from the AGI environment (caller
+    id, channel, ...) and sent no command other than SET VARIABLE and
+    VERBOSE.
+    """
+
+    _PASSTHROUGH = ('config', 'args', 'verbose', 'dp_break')
+
+    def __init__(self, agi, inputs):
+        self.outputs = []
+        self.replayable = True
+        self.reason = None
+        self._agi = agi
+        self._inputs = inputs
+
+    def get_variable(self, name):
+        if name in self._inputs:
+            return self._inputs[name]
+        self._not_replayable('undeclared input {}'.format(name))
+        return self._agi.get_variable(name)
+
+    def set_variable(self, name, value):
+        self.outputs.append((name, value))
+        self._agi.set_variable(name, value)
+
+    def __getattr__(self, name):
+        if name not in self._PASSTHROUGH:
+            self._not_replayable('call to {}'.format(name))
+        return getattr(self._agi, name)
+
+    def _not_replayable(self, reason):
+        self.replayable = False
+        self.reason = reason
+
+
+def register(handle_fn, setup_fn=None, memoize=None):
+    """Register an AGI handler.
+
+    A handler whose outputs only depend on its arguments and on the channel
+    variables listed in ``memoize`` can declare them: the variables it sets
+    are then cached for MEMOIZED_RESULTS_TTL seconds and replayed without
+    running it. The inputs are read on every call, hit or miss, so only
+    handlers whose queries cost more than these reads should declare them.
+    """
     handler_name = handle_fn.__name__
 
     if handler_name in _handlers:
         raise ValueError("handler %r already registered", handler_name)
 
-    _handlers[handler_name] = Handler(handler_name, setup_fn, handle_fn)
+    _handlers[handler_name] = Handler(handler_name, setup_fn, handle_fn, memoize)
 
 
 def sighup_handle(signum, frame):
@@ -202,7 +377,16 @@ def sighup_handle(signum, frame):
         for handler in _handlers.itervalues():
             handler.reload(cursor)
 
+        logger.debug("reloading snapshots")
+        cache.reload_snapshots(cursor)
+        cache.clear_negative_caches()
+        dao_cache.clear_all()
+        circuit_breaker.log_statistics()
+        http_pools.log_statistics()
+        dispatcher.log_statistics()
+
         conn.commit()
+        _ready.set()
         logger.debug("finished reload")
     finally:
         _server.db_conn_pool.release(conn)
@@ -222,9 +406,50 @@ def run():
     finally:
         _server.db_conn_pool.release(conn)
 
+    if _server.config.get('warm_up_in_background'):
+        # Requests are accepted right away, snapshots that are not warm
+        # yet are loaded by the first request that needs them
+        warm_up_thread = Thread(target=_warm_up_in_background, name='warm-up')
+        warm_up_thread.daemon = True
+        warm_up_thread.start()
+    else:
+        _warm_up()
+
     _server.serve_forever()
 
 
+def is_ready():
+    return _ready.is_set()
+
+
+def is_database_available():
+    """Returns False while handling a request without a database connection.
+
+    Handlers must then skip their writes.
+    """
+    return getattr(_request, 'database_available', True)
+
+
+def _warm_up():
+    logger.info("warming up caches")
+    conn = _server.db_conn_pool.acquire()
+    try:
+        cache.warm_up(conn.cursor())
+        conn.commit()
+    finally:
+        _server.db_conn_pool.release(conn)
+
+    _ready.set()
+    logger.info("wazo-agid is ready")
+
+
+def _warm_up_in_background():
+    try:
+        _warm_up()
+    except Exception:
+        logger.exception("cache warm-up failed, caches will be loaded on demand")
+
+
 def init(config):
     global _server
     _server = AGID(config)
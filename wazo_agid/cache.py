@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import logging
+import time
+
+from collections import OrderedDict
+from threading import Event, Lock
+
+from psycopg2 import InterfaceError, OperationalError
+
+logger = logging.getLogger(__name__)
+
+_snapshots = []
+_negative_caches = []
+_last_known_results = []
+_missing = object()
+
+# Errors raised when the database cannot be reached, either by psycopg2 or
+# wrapped by SQLAlchemy
+DB_CONNECTION_ERRORS = (OperationalError, InterfaceError)
+
+# When a refresh fails, e.g. during a database outage, the previous
+# content is served up to this age and the refresh is retried at most
+# every STALE_RETRY_DELAY seconds
+MAX_STALE_AGE = 600
+STALE_RETRY_DELAY = 5
+
+
+class LRUCache(object):
+    """Thread safe, size bounded cache with an optional time to live.
+
+    The least recently used entry is evicted when the cache is full.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires_at is not None and expires_at <= time.time():
+                self.misses += 1
+                return default
+
+            self._entries[key] = (value, expires_at)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires_at)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SingleFlight(object):
+    """Lets concurrent callers asking for the same key share one call."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = Lock()
+
+    def call(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            owner = call is None
+            if owner:
+                call = self._calls[key] = _Call()
+
+        if not owner:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class NegativeCache(object):
+    """Remembers, for a short time, the keys for which a lookup found nothing.
+
+    Each kind of lookup gets its own bounded cache. The number of lookups
+    answered from the cache is kept per kind in ``statistics()``.
+    """
+
+    def __init__(self, name, maxsize, ttl):
+        _negative_caches.append(self)
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._kinds = {}
+        self._lock = Lock()
+
+    def add(self, kind, key):
+        self._get_kind(kind).set(key, True)
+
+    def is_missing(self, kind, key):
+        return self._get_kind(kind).get(key, False)
+
+    def statistics(self):
+        return dict((kind, cache.hits) for kind, cache in self._kinds.items())
+
+    def clear(self):
+        for cache in self._kinds.values():
+            cache.clear()
+
+    def _get_kind(self, kind):
+        with self._lock:
+            if kind not in self._kinds:
+                self._kinds[kind] = LRUCache(self.maxsize, self.ttl)
+            return self._kinds[kind]
+
+
+class Snapshot(object):
+    """In-memory copy of some database content.
+
+    The content is built by ``load_fn(cursor)`` on first use, when
+    ``reload`` is called and once it is older than ``max_age`` seconds.
+    Every snapshot is also reloaded by ``reload_snapshots``, at startup and
+    when agid is reloaded.
+    While a thread rebuilds an existing snapshot, the other threads keep
+    reading the previous one.
+    ``version`` is incremented each time the content is rebuilt.
+
+    If a refresh fails because the database cannot be reached, the previous
+    content keeps being served, with ``stale`` set, until it is older than
+    ``MAX_STALE_AGE`` seconds. Other errors are raised.
+    """
+
+    def __init__(self, name, load_fn, max_age=None):
+        _snapshots.append(self)
+        self.name = name
+        self.max_age = max_age
+        self.loaded_at = None
+        self.version = 0
+        self.stale = False
+        self._expired = False
+        self._retry_at = None
+        self._load_fn = load_fn
+        self._value = None
+        self._lock = Lock()
+
+    def get(self, cursor):
+        if not self._is_stale():
+            return self._value
+
+        if self._lock.acquire(self._value is None):
+            try:
+                if self._is_stale():
+                    self._refresh(cursor)
+            finally:
+                self._lock.release()
+
+        return self._value
+
+    def reload(self, cursor):
+        with self._lock:
+            self._load(cursor)
+
+    def invalidate(self):
+        self._expired = True
+
+    def _refresh(self, cursor):
+        if self._value is None:
+            self._load(cursor)
+            return
+
+        try:
+            self._load(cursor)
+        except Exception as e:
+            age = time.time() - self.loaded_at
+            if not is_db_connection_error(e) or age >= MAX_STALE_AGE:
+                raise
+            if not self.stale:
+                logger.warning('%s snapshot could not be refreshed, serving data from %ds ago',
+                               self.name, age, exc_info=True)
+            self.stale = True
+            self._retry_at = time.time() + STALE_RETRY_DELAY
+
+    def _load(self, cursor):
+        self._value = self._load_fn(cursor)
+        self.loaded_at = time.time()
+        self.version += 1
+        self._expired = False
+        self._retry_at = None
+        if self.stale:
+            self.stale = False
+            logger.warning('%s snapshot refreshed, no longer serving stale data', self.name)
+        logger.debug('%s snapshot loaded (version %s)', self.name, self.version)
+
+    def _is_stale(self):
+        if self.loaded_at is None:
+            return True
+        if self._retry_at is not None and time.time() < self._retry_at:
+            return False
+        if self._expired:
+            return True
+        if self.max_age is None:
+            return False
+        return time.time() - self.loaded_at >= self.max_age
+
+
+class LastKnownResults(object):
+    """Remembers the last result of a database lookup, per key, to answer it
+    while the database cannot be reached.
+
+    ``get(key, fetch_fn)`` always calls ``fetch_fn``. If it fails because
+    the database cannot be reached, the last result fetched for ``key`` is
+    returned instead, with ``stale`` set, if it is less than
+    ``MAX_STALE_AGE`` seconds old. Results must not be modified by the
+    callers.
+    """
+
+    def __init__(self, name, maxsize):
+        _last_known_results.append(self)
+        self.name = name
+        self.stale = False
+        self._results = LRUCache(maxsize, ttl=MAX_STALE_AGE)
+
+    def get(self, key, fetch_fn):
+        try:
+            result = fetch_fn()
+        except Exception as e:
+            if not is_db_connection_error(e):
+                raise
+            result = self._results.get(key, _missing)
+            if result is _missing:
+                raise
+            if not self.stale:
+                logger.warning('database unreachable, serving last known %s', self.name)
+            self.stale = True
+            return result
+
+        self._results.set(key, result)
+        if self.stale:
+            self.stale = False
+            logger.warning('%s fetched again, no longer serving stale data', self.name)
+        return result
+
+
+def is_db_connection_error(exception):
+    return (isinstance(exception, DB_CONNECTION_ERRORS)
+            or isinstance(getattr(exception, 'orig', None), DB_CONNECTION_ERRORS))
+
+
+def stale_snapshots():
+    return [snapshot.name for snapshot in _snapshots if snapshot.stale]
+
+
+def stale_lookups():
+    return [results.name for results in _last_known_results if results.stale]
+
+
+def reload_snapshots(cursor):
+    for snapshot in _snapshots:
+        snapshot.reload(cursor)
+
+
+def warm_up(cursor):
+    total = len(_snapshots)
+    for position, snapshot in enumerate(_snapshots, 1):
+        started_at = time.time()
+        snapshot.reload(cursor)
+        logger.info('cache warm-up: %s snapshot loaded in %.2fs (%s/%s)',
+                    snapshot.name, time.time() - started_at, position, total)
+
+
+def clear_negative_caches():
+    for negative_cache in _negative_caches:
+        logger.info('%s unknown lookups suppressed: %s', negative_cache.name, negative_cache.statistics())
+        negative_cache.clear()
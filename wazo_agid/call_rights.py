@@ -1,15 +1,21 @@
 # -*- coding: utf-8 -*-
-# Copyright (C) 2006-2014 Avencall
+# Copyright 2006-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import logging
 import re
 
+from collections import defaultdict
+
+from wazo_agid.cache import LRUCache
+
 logger = logging.getLogger(__name__)
 
 RIGHTCALL_AUTHORIZATION_COLNAME = "rightcall.authorization"
 RIGHTCALL_PASSWD_COLNAME = "rightcall.passwd"
 
+DECISION_CACHE_SIZE = 4096
+
 rep = (('_', ''),
        ('*', '\*'),
        ('+', '\+'),
@@ -37,11 +43,15 @@ def deny(agi, password):
     raise RuleAppliedException()
 
 
-def extension_matches(number, pattern):
+def _pattern_to_regex(pattern):
     for (key, val) in rep:
         pattern = pattern.replace(key, val)
 
-    return bool(re.match("^%s$" % pattern, number))
+    return "^%s$" % pattern
+
+
+def extension_matches(number, pattern):
+    return bool(re.match(_pattern_to_regex(pattern), number))
 
 
 def apply_rules(agi, rules):
@@ -53,3 +63,137 @@ def apply_rules(agi, rules):
             allow(agi)
 
     deny(agi, rule[RIGHTCALL_PASSWD_COLNAME])
+
+
+def apply_decision(agi, decision):
+    authorization, password = decision
+    if authorization == 'ALLOW':
+        allow(agi)
+    deny(agi, password)
+
+
+class CallRightsTable(object):
+    """Precomputed call permissions.
+
+    Maps each user, group and outcall to the rightcall ids it is a member
+    of, along with the authorization and password of every enabled
+    rightcall, so that a decision can be taken without any query. The
+    decisions are memoized per (user, outcall, matched rightcalls).
+    """
+
+    ALLOW = ('ALLOW', None)
+
+    def __init__(self, extens, rightcalls, members, user_groups, user_rightcallcodes, outcall_ids):
+        self._extens = [(rightcall_id, re.compile(_pattern_to_regex(exten)))
+                        for rightcall_id, exten in extens]
+        self._rightcalls = rightcalls
+        self._members = members
+        self._user_groups = user_groups
+        self._user_rightcallcodes = user_rightcallcodes
+        self._outcall_ids = outcall_ids
+        self._decisions = LRUCache(DECISION_CACHE_SIZE)
+
+    @classmethod
+    def load(cls, cursor):
+        cursor.query("SELECT ${columns} FROM rightcallexten",
+                     ('rightcallid', 'exten'))
+        extens = [(row['rightcallid'], row['exten']) for row in cursor.fetchall()]
+
+        cursor.query("SELECT ${columns} FROM rightcall "
+                     "WHERE commented = 0",
+                     ('id', 'authorization', 'passwd'))
+        rightcalls = dict((row['id'], (row['authorization'], row['passwd']))
+                          for row in cursor.fetchall())
+
+        cursor.query("SELECT ${columns} FROM rightcallmember",
+                     ('rightcallid', 'type', 'typeval'))
+        members = defaultdict(set)
+        for row in cursor.fetchall():
+            members[(row['type'], row['typeval'])].add(row['rightcallid'])
+
+        cursor.query("SELECT ${columns} FROM groupfeatures "
+                     "INNER JOIN queuemember "
+                     "ON groupfeatures.name = queuemember.queue_name "
+                     "INNER JOIN queue "
+                     "ON queue.name = queuemember.queue_name "
+                     "WHERE queuemember.usertype = 'user' "
+                     "AND queuemember.category = 'group' "
+                     "AND queuemember.commented = 0 "
+                     "AND queue.category = 'group' "
+                     "AND queue.commented = 0",
+                     ('queuemember.userid', 'groupfeatures.id'))
+        user_groups = defaultdict(list)
+        for row in cursor.fetchall():
+            user_groups[row['queuemember.userid']].append(row['groupfeatures.id'])
+
+        cursor.query("SELECT ${columns} FROM userfeatures",
+                     ('id', 'rightcallcode'))
+        user_rightcallcodes = dict((row['id'], row['rightcallcode']) for row in cursor.fetchall())
+
+        cursor.query("SELECT ${columns} FROM outcall",
+                     ('id',))
+        outcall_ids = set(row['id'] for row in cursor.fetchall())
+
+        return cls(extens, rightcalls, dict(members), dict(user_groups), user_rightcallcodes, outcall_ids)
+
+    def has_user(self, user_id):
+        return user_id in self._user_rightcallcodes
+
+    def matching_rightcall_ids(self, number):
+        return frozenset(rightcall_id for rightcall_id, regex in self._extens
+                         if regex.match(number))
+
+    def decide(self, user_id, outcall_id, rightcall_ids):
+        if not rightcall_ids:
+            return self.ALLOW
+
+        key = (user_id, outcall_id, rightcall_ids)
+        decision = self._decisions.get(key)
+        if decision is None:
+            decision = self._decide(user_id, outcall_id, rightcall_ids)
+            self._decisions.set(key, decision)
+        return decision
+
+    def _decide(self, user_id, outcall_id, rightcall_ids):
+        if user_id is not None:
+            rightcallcode = self._user_rightcallcodes[user_id]
+            rules = self._find_rules(rightcall_ids, 'user', [user_id])
+            if rightcallcode:
+                rules = [(authorization, rightcallcode if password else password)
+                         for authorization, password in rules]
+            decision = self._evaluate(rules)
+            if decision:
+                return decision
+
+            group_ids = self._user_groups.get(user_id)
+            if group_ids:
+                decision = self._evaluate(self._find_rules(rightcall_ids, 'group', group_ids))
+                if decision:
+                    return decision
+        elif not outcall_id:
+            return self.ALLOW
+
+        if outcall_id and outcall_id in self._outcall_ids:
+            decision = self._evaluate(self._find_rules(rightcall_ids, 'outcall', [outcall_id]))
+            if decision:
+                return decision
+
+        return self.ALLOW
+
+    def _find_rules(self, rightcall_ids, member_type, member_ids):
+        matched_ids = set()
+        for member_id in member_ids:
+            matched_ids.update(self._members.get((member_type, str(member_id)), ()))
+        matched_ids &= rightcall_ids
+        return [self._rightcalls[rightcall_id] for rightcall_id in sorted(matched_ids)
+                if rightcall_id in self._rightcalls]
+
+    def _evaluate(self, rules):
+        if not rules:
+            return None
+
+        for authorization, password in rules:
+            if authorization:
+                return self.ALLOW
+
+        return ('DENY', password)
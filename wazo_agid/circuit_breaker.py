@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import logging
+import time
+
+from contextlib import contextmanager
+from threading import Lock
+
+from requests import ConnectionError, ConnectTimeout, HTTPError, RequestException
+from requests.packages.urllib3.exceptions import NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+DEFAULT_ERROR_THRESHOLD = 5
+DEFAULT_LATENCY_THRESHOLD = 2
+DEFAULT_RESET_TIMEOUT = 30
+
+_breakers = {}
+_breakers_lock = Lock()
+_settings = {}
+
+
+class CircuitBreakerOpen(RequestException):
+    """Raised instead of calling a service that is known to be failing.
+
+    It is a ``RequestException`` so that handlers already falling back when
+    a service is unreachable do the same when the breaker is open.
+    """
+
+    def __init__(self, service):
+        super(CircuitBreakerOpen, self).__init__('{} circuit breaker is open'.format(service))
+        self.service = service
+
+
+class CircuitBreaker(object):
+    """Stops calling a service after ``error_threshold`` consecutive failures.
+
+    A call fails when it raises a connection error, a timeout or a server
+    error, or when it takes more than ``latency_threshold`` seconds. Once
+    open, calls are rejected with ``CircuitBreakerOpen`` for
+    ``reset_timeout`` seconds, then a single probe call is let through: the
+    breaker closes if it succeeds and opens again otherwise.
+    """
+
+    def __init__(self, service,
+                 error_threshold=DEFAULT_ERROR_THRESHOLD,
+                 latency_threshold=DEFAULT_LATENCY_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.service = service
+        self.error_threshold = error_threshold
+        self.latency_threshold = latency_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.calls = 0
+        self.errors = 0
+        self.slow_calls = 0
+        self.rejected = 0
+        self.opened = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = Lock()
+
+    @contextmanager
+    def guard(self, is_failure=None):
+        is_failure = is_failure or is_transient_error
+        self._before_call()
+        started_at = time.time()
+        try:
+            yield
+        except Exception as e:
+            if is_failure(e):
+                self._on_failure('error: {}'.format(e))
+            else:
+                self._on_success(time.time() - started_at)
+            raise
+        else:
+            self._on_success(time.time() - started_at)
+
+    def statistics(self):
+        return {
+            'state': self.state,
+            'calls': self.calls,
+            'errors': self.errors,
+            'slow_calls': self.slow_calls,
+            'rejected': self.rejected,
+            'opened': self.opened,
+        }
+
+    def _before_call(self):
+        with self._lock:
+            if self.state == OPEN and time.time() - self._opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                logger.info('%s circuit breaker is half-open, probing the service', self.service)
+
+            if self.state == OPEN or (self.state == HALF_OPEN and self._probing):
+                self.rejected += 1
+                raise CircuitBreakerOpen(self.service)
+
+            if self.state == HALF_OPEN:
+                self._probing = True
+            self.calls += 1
+
+    def _on_success(self, duration):
+        if self.latency_threshold is not None and duration > self.latency_threshold:
+            with self._lock:
+                self.slow_calls += 1
+            self._on_failure('call took {:.2f}s'.format(duration))
+            return
+
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != CLOSED:
+                self.state = CLOSED
+                logger.warning('%s circuit breaker closed', self.service)
+
+    def _on_failure(self, reason):
+        with self._lock:
+            self.errors += 1
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.error_threshold):
+                self.state = OPEN
+                self.opened += 1
+                self._opened_at = time.time()
+                logger.warning('%s circuit breaker opened for %ss after %s failure(s), last %s',
+                               self.service, self.reset_timeout, self.failures, reason)
+
+
+def is_transient_error(exception):
+    if not isinstance(exception, RequestException):
+        return False
+    if isinstance(exception, HTTPError) and exception.response is not None:
+        return exception.response.status_code >= 500
+    return True
+
+
+def is_connection_failure(exception):
+    """Tells whether the request failed before it could reach the service."""
+    if isinstance(exception, (CircuitBreakerOpen, ConnectTimeout)):
+        return True
+    if isinstance(exception, ConnectionError) and exception.args:
+        return isinstance(getattr(exception.args[0], 'reason', None), NewConnectionError)
+    return False
+
+
+def configure(config):
+    """Sets the thresholds of the breakers from the ``circuit_breaker`` config.
+
+    The top-level keys apply to every service and a section named after a
+    service overrides them for that service.
+    """
+    with _breakers_lock:
+        _settings.clear()
+        _settings.update(config)
+        _breakers.clear()
+
+
+def get(service):
+    with _breakers_lock:
+        breaker = _breakers.get(service)
+        if breaker is None:
+            breaker = _breakers[service] = CircuitBreaker(service, **_service_settings(service))
+        return breaker
+
+
+def guard(service, is_failure=None):
+    """Guards a call to ``service``.
+
+    ``is_failure(exception)`` tells whether an error raised by the call is
+    a failure of the service, ``is_transient_error`` by default.
+    """
+    return get(service).guard(is_failure)
+
+
+def statistics():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return dict((breaker.service, breaker.statistics()) for breaker in breakers)
+
+
+def log_statistics():
+    for service, breaker_statistics in sorted(statistics().items()):
+        logger.info('%s circuit breaker: %s', service, breaker_statistics)
+
+
+def _service_settings(service):
+    settings = dict((key, value) for key, value in _settings.items() if not isinstance(value, dict))
+    settings.update(_settings.get(service) or {})
+    return settings
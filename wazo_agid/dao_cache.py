@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import logging
+
+from collections import namedtuple
+from threading import local
+
+from wazo_agid.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+_cached_functions = []
+_request = local()
+_missing = object()
+
+
+class CachedFunction(object):
+    """Caches the results of a function reading the database through xivo_dao.
+
+    Results are kept per arguments for ``ttl`` seconds, at most ``maxsize``
+    of them. ``freeze`` turns a result into a value that can be shared
+    between threads, e.g. a namedtuple built with ``frozen``, so that no
+    SQLAlchemy object outlives the session it was loaded in. Exceptions are
+    not cached.
+    """
+
+    def __init__(self, fn, maxsize, ttl, freeze=None):
+        _cached_functions.append(self)
+        self.name = fn.__name__
+        self._fn = fn
+        self._freeze = freeze
+        self._results = LRUCache(maxsize, ttl=ttl)
+
+    def __call__(self, *args):
+        result = self._results.get(args, _missing)
+        if result is not _missing:
+            _count('hits')
+            return result
+
+        _count('calls')
+        result = self._fn(*args)
+        if self._freeze is not None:
+            result = self._freeze(result)
+        self._results.set(args, result)
+        return result
+
+    def invalidate(self, *args):
+        self._results.invalidate(args)
+
+    def clear(self):
+        self._results.clear()
+
+    def statistics(self):
+        return {'hits': self._results.hits, 'misses': self._results.misses}
+
+
+def cached(maxsize, ttl, freeze=None):
+    def decorator(fn):
+        return CachedFunction(fn, maxsize, ttl, freeze)
+    return decorator
+
+
+def frozen(*attributes):
+    """Returns a ``freeze`` function copying ``attributes`` into a namedtuple."""
+    record_class = namedtuple('FrozenResult', attributes)
+
+    def freeze(result):
+        if result is None:
+            return None
+        return record_class(*[getattr(result, attribute) for attribute in attributes])
+    return freeze
+
+
+def start_request():
+    _request.calls = 0
+    _request.hits = 0
+
+
+def request_statistics():
+    return {'calls': getattr(_request, 'calls', 0), 'hits': getattr(_request, 'hits', 0)}
+
+
+def clear_all():
+    for cached_function in _cached_functions:
+        logger.info('%s cached results: %s', cached_function.name, cached_function.statistics())
+        cached_function.clear()
+
+
+def _count(counter):
+    setattr(_request, counter, getattr(_request, counter, 0) + 1)
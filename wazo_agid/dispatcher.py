@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import itertools
+import logging
+import time
+
+from Queue import Full, Queue
+from threading import Lock, Thread
+
+from wazo_agid.circuit_breaker import is_connection_failure, is_transient_error
+
+logger = logging.getLogger(__name__)
+dead_letter_logger = logging.getLogger('{}.dead_letter'.format(__name__))
+
+_dispatcher = None
+
+
+class Dispatcher(object):
+    """Runs side effects, e.g. REST requests whose result the dialplan does
+    not need, in background threads.
+
+    A job failing because a service is unreachable or answers with a server
+    error is retried up to ``max_attempts`` times, waiting ``backoff``, then
+    twice as long, and so on between attempts. A job that does not succeed
+    is logged to the dead letter logger. When ``queue_size`` jobs are
+    already waiting, a new job is run in the calling thread, slowing the
+    producers down instead of dropping it.
+
+    Each worker has its own queue. Jobs submitted with ``submit_ordered``
+    and the same key go to the same worker, so they run one at a time in
+    submission order.
+    """
+
+    def __init__(self, workers=2, queue_size=1000, max_attempts=3, backoff=1):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._queues = [Queue(max(1, queue_size // workers)) for _ in range(workers)]
+        self._next_queue = itertools.count()
+        self._counters = {'submitted': 0, 'completed': 0, 'retried': 0, 'failed': 0, 'run_inline': 0}
+        self._lock = Lock()
+        self._threads = [
+            Thread(target=self._work, args=(queue,), name='dispatcher-{}'.format(i))
+            for i, queue in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.daemon = True
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, name, fn, *args, **kwargs):
+        job = (name, fn, args, kwargs, is_transient_error)
+        queue = self._queues[next(self._next_queue) % len(self._queues)]
+        self._count('submitted')
+        try:
+            queue.put_nowait(job)
+        except Full:
+            logger.warning('dispatcher queue is full, running %s in the calling thread', name)
+            self._count('run_inline')
+            self._run(job, max_attempts=1)
+
+    def submit_ordered(self, key, name, fn, *args, **kwargs):
+        # Running the job in the calling thread could overtake the jobs
+        # already queued for the same key, so wait for some room instead
+        job = (name, fn, args, kwargs, is_connection_failure)
+        queue = self._queues[hash(key) % len(self._queues)]
+        self._count('submitted')
+        queue.put(job)
+
+    def statistics(self):
+        with self._lock:
+            statistics = dict(self._counters)
+        statistics['queued'] = sum(queue.qsize() for queue in self._queues)
+        return statistics
+
+    def _work(self, queue):
+        while True:
+            job = queue.get()
+            try:
+                self._run(job, self.max_attempts)
+            except Exception:
+                logger.exception('unexpected error in dispatcher worker')
+            finally:
+                queue.task_done()
+
+    def _run(self, job, max_attempts):
+        name, fn, args, kwargs, is_retryable = job
+        for attempt in range(1, max_attempts + 1):
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == max_attempts or not is_retryable(e):
+                    self._count('failed')
+                    dead_letter_logger.error('%s%r failed after %s attempt(s): %s', name, args, attempt, e)
+                    return
+                self._count('retried')
+                logger.info('%s failed (attempt %s/%s), retrying: %s', name, attempt, max_attempts, e)
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            else:
+                self._count('completed')
+                return
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+
+def start(config):
+    global _dispatcher
+    _dispatcher = Dispatcher(**config)
+    _dispatcher.start()
+
+
+def submit(name, fn, *args, **kwargs):
+    """Runs ``fn(*args, **kwargs)`` in the background, without waiting.
+
+    Until ``start`` is called, the job is run right away in the calling
+    thread.
+    """
+    if _dispatcher is None:
+        _run_inline(name, fn, args, kwargs)
+        return
+    _dispatcher.submit(name, fn, *args, **kwargs)
+
+
+def submit_ordered(key, name, fn, *args, **kwargs):
+    """Like ``submit``, for jobs that must not be reordered or repeated.
+
+    The jobs sharing ``key`` run one at a time, in submission order. As the
+    request may not be idempotent, a job is only retried when its request
+    could not reach the service, e.g. not after a read timeout.
+    """
+    if _dispatcher is None:
+        _run_inline(name, fn, args, kwargs)
+        return
+    _dispatcher.submit_ordered(key, name, fn, *args, **kwargs)
+
+
+def _run_inline(name, fn, args, kwargs):
+    try:
+        fn(*args, **kwargs)
+    except Exception as e:
+        dead_letter_logger.error('%s%r failed: %s', name, args, e)
+
+
+def log_statistics():
+    if _dispatcher is not None:
+        logger.info('dispatcher: %s', _dispatcher.statistics())
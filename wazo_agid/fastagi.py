@@ -127,9 +127,22 @@ class FastAGI(object):
     def dp_break(message):
         raise FastAGIDialPlanBreak(message)
 
+    @staticmethod
+    def encode_command(command, *args):
+        return ' '.join([command.strip()] + map(str, args)).strip() + "\n"
+
+    @classmethod
+    def encode_set_variable(cls, name, value):
+        return cls.encode_command('SET VARIABLE', cls._quote(name), cls._quote(value))
+
     def execute(self, command, *args):
+        return self.execute_encoded(self.encode_command(command, *args))
+
+    def execute_encoded(self, encoded_command):
+        """Send a command encoded by encode_command and read its result"""
         try:
-            self.send_command(command, *args)
+            self.outf.write(encoded_command)
+            self.outf.flush()
             return self.get_result()
         except IOError as e:
             if e.errno == 32:
@@ -140,8 +153,7 @@ class FastAGI(object):
 
     def send_command(self, command, *args):
         """Send a command to Asterisk"""
-        command = ' '.join([command.strip()] + map(str, args)).strip() + "\n"
-        self.outf.write(command)
+        self.outf.write(self.encode_command(command, *args))
         self.outf.flush()
 
     def fail(self):
@@ -495,7 +507,7 @@ class FastAGI(object):
     def set_variable(self, name, value):
         """Set a channel variable.
         """
-        self.execute('SET VARIABLE', self._quote(name), self._quote(value))
+        self.execute_encoded(self.encode_set_variable(name, value))
 
     def get_variable(self, name):
         """Get a channel variable.
@@ -1,17 +1,34 @@
 # -*- coding: utf-8 -*-
-# Copyright 2012-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2012-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 from wazo_agentd_client import error
 from wazo_agentd_client.error import AgentdClientError
 
+from wazo_agid import agent_status
+from wazo_agid import circuit_breaker
+from wazo_agid import routing
+
 AGENTSTATUS_VAR = 'XIVO_AGENTSTATUS'
 
+# wazo-agentd-client raises AgentdClientError for the error responses
+# carrying an error message, without their status code. The messages it
+# defines are client errors, any other one is a failure of wazo-agentd.
+_CLIENT_ERRORS = frozenset(value for name, value in vars(error).items()
+                           if name.isupper() and isinstance(value, basestring))
+
+
+def _is_agentd_failure(exception):
+    if isinstance(exception, AgentdClientError):
+        return exception.error not in _CLIENT_ERRORS
+    return circuit_breaker.is_transient_error(exception)
+
 
 def login_agent(agi, agent_id, extension, context, tenant_uuid):
     agentd_client = agi.config['agentd']['client']
     try:
-        agentd_client.agents.login_agent(agent_id, extension, context, tenant_uuid=tenant_uuid)
+        with circuit_breaker.guard('agentd', _is_agentd_failure):
+            agentd_client.agents.login_agent(agent_id, extension, context, tenant_uuid=tenant_uuid)
     except AgentdClientError as e:
         if e.error == error.ALREADY_LOGGED:
             agi.set_variable(AGENTSTATUS_VAR, 'already_logged')
@@ -20,20 +37,31 @@ def login_agent(agi, agent_id, extension, context, tenant_uuid):
         else:
             raise
     else:
+        agent_status.invalidate()
         agi.set_variable(AGENTSTATUS_VAR, 'logged')
 
 
 def logoff_agent(agi, agent_id, tenant_uuid):
     agentd_client = agi.config['agentd']['client']
     try:
-        agentd_client.agents.logoff_agent(agent_id, tenant_uuid=tenant_uuid)
+        with circuit_breaker.guard('agentd', _is_agentd_failure):
+            agentd_client.agents.logoff_agent(agent_id, tenant_uuid=tenant_uuid)
     except AgentdClientError as e:
         if e.error != error.NOT_LOGGED:
             raise
+    else:
+        agent_status.invalidate()
 
 
-def get_agent_status(agi, agent_id, tenant_uuid):
-    agentd_client = agi.config['agentd']['client']
-    status = agentd_client.agents.get_agent_status(agent_id, tenant_uuid=tenant_uuid)
-    login_status = 'logged_in' if status.logged else 'logged_out'
+def get_agent_status(agi, cursor, agent_id, tenant_uuid):
+    agent = routing.find_agent(cursor, agent_id=agent_id)
+    if agent is not None and agent.tenant_uuid == tenant_uuid:
+        logged = agent_status.find_state_interface(cursor, agent_id) is not None
+    else:
+        # Let wazo-agentd report the unknown agent
+        agentd_client = agi.config['agentd']['client']
+        with circuit_breaker.guard('agentd', _is_agentd_failure):
+            status = agentd_client.agents.get_agent_status(agent_id, tenant_uuid=tenant_uuid)
+        logged = status.logged
+    login_status = 'logged_in' if logged else 'logged_out'
     agi.set_variable('XIVO_AGENT_LOGIN_STATUS', login_status)
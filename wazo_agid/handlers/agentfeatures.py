@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
-# Copyright 2013-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2013-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import re
 
+from wazo_agid import agent_status
 from wazo_agid import objects
 from wazo_agid.handlers.handler import Handler
 
@@ -36,12 +37,9 @@ class AgentFeatures(Handler):
         self._agi.set_variable('XIVO_AGENT_INTERFACE', device)
 
     def _get_agent_device(self):
-        self._cursor.query('SELECT state_interface FROM agent_login_status WHERE agent_id  = %s',
-                           parameters=(self.agent_id,))
-        res = self._cursor.fetchone()
-        if not res:
+        device = agent_status.find_state_interface(self._cursor, self.agent_id)
+        if device is None:
             raise LookupError('Unable to find agent (id: %s)' % self.agent_id)
-        device = res[0]
         # TODO clean after pjsip migration
         if device.startswith('SIP/'):
             device = device.replace('SIP', 'PJSIP')
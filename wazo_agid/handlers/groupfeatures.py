@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
-# Copyright 2012-2020 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2012-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 from wazo_agid.handlers.handler import Handler
 from wazo_agid import objects
 from wazo_agid import dialplan_variables
+from wazo_agid import routing
 
 
 class GroupFeatures(Handler):
@@ -43,46 +44,23 @@ class GroupFeatures(Handler):
         self._id = int(self._agi.get_variable(dialplan_variables.DESTINATION_ID))
         self._referer = self._agi.get_variable(dialplan_variables.FWD_REFERER)
 
-        groupfeatures_columns = ('id', 'name',
-                                 'timeout', 'transfer_user', 'transfer_call',
-                                 'write_caller', 'write_calling', 'ignore_forward',
-                                 'preprocess_subroutine', 'mark_answered_elsewhere')
-        queue_columns = ('musicclass',)
-        extensions_columns = ('exten', 'context')
-        columns = (
-            ["groupfeatures." + c for c in groupfeatures_columns] +
-            ["queue." + c for c in queue_columns] +
-            ["extensions." + c for c in extensions_columns]
-        )
-
-        self._cursor.query("SELECT ${columns} FROM groupfeatures "
-                           "INNER JOIN queue "
-                           "ON groupfeatures.name = queue.name "
-                           "LEFT JOIN extensions "
-                           "ON groupfeatures.id::text = extensions.typeval "
-                           "AND extensions.type = 'group' "
-                           "WHERE groupfeatures.id = %s "
-                           "AND queue.category = 'group' "
-                           "AND queue.commented = 0",
-                           columns,
-                           (self._id,))
-        res = self._cursor.fetchone()
+        res = routing.find_group(self._cursor, self._id)
 
         if not res:
             raise LookupError("Unable to find group (id: %s)" % (self._id))
 
-        self._exten = res['extensions.exten']
-        self._context = res['extensions.context']
-        self._name = res['groupfeatures.name']
-        self._timeout = res['groupfeatures.timeout']
-        self._transfer_user = res['groupfeatures.transfer_user']
-        self._transfer_call = res['groupfeatures.transfer_call']
-        self._write_caller = res['groupfeatures.write_caller']
-        self._write_calling = res['groupfeatures.write_calling']
-        self._ignore_forward = res['groupfeatures.ignore_forward']
-        self._preprocess_subroutine = res['groupfeatures.preprocess_subroutine']
-        self._musicclass = res['queue.musicclass']
-        self._mark_answered_elsewhere = res['groupfeatures.mark_answered_elsewhere']
+        self._exten = res.exten
+        self._context = res.context
+        self._name = res.name
+        self._timeout = res.timeout
+        self._transfer_user = res.transfer_user
+        self._transfer_call = res.transfer_call
+        self._write_caller = res.write_caller
+        self._write_calling = res.write_calling
+        self._ignore_forward = res.ignore_forward
+        self._preprocess_subroutine = res.preprocess_subroutine
+        self._musicclass = res.musicclass
+        self._mark_answered_elsewhere = res.mark_answered_elsewhere
 
     def _set_vars(self):
         self._agi.set_variable('XIVO_REAL_NUMBER', self._exten)
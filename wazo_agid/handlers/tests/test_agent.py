@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
-# Copyright 2015-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2015-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import unittest
 
-from mock import ANY, Mock
+from mock import ANY, Mock, patch, sentinel
+from requests import ConnectionError
 from wazo_agentd_client import error
 from wazo_agentd_client.error import AgentdClientError
 from wazo_agid.fastagi import FastAGI
@@ -50,6 +51,13 @@ class TestAgent(unittest.TestCase):
 
         self.assertRaises(AgentdClientError, agent.login_agent, self.agi, self.agent_id, self.extension, self.context, tenant_uuid=self.tenant)
 
+    def test_agentd_failures(self):
+        self.assertFalse(agent._is_agentd_failure(AgentdClientError(error.ALREADY_LOGGED)))
+        self.assertFalse(agent._is_agentd_failure(AgentdClientError(error.NOT_LOGGED)))
+        self.assertTrue(agent._is_agentd_failure(AgentdClientError('internal server error')))
+        self.assertTrue(agent._is_agentd_failure(ConnectionError()))
+        self.assertFalse(agent._is_agentd_failure(ValueError()))
+
     def test_logoff_agent(self):
         agent.logoff_agent(self.agi, self.agent_id, tenant_uuid=self.tenant)
 
@@ -65,8 +73,23 @@ class TestAgent(unittest.TestCase):
 
         self.assertRaises(AgentdClientError, agent.logoff_agent, self.agi, self.agent_id, tenant_uuid=self.tenant)
 
-    def test_get_agent_status(self):
-        agent.get_agent_status(self.agi, self.agent_id, tenant_uuid=self.tenant)
+    @patch('wazo_agid.handlers.agent.routing')
+    def test_get_agent_status(self, routing):
+        routing.find_agent.return_value = None
+
+        agent.get_agent_status(self.agi, sentinel.cursor, self.agent_id, tenant_uuid=self.tenant)
 
         self.agentd_client.agents.get_agent_status.assert_called_once_with(self.agent_id, tenant_uuid=self.tenant)
         self.agi.set_variable.assert_called_once_with('XIVO_AGENT_LOGIN_STATUS', ANY)
+
+    @patch('wazo_agid.handlers.agent.agent_status')
+    @patch('wazo_agid.handlers.agent.routing')
+    def test_get_agent_status_of_known_agent(self, routing, agent_status):
+        routing.find_agent.return_value = Mock(tenant_uuid=self.tenant)
+        agent_status.find_state_interface.return_value = 'PJSIP/abcd'
+
+        agent.get_agent_status(self.agi, sentinel.cursor, self.agent_id, tenant_uuid=self.tenant)
+
+        agent_status.find_state_interface.assert_called_once_with(sentinel.cursor, self.agent_id)
+        self.agentd_client.agents.get_agent_status.assert_not_called()
+        self.agi.set_variable.assert_called_once_with('XIVO_AGENT_LOGIN_STATUS', 'logged_in')
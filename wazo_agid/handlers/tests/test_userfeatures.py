@@ -4,12 +4,16 @@
 
 import unittest
 
+from threading import BoundedSemaphore
+
 from hamcrest import assert_that
 from hamcrest import contains
 from hamcrest import equal_to
 
 from mock import Mock, call, patch, sentinel
 
+from wazo_agid.cache import LRUCache
+from wazo_agid.fastagi import FastAGI
 from wazo_agid.handlers.userfeatures import UserFeatures, requests
 from wazo_agid import objects
 
@@ -117,6 +121,59 @@ class TestUserFeatures(_BaseTestCase):
         assert_that(result, equal_to(True))
         self._agi.set_variable.called_once_with('WAZO_MOBILE_CONNECTION', True)
 
+    @patch('wazo_agid.handlers.userfeatures._mobile_connections', LRUCache(10))
+    def test_has_mobile_connection_is_cached_per_user(self):
+        userfeatures = UserFeatures(self._agi, self._cursor, self._args)
+        auth = userfeatures.auth_client = Mock()
+        auth.token.list.return_value = {'items': [], 'filtered': 0, 'total': 42}
+        auth.users.get_sessions.return_value = {'items': [{'mobile': True}]}
+        userfeatures._user = Mock(uuid='user-uuid')
+
+        userfeatures._has_mobile_connection()
+        result = userfeatures._has_mobile_connection()
+
+        assert_that(result, equal_to(True))
+        auth.token.list.assert_called_once_with('user-uuid', mobile=True)
+        auth.users.get_sessions.assert_called_once_with('user-uuid')
+
+    @patch('wazo_agid.handlers.userfeatures._mobile_connections', LRUCache(10))
+    def test_has_mobile_connection_is_not_cached_on_error(self):
+        userfeatures = UserFeatures(self._agi, self._cursor, self._args)
+        auth = userfeatures.auth_client = Mock()
+        auth.token.list.side_effect = requests.HTTPError
+        auth.users.get_sessions.return_value = {'items': []}
+        userfeatures._user = Mock(uuid='user-uuid')
+
+        userfeatures._has_mobile_connection()
+        userfeatures._has_mobile_connection()
+
+        assert_that(auth.token.list.call_count, equal_to(2))
+
+    @patch('wazo_agid.handlers.userfeatures._mobile_sessions_threads', BoundedSemaphore(0))
+    def test_sessions_fetched_after_the_tokens_without_free_thread(self):
+        userfeatures = UserFeatures(self._agi, self._cursor, self._args)
+        auth = userfeatures.auth_client = Mock()
+        auth.token.list.return_value = {'items': [], 'filtered': 0, 'total': 42}
+        auth.users.get_sessions.return_value = {'items': [{'mobile': True}]}
+        userfeatures._user = Mock()
+
+        result = userfeatures._has_mobile_connection()
+
+        assert_that(result, equal_to(True))
+        auth.users.get_sessions.assert_called_once_with(userfeatures._user.uuid)
+
+    @patch('wazo_agid.handlers.userfeatures._mobile_sessions_threads', BoundedSemaphore(0))
+    def test_sessions_not_fetched_without_free_thread_when_a_token_is_mobile(self):
+        userfeatures = UserFeatures(self._agi, self._cursor, self._args)
+        auth = userfeatures.auth_client = Mock()
+        auth.token.list.return_value = {'items': [{'mobile': True}], 'filtered': 1, 'total': 42}
+        userfeatures._user = Mock()
+
+        result = userfeatures._has_mobile_connection()
+
+        assert_that(result, equal_to(True))
+        auth.users.get_sessions.assert_not_called()
+
     def test_set_members(self):
         userfeatures = UserFeatures(self._agi, self._cursor, self._args)
         userfeatures._set_caller = Mock()
@@ -199,31 +256,67 @@ class TestUserFeatures(_BaseTestCase):
         userfeatures._set_call_record_enabled()
         self._agi.set_variable.assert_called_once_with('WAZO_CALL_RECORD_ENABLED', '1')
 
-    @patch('wazo_agid.handlers.userfeatures.extension_dao')
-    @patch('wazo_agid.handlers.userfeatures.line_extension_dao')
-    @patch('wazo_agid.handlers.userfeatures.line_dao')
-    @patch('wazo_agid.handlers.userfeatures.user_line_dao')
-    def test_set_line(self, user_line_dao, line_dao, line_extension_dao, extension_dao):
+    @patch('wazo_agid.handlers.userfeatures.routing')
+    def test_set_line(self, routing):
         userfeatures = UserFeatures(self._agi, self._cursor, self._args)
 
         userfeatures._set_line()
         self.assertEqual(userfeatures.lines, [])
 
         userfeatures._dstid = self._variables['XIVO_DSTID']
-        user_lines = [Mock(user_id=1, line_id=10)]
         line = Mock(main_line=True)
-        extension = Mock(exten='1234')
+        extension = Mock(id=100, exten='1234')
 
-        user_line_dao.find_all_by.return_value = user_lines
-        line_dao.find_by.return_value = line
-        line_extension_dao.find_all_by.return_value = [Mock(extension_id=100)]
-        extension_dao.get_by.return_value = extension
+        routing.find_callee_lines.return_value = line, extension, [line]
 
         userfeatures._set_line()
 
+        routing.find_callee_lines.assert_called_once_with(self._cursor, userfeatures._dstid, None)
         self.assertEqual([line], userfeatures.lines)
         self.assertEqual(extension, userfeatures.main_extension)
         self.assertEqual(line, userfeatures.main_line)
+        self.assertEqual(100, userfeatures._destination_extension_id)
+
+    @patch('wazo_agid.handlers.userfeatures.routing')
+    def test_set_line_no_main_line(self, routing):
+        userfeatures = UserFeatures(self._agi, self._cursor, self._args)
+        userfeatures._dstid = self._variables['XIVO_DSTID']
+
+        routing.find_callee_lines.return_value = None, None, []
+
+        userfeatures._set_line()
+
+        self._agi.dp_break.assert_called_once_with('Unable to find main line of user (id: 33)')
+
+    @patch('wazo_agid.handlers.userfeatures._callee_variables', LRUCache(10))
+    @patch('wazo_agid.objects.DialAction')
+    def test_set_callee_variables_rendered_once(self, DialAction):
+        DialAction.return_value.action = 'none'
+        userfeatures = UserFeatures(self._agi, self._cursor, self._args)
+        userfeatures.main_extension = Mock(context='default')
+        userfeatures._user = Mock(
+            id=33,
+            simultcalls=5,
+            ringseconds=30,
+            enablednd=0,
+            enablevoicemail=0,
+            vmbox=None,
+            enableunc=0,
+            enablerna=0,
+            enablebusy=0,
+            musiconhold='',
+            preprocess_subroutine=None,
+            mobilephonenumber='',
+        )
+
+        userfeatures._set_callee_variables()
+        userfeatures._set_callee_variables()
+
+        self.assertEqual(DialAction.call_count, 4)
+        commands = self._agi.execute_encoded.call_args_list
+        self.assertEqual(commands[:len(commands) // 2], commands[len(commands) // 2:])
+        self.assertIn(call(FastAGI.encode_set_variable('XIVO_SIMULTCALLS', 5)), commands)
+        self._agi.set_variable.assert_not_called()
 
     def test_set_user(self):
         userfeatures = UserFeatures(self._agi, self._cursor, self._args)
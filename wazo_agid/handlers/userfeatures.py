@@ -6,22 +6,83 @@ import logging
 import time
 import requests
 
-from xivo_dao import callfilter_dao, context_dao, user_line_dao as old_user_line_dao
-
-from xivo_dao.resources.user_line import dao as user_line_dao
-from xivo_dao.resources.line import dao as line_dao
-from xivo_dao.resources.line_extension import dao as line_extension_dao
-from xivo_dao.resources.extension import dao as extension_dao
+from functools import partial
+from threading import BoundedSemaphore, Thread
+from xivo_dao import callfilter_dao, context_dao
 
+from wazo_agid.cache import LRUCache
+from wazo_agid.circuit_breaker import CircuitBreakerOpen
+from wazo_agid.fastagi import FastAGI
 from wazo_agid.helpers import CallRecordingNameGenerator
 from wazo_agid.objects import DialAction, CallerID
 from wazo_agid.handlers.handler import Handler
+from wazo_agid import circuit_breaker
 from wazo_agid import objects
 from wazo_agid import dialplan_variables
+from wazo_agid import routing
 from wazo_agid.helpers import is_registered_and_mobile, is_webrtc
 
 logger = logging.getLogger(__name__)
 
+CALLEE_VARIABLES_SIZE = 4096
+CALLEE_VARIABLES_TTL = 30
+
+_callee_variables = LRUCache(CALLEE_VARIABLES_SIZE, ttl=CALLEE_VARIABLES_TTL)
+
+MOBILE_CONNECTIONS_SIZE = 4096
+MOBILE_CONNECTIONS_TTL = 10
+
+_mobile_connections = LRUCache(MOBILE_CONNECTIONS_SIZE, ttl=MOBILE_CONNECTIONS_TTL)
+
+# At most this many sessions lookups run in the background, the others are
+# run after the tokens lookup
+MOBILE_SESSIONS_THREADS = 4
+
+_mobile_sessions_threads = BoundedSemaphore(MOBILE_SESSIONS_THREADS)
+
+
+class _VariableRecorder(object):
+
+    def __init__(self):
+        self.variables = []
+
+    def set_variable(self, name, value):
+        self.variables.append((name, value))
+
+
+class _BackgroundCall(Thread):
+    """Runs a function in a thread holding one of the ``slots``."""
+
+    def __init__(self, slots, fn, *args):
+        super(_BackgroundCall, self).__init__()
+        self.daemon = True
+        self._slots = slots
+        self._fn = fn
+        self._args = args
+        self._result = None
+        self._error = None
+        self.start()
+
+    @classmethod
+    def start_if_available(cls, slots, fn, *args):
+        if not slots.acquire(False):
+            return None
+        return cls(slots, fn, *args)
+
+    def run(self):
+        try:
+            self._result = self._fn(*self._args)
+        except Exception as e:
+            self._error = e
+        finally:
+            self._slots.release()
+
+    def get(self):
+        self.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
 
 class UserFeatures(Handler):
 
@@ -58,22 +119,66 @@ class UserFeatures(Handler):
             return
 
         self._set_options()
-        self._set_simultcalls()
-        self._set_ringseconds()
-        self._set_enablednd()
-        self._set_mailbox()
-        self._set_call_forwards()
-        self._set_dial_action_congestion()
-        self._set_dial_action_chanunavail()
-        self._set_music_on_hold()
+        self._set_callee_variables()
         self._set_call_record_enabled()
         self._set_call_recordfile()
-        self._set_preprocess_subroutine()
-        self._set_mobile_number()
         self._set_vmbox_lang()
         self._set_video_enabled()
         self._set_path(UserFeatures.PATH_TYPE, self._user.id)
 
+    def _set_callee_variables(self):
+        key = self._get_callee_variables_key()
+        commands = _callee_variables.get(key)
+        if commands is None:
+            commands = self._render_callee_variables()
+            _callee_variables.set(key, commands)
+
+        for command in commands:
+            self._agi.execute_encoded(command)
+
+    def _render_callee_variables(self):
+        # Variables that only depend on the callee, encoded once and sent
+        # as is on the next calls
+        agi, self._agi = self._agi, _VariableRecorder()
+        try:
+            self._set_simultcalls()
+            self._set_ringseconds()
+            self._set_enablednd()
+            self._set_mailbox()
+            self._set_call_forwards()
+            self._set_dial_action_congestion()
+            self._set_dial_action_chanunavail()
+            self._set_music_on_hold()
+            self._set_preprocess_subroutine()
+            self._set_mobile_number()
+            variables = self._agi.variables
+        finally:
+            self._agi = agi
+
+        return tuple(FastAGI.encode_set_variable(name, value) for name, value in variables)
+
+    def _get_callee_variables_key(self):
+        user = self._user
+        vmbox = user.vmbox
+        return (
+            user.id,
+            self.main_extension.context,
+            user.simultcalls,
+            user.ringseconds,
+            user.enablednd,
+            user.enablevoicemail,
+            (vmbox.mailbox, vmbox.context, vmbox.email) if vmbox else None,
+            user.enableunc,
+            user.destunc,
+            user.enablerna,
+            user.destrna,
+            user.enablebusy,
+            user.destbusy,
+            user.musiconhold,
+            user.preprocess_subroutine,
+            user.mobilephonenumber,
+        )
+
     def _set_members(self):
         self._userid = self._agi.get_variable(dialplan_variables.USERID)
         self._dstid = self._agi.get_variable(dialplan_variables.DESTINATION_ID)
@@ -96,22 +201,14 @@ class UserFeatures(Handler):
     def _set_line(self):
         if self._dstid:
             try:
-                user_main_line = user_line_dao.get_by(user_id=self._dstid, main_line=True)
-                self.main_line = line_dao.find_by(id=user_main_line.line_id)  # XXX Should use get_by
-
-                # destination_extension_id may be unset (e.g. incoming call)
-                # In this case, only the main extension of the main line should be rung
-                if not self._destination_extension_id:
-                    line_extension = line_extension_dao.get_by(line_id=self.main_line.id)  # main_extension=True
-                    self._destination_extension_id = line_extension.extension_id
-
-                self.main_extension = extension_dao.get_by(id=self._destination_extension_id)
-
-                line_extensions = line_extension_dao.find_all_by(extension_id=self.main_extension.id)
-                for line_extension in line_extensions:
-                    line = line_dao.find_by(id=line_extension.line_id)  # XXX Should use get_by
-                    self.lines.append(line)
-
+                self.main_line, self.main_extension, self.lines = routing.find_callee_lines(
+                    self._cursor, self._dstid, self._destination_extension_id,
+                )
+                if not self.main_line:
+                    raise LookupError("Unable to find main line of user (id: %s)" % (self._dstid,))
+                if not self.main_extension:
+                    raise LookupError("Unable to find extension (id: %s)" % (self._destination_extension_id,))
+                self._destination_extension_id = self.main_extension.id
             except (ValueError, LookupError) as e:
                 self._agi.dp_break(str(e))
             else:
@@ -195,8 +292,8 @@ class UserFeatures(Handler):
         caller = self._caller
         called = self._user
 
-        boss_callfiltermember = callfilter_dao.find_boss(called.id)
-        if not boss_callfiltermember:
+        boss_call_filter = objects.BossCallFilter.find(self._cursor, called.id)
+        if not boss_call_filter:
             logger.debug('Ignoring callfilter: No boss')
             return False
 
@@ -206,14 +303,12 @@ class UserFeatures(Handler):
                 logger.debug('Ignoring callfilter: secretary can call boss')
                 return False
 
-        callfilter = callfilter_dao.find(boss_callfiltermember.callfilterid)
+        callfilter = boss_call_filter.callfilter
         if not callfilter:
-            logger.debug('Ignoring callfilter: no such callfilter: "%s"', boss_callfiltermember.callfilterid)
+            logger.debug('Ignoring callfilter: no such callfilter')
             return False
 
-        callfilter_active = callfilter_dao.is_activated_by_callfilter_id(boss_callfiltermember.callfilterid)
-
-        if callfilter_active == 0:
+        if boss_call_filter.active == 0:
             logger.debug('Ignoring callfilter: callfilter is not active')
             return False
 
@@ -222,8 +317,6 @@ class UserFeatures(Handler):
             logger.debug('Ignoring callfilter: call not in zone')
             return False
 
-        secretaries = callfilter_dao.get_secretaries_by_callfiltermember_id(boss_callfiltermember.callfilterid)
-
         boss_line = self.main_line
         protocol = boss_line.protocol.upper()
         # TODO PJSIP migration
@@ -233,25 +326,15 @@ class UserFeatures(Handler):
 
         if callfilter.bosssecretary in ("bossfirst-simult", "bossfirst-serial", "all"):
             self._agi.set_variable('XIVO_CALLFILTER_BOSS_INTERFACE', boss_interface)
-            self._set_callfilter_ringseconds('BOSS_TIMEOUT', boss_callfiltermember.ringseconds)
+            self._set_callfilter_ringseconds('BOSS_TIMEOUT', boss_call_filter.boss_ringseconds)
 
-        index = 0
         ifaces = []
-        for secretary in secretaries:
-            secretary_callfiltermember, ringseconds = secretary
-            if secretary_callfiltermember.active:
-                iface = old_user_line_dao.get_line_identity_by_user_id(secretary_callfiltermember.typeval)
-                # TODO PJSIP migration
-                if iface.startswith('SIP'):
-                    iface = 'PJ{}'.format(iface)
-                if iface.startswith('sip'):
-                    iface = 'pj{}'.format(iface)
-                ifaces.append(iface)
-
-                if callfilter.bosssecretary in ("bossfirst-serial", "secretary-serial"):
-                    self._agi.set_variable('XIVO_CALLFILTER_SECRETARY%d_INTERFACE' % index, iface)
-                    self._set_callfilter_ringseconds('SECRETARY%d_TIMEOUT' % index, ringseconds)
-                    index += 1
+        for index, (iface, ringseconds) in enumerate(boss_call_filter.secretaries):
+            ifaces.append(iface)
+
+            if callfilter.bosssecretary in ("bossfirst-serial", "secretary-serial"):
+                self._agi.set_variable('XIVO_CALLFILTER_SECRETARY%d_INTERFACE' % index, iface)
+                self._set_callfilter_ringseconds('SECRETARY%d_TIMEOUT' % index, ringseconds)
 
         if callfilter.bosssecretary in ("bossfirst-simult", "secretary-simult", "all"):
             self._agi.set_variable('XIVO_CALLFILTER_INTERFACE', '&'.join(ifaces))
@@ -334,11 +417,17 @@ class UserFeatures(Handler):
             'local_time': time.asctime(time.localtime()),
             'utc_time': time.asctime(time.gmtime()),
             'base_context': self._context,
-            'tenant_uuid': context_dao.get(self._context).tenant_uuid,
+            'tenant_uuid': self._get_context_tenant_uuid(),
         }
         callrecordfile = self._call_recording_name_generator.generate(args)
         self._agi.set_variable('__XIVO_CALLRECORDFILE', callrecordfile)
 
+    def _get_context_tenant_uuid(self):
+        tenant_uuid = objects.Context.get_tenant_uuid(self._cursor, self._context)
+        if tenant_uuid is None:
+            tenant_uuid = context_dao.get(self._context).tenant_uuid
+        return tenant_uuid
+
     def _set_music_on_hold(self):
         if self._user.musiconhold:
             self._agi.set_variable('CHANNEL(musicclass)', self._user.musiconhold)
@@ -454,31 +543,55 @@ class UserFeatures(Handler):
         objects.DialAction(self._agi, self._cursor, 'chanunavail', 'user', self._user.id).set_variables()
 
     def _has_mobile_connection(self):
+        mobile = _mobile_connections.get(self._user.uuid)
+        if mobile is None:
+            mobile = self._fetch_mobile_connection(self._user.uuid)
+
+        if mobile:
+            self._agi.set_variable('WAZO_MOBILE_CONNECTION', True)
+            return True
+
+        return False
+
+    def _fetch_mobile_connection(self, user_uuid):
+        # The sessions are fetched while the tokens are, instead of after,
+        # unless too many lookups are already running
+        sessions = _BackgroundCall.start_if_available(_mobile_sessions_threads, self._get_user_sessions, user_uuid)
         mobile = False
+        complete = True
 
         try:
-            response = self.auth_client.token.list(self._user.uuid, mobile=True)
-        except requests.HTTPError as e:
+            with circuit_breaker.guard('auth'):
+                response = self.auth_client.token.list(user_uuid, mobile=True)
+        except (requests.HTTPError, CircuitBreakerOpen) as e:
             self._agi.verbose('failed to fetch user refresh tokens {}'.format(e))
+            complete = False
         else:
             mobile = response['filtered'] > 0
 
-        if not mobile:
+        if sessions is not None:
+            get_sessions = sessions.get
+        elif not mobile:
+            get_sessions = partial(self._get_user_sessions, user_uuid)
+        else:
+            get_sessions = None
+
+        if get_sessions is not None:
             try:
-                response = self.auth_client.users.get_sessions(self._user.uuid)
-            except requests.HTTPError as e:
+                response = get_sessions()
+            except (requests.HTTPError, CircuitBreakerOpen) as e:
                 self._agi.verbose('failed to fetch user sessions {}'.format(e))
+                complete = False
             else:
-                for session in response['items']:
-                    if session['mobile']:
-                        mobile = True
-                        break
+                mobile = mobile or any(session['mobile'] for session in response['items'])
 
-        if mobile:
-            self._agi.set_variable('WAZO_MOBILE_CONNECTION', True)
-            return True
+        if mobile or complete:
+            _mobile_connections.set(user_uuid, mobile)
+        return mobile
 
-        return False
+    def _get_user_sessions(self, user_uuid):
+        with circuit_breaker.guard('auth'):
+            return self.auth_client.users.get_sessions(user_uuid)
 
     def _set_video_enabled(self):
         native_video_format = self._agi.get_variable('CHANNEL(videonativeformat)')
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import logging
+
+from threading import Lock
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+_adapters = {}
+_adapters_lock = Lock()
+
+
+class _SharedHTTPAdapter(HTTPAdapter):
+    """HTTP adapter shared by every session of a client.
+
+    The REST clients build a new session for each request, and may close
+    it afterwards. The pooled connections must outlive those sessions.
+    """
+
+    def close(self):
+        pass
+
+
+def use_shared_pool(client, service, maxsize, connect_retries=0, backoff_factor=0):
+    """Makes every session created by ``client`` use the keep-alive pool of ``service``.
+
+    At most ``maxsize`` connections to the service are kept open. Failed
+    connection attempts are retried ``connect_retries`` times, waiting
+    longer after each attempt. A request that reached the service is never
+    retried.
+    """
+    adapter = _get_adapter(service, maxsize, connect_retries, backoff_factor)
+    create_session = client.session
+
+    def session():
+        session = create_session()
+        # The clients ask the services to close the connection after each
+        # response, which would leave nothing to reuse in the pool
+        session.headers.pop('Connection', None)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    client.session = session
+    return client
+
+
+def statistics():
+    with _adapters_lock:
+        adapters = list(_adapters.items())
+
+    result = {}
+    for service, adapter in adapters:
+        opened = requests = idle = 0
+        for key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            requests += pool.num_requests
+            idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        result[service] = {'connections_opened': opened, 'requests': requests, 'idle_connections': idle}
+    return result
+
+
+def log_statistics():
+    for service, pool_statistics in sorted(statistics().items()):
+        logger.info('%s HTTP connection pool: %s', service, pool_statistics)
+
+
+def _get_adapter(service, maxsize, connect_retries, backoff_factor):
+    with _adapters_lock:
+        adapter = _adapters.get(service)
+        if adapter is None:
+            max_retries = Retry(
+                total=connect_retries,
+                connect=connect_retries,
+                read=0,
+                backoff_factor=backoff_factor,
+            )
+            adapter = _adapters[service] = _SharedHTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=maxsize,
+                max_retries=max_retries,
+            )
+        return adapter
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-# Copyright 2008-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2008-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import logging
@@ -36,4 +36,4 @@ def agent_get_options(agi, cursor, args):
         agi.set_variable('CHANNEL(language)', agent.language)
 
 
-agid.register(agent_get_options)
+agid.register(agent_get_options, memoize=())
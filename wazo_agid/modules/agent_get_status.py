@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-# Copyright 2012-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2012-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import logging
@@ -14,7 +14,7 @@ def agent_get_status(agi, cursor, args):
         tenant_uuid = args[0]
         agent_id = int(args[1])
 
-        agent.get_agent_status(agi, agent_id, tenant_uuid=tenant_uuid)
+        agent.get_agent_status(agi, cursor, agent_id, tenant_uuid=tenant_uuid)
     except Exception as e:
         logger.exception("Error while getting agent status")
         agi.dp_break(e)
@@ -4,6 +4,8 @@
 
 import logging
 from wazo_agid import agid
+from wazo_agid import circuit_breaker
+from wazo_agid import dispatcher
 
 logger = logging.getLogger(__name__)
 
@@ -11,24 +13,21 @@ logger = logging.getLogger(__name__)
 def call_recording(agi, cursor, args):
     calld = agi.config['calld']['client']
     channel_id = agi.env['agi_uniqueid']
+    # Start and stop of a channel must not be reordered
     if agi.get_variable('WAZO_CALL_RECORD_ACTIVE') == '1':
-        _disable_call_recording(agi, calld, channel_id)
+        dispatcher.submit_ordered(channel_id, 'disable call recording', _disable_call_recording, calld, channel_id)
     else:
-        _enable_call_recording(agi, calld, channel_id)
+        dispatcher.submit_ordered(channel_id, 'enable call recording', _enable_call_recording, calld, channel_id)
 
 
-def _enable_call_recording(agi, calld, channel_id):
-    try:
+def _enable_call_recording(calld, channel_id):
+    with circuit_breaker.guard('calld'):
         calld.calls.start_record(channel_id)
-    except Exception as e:
-        logger.error('Error during enabling call recording: %s', e)
 
 
-def _disable_call_recording(agi, calld, channel_id):
-    try:
+def _disable_call_recording(calld, channel_id):
+    with circuit_breaker.guard('calld'):
         calld.calls.stop_record(channel_id)
-    except Exception as e:
-        logger.error('Error during disabling call recording: %s', e)
 
 
 agid.register(call_recording)
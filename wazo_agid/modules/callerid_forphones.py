@@ -1,16 +1,29 @@
 # -*- coding: utf-8 -*-
-# Copyright 2012-2020 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2012-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import logging
 
 from wazo_agid import agid
+from wazo_agid import circuit_breaker
+from wazo_agid import dao_cache
+from wazo_agid.cache import LRUCache, SingleFlight
 from xivo_dao.resources.directory_profile import dao as directory_profile_dao
 
 logger = logging.getLogger(__name__)
 
 FAKE_XIVO_USER_UUID = '00000000-0000-0000-0000-000000000000'
 
+REVERSE_LOOKUP_CACHE_SIZE = 4096
+REVERSE_LOOKUP_TTL = 300
+REVERSE_LOOKUP_NOT_FOUND_TTL = 60
+
+CALLEE_INFOS_CACHE_SIZE = 1024
+CALLEE_INFOS_CACHE_TTL = 60
+
+_reverse_lookups = LRUCache(REVERSE_LOOKUP_CACHE_SIZE)
+_pending_reverse_lookups = SingleFlight()
+
 
 def callerid_forphones(agi, cursor, args):
     dird_client = agi.config['dird']['client']
@@ -23,20 +36,14 @@ def callerid_forphones(agi, cursor, args):
             return
 
         incall_id = int(agi.get_variable('XIVO_INCALL_ID'))
-        callee_infos = directory_profile_dao.find_by_incall_id(incall_id)
+        callee_infos = _find_callee_infos(incall_id)
         if callee_infos is None:
             user_uuid = FAKE_XIVO_USER_UUID
         else:
             user_uuid = callee_infos.xivo_user_uuid
 
         tenant_uuid = agi.get_variable('WAZO_TENANT_UUID')
-        # It is not possible to associate a profile to a reverse configuration in the webi
-        lookup_result = dird_client.directories.reverse(
-            profile='default',
-            user_uuid=user_uuid,
-            exten=cid_number,
-            tenant_uuid=tenant_uuid,
-        )
+        lookup_result = _reverse_lookup(dird_client, tenant_uuid, user_uuid, cid_number)
         logger.debug('Found caller ID: "%s"<%s>', lookup_result['display'], cid_number)
         if lookup_result['display'] is not None:
             _set_new_caller_id(agi, lookup_result['display'], cid_number)
@@ -47,6 +54,40 @@ def callerid_forphones(agi, cursor, args):
         agi.verbose(msg)
 
 
+@dao_cache.cached(CALLEE_INFOS_CACHE_SIZE, CALLEE_INFOS_CACHE_TTL, freeze=dao_cache.frozen('xivo_user_uuid'))
+def _find_callee_infos(incall_id):
+    return directory_profile_dao.find_by_incall_id(incall_id)
+
+
+def _reverse_lookup(dird_client, tenant_uuid, user_uuid, cid_number):
+    key = (tenant_uuid, user_uuid, cid_number)
+    lookup_result = _reverse_lookups.get(key)
+    if lookup_result is None:
+        # Concurrent calls from the same number share one dird request
+        lookup_result = _pending_reverse_lookups.call(
+            key, lambda: _fetch_reverse_lookup(dird_client, key),
+        )
+    return lookup_result
+
+
+def _fetch_reverse_lookup(dird_client, key):
+    tenant_uuid, user_uuid, cid_number = key
+    # It is not possible to associate a profile to a reverse configuration in the webi
+    with circuit_breaker.guard('dird'):
+        lookup_result = dird_client.directories.reverse(
+            profile='default',
+            user_uuid=user_uuid,
+            exten=cid_number,
+            tenant_uuid=tenant_uuid,
+        )
+    if lookup_result['display'] is None:
+        ttl = REVERSE_LOOKUP_NOT_FOUND_TTL
+    else:
+        ttl = REVERSE_LOOKUP_TTL
+    _reverse_lookups.set(key, lookup_result, ttl)
+    return lookup_result
+
+
 def _should_reverse_lookup(cid_name, cid_number):
     return cid_name == cid_number or cid_name == 'unknown'
 
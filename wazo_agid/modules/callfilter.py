@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
-# Copyright 2013-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2013-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from wazo_agid import agid, dialplan_variables
+from wazo_agid import agid, dao_cache, dialplan_variables, objects
 from xivo_dao import callfilter_dao
 
+MEMBERS_CACHE_SIZE = 1024
+MEMBERS_CACHE_TTL = 30
+
 
 def callfilter(agi, cursor, args):
     callfiltermember_id = args[0]
@@ -12,26 +15,30 @@ def callfilter(agi, cursor, args):
     if not callfiltermember_id.isdigit():
         agi.dp_break('This id "%s" is not a valid callfiltermember_id id.' % callfiltermember_id)
 
+    if not agid.is_database_available():
+        agi.dp_break('Database unreachable, callfilter state not changed')
+
     caller_user_id = agi.get_variable(dialplan_variables.USERID)
     callfiltermember = callfilter_dao.get_by_callfiltermember_id(callfiltermember_id)
     if not callfiltermember:
         agi.dp_break('This callfilter does not exist.')
 
-    bslist = callfilter_dao.get(callfiltermember.callfilterid)
-    if not bslist:
+    allow_ids = _get_member_ids(callfiltermember.callfilterid)
+    if not allow_ids:
         agi.dp_break('This callfilter has no member.')
 
-    allow_ids = []
-    for bs in bslist:
-        callfilter, callfiltermembers = bs
-        allow_ids.append(callfiltermembers.typeval)
-
     if not caller_user_id or caller_user_id not in allow_ids:
         agi.dp_break('This user is not allowed to use this callfilter.')
 
     new_state = 0 if callfiltermember.active == 1 else 1
     callfilter_dao.update_callfiltermember_state(callfiltermember_id, new_state)
+    objects.BossCallFilter.invalidate()
     agi.set_variable('XIVO_BSFILTERENABLED', new_state)
 
 
+@dao_cache.cached(MEMBERS_CACHE_SIZE, MEMBERS_CACHE_TTL)
+def _get_member_ids(callfilter_id):
+    return tuple(callfiltermembers.typeval for _, callfiltermembers in callfilter_dao.get(callfilter_id))
+
+
 agid.register(callfilter)
@@ -1,13 +1,19 @@
 # -*- coding: utf-8 -*-
-# Copyright 2010-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2010-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import logging
 from wazo_agid import agid
 from wazo_agid import objects
+from wazo_agid.cache import LRUCache
 
 logger = logging.getLogger(__name__)
 
+SCHEDULE_CACHE_SIZE = 1024
+SCHEDULE_CACHE_TTL = 60
+
+_schedules = LRUCache(SCHEDULE_CACHE_SIZE, ttl=SCHEDULE_CACHE_TTL)
+
 
 def check_schedule(agi, cursor, args):
     path = agi.get_variable('XIVO_PATH')
@@ -16,7 +22,7 @@ def check_schedule(agi, cursor, args):
     if not path:
         return
 
-    schedule = objects.ScheduleDataMapper.get_from_path(cursor, path, path_id)
+    schedule = _get_schedule(cursor, path, path_id)
     schedule_state = schedule.compute_state_for_now()
 
     agi.set_variable('XIVO_SCHEDULE_STATUS', schedule_state.state)
@@ -27,4 +33,17 @@ def check_schedule(agi, cursor, args):
     agi.set_variable('XIVO_PATH', '')
 
 
-agid.register(check_schedule)
+def _get_schedule(cursor, path, path_id):
+    key = (path, path_id)
+    schedule = _schedules.get(key)
+    if schedule is None:
+        schedule = objects.ScheduleDataMapper.get_from_path(cursor, path, path_id)
+        _schedules.set(key, schedule)
+    return schedule
+
+
+def setup(cursor):
+    _schedules.clear()
+
+
+agid.register(check_schedule, setup)
@@ -1,33 +1,32 @@
 # -*- coding: utf-8 -*-
-# Copyright 2006-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2006-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import logging
 
 from wazo_agid import agid
+from wazo_agid import dispatcher
+from wazo_agid import user_settings
 
 logger = logging.getLogger(__name__)
 
 
 def fwdundoall(agi, cursor, args):
     user_id = _get_id_of_calling_user(agi)
-    _user_disable_all_forwards(agi, user_id)
+    confd_client = agi.config['confd']['client']
+    dispatcher.submit('disable all forwards', _user_disable_all_forwards, confd_client, user_id)
 
 
 def _get_id_of_calling_user(agi):
     return int(agi.get_variable('XIVO_USERID'))
 
 
-def _user_disable_all_forwards(agi, user_id):
-    try:
-        confd_client = agi.config['confd']['client']
-        disabled = {'enabled': False}
-        body = {'busy': disabled,
-                'noanswer': disabled,
-                'unconditional': disabled}
-        confd_client.users(user_id).update_forwards(body)
-    except Exception as e:
-        logger.error('Error during disabling all forwards: %s', e)
+def _user_disable_all_forwards(confd_client, user_id):
+    disabled = {'enabled': False}
+    body = {'busy': disabled,
+            'noanswer': disabled,
+            'unconditional': disabled}
+    user_settings.update_forwards(confd_client, user_id, body)
 
 
 agid.register(fwdundoall)
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-# Copyright 2006-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2006-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import ConfigParser
@@ -77,4 +77,10 @@ def setup(cursor):
     CONFIG_PARSER.readfp(open(CONFIG_FILE))
 
 
-agid.register(getring, setup)
+agid.register(getring, setup, memoize=(
+    'XIVO_REAL_NUMBER',
+    'XIVO_REAL_CONTEXT',
+    'XIVO_CALLORIGIN',
+    'XIVO_FWD_REFERER',
+    'XIVO_CALLFORWARDED',
+))
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
-# Copyright 2018-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2018-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0+
 
 import logging
 from requests import RequestException
 from wazo_agid import agid
+from wazo_agid import cache
+from wazo_agid import circuit_breaker
+from wazo_agid import routing
 
 logger = logging.getLogger(__name__)
 
@@ -22,10 +25,8 @@ def group_member_add(agi, cursor, args):
     user_uuid = args[1]
     group_id = int(args[2])
 
-    confd_client = agi.config['confd']['client']
-
     try:
-        group_name = confd_client.groups.get(group_id, tenant_uuid=tenant_uuid)['name']
+        group_name = _get_group_name(agi, cursor, tenant_uuid, group_id)
     except RequestException as e:
         logger.error('Error while getting group %s in tenant %s: %s', group_id, tenant_uuid, e)
         agi.set_variable('WAZO_GROUP_MEMBER_ERROR', e)
@@ -48,10 +49,8 @@ def group_member_remove(agi, cursor, args):
     user_uuid = args[1]
     group_id = int(args[2])
 
-    confd_client = agi.config['confd']['client']
-
     try:
-        group_name = confd_client.groups.get(group_id, tenant_uuid=tenant_uuid)['name']
+        group_name = _get_group_name(agi, cursor, tenant_uuid, group_id)
     except RequestException as e:
         logger.error('Error while getting group %s in tenant %s: %s', group_id, tenant_uuid, e)
         agi.set_variable('WAZO_GROUP_MEMBER_ERROR', e)
@@ -66,15 +65,13 @@ def group_member_remove(agi, cursor, args):
     agi.appexec('RemoveQueueMember', args)
 
 
-def group_member_present(agi, cursors, args):
+def group_member_present(agi, cursor, args):
     tenant_uuid = args[0]
     user_uuid = args[1]
     group_id = int(args[2])
 
-    confd_client = agi.config['confd']['client']
-
     try:
-        group_name = confd_client.groups.get(group_id, tenant_uuid=tenant_uuid)['name']
+        group_name = _get_group_name(agi, cursor, tenant_uuid, group_id)
     except RequestException as e:
         logger.error('Error while getting group %s in tenant %s: %s', group_id, tenant_uuid, e)
         agi.set_variable('WAZO_GROUP_MEMBER_ERROR', e)
@@ -90,6 +87,20 @@ def group_member_present(agi, cursors, args):
         agi.set_variable('WAZO_GROUP_MEMBER_PRESENT', '0')
 
 
+def _get_group_name(agi, cursor, tenant_uuid, group_id):
+    try:
+        group_name = routing.find_group_name(cursor, tenant_uuid, group_id)
+    except cache.DB_CONNECTION_ERRORS as e:
+        logger.info('database unreachable, getting group %s from confd: %s', group_id, e)
+    else:
+        if group_name is not None:
+            return group_name
+
+    confd_client = agi.config['confd']['client']
+    with circuit_breaker.guard('confd'):
+        return confd_client.groups.get(group_id, tenant_uuid=tenant_uuid)['name']
+
+
 agid.register(group_member_remove)
 agid.register(group_member_add)
 agid.register(group_member_present)
@@ -3,14 +3,18 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 from wazo_agid import agid
+from wazo_agid import dao_cache
 from xivo_dao.resources.conference import dao as conference_dao
 
+CONFERENCE_CACHE_SIZE = 1024
+CONFERENCE_CACHE_TTL = 30
+
 
 def incoming_conference_set_features(agi, cursor, args):
     conference_id = int(agi.get_variable('XIVO_DSTID'))
 
     try:
-        conference = conference_dao.get(conference_id)
+        conference = _get_conference(conference_id)
     except (ValueError) as e:
         agi.dp_break(str(e))
 
@@ -40,4 +44,11 @@ def incoming_conference_set_features(agi, cursor, args):
     agi.set_variable('WAZO_CONFBRIDGE_PREPROCESS_SUBROUTINE', conference.preprocess_subroutine or '')
 
 
+@dao_cache.cached(CONFERENCE_CACHE_SIZE, CONFERENCE_CACHE_TTL, freeze=dao_cache.frozen(
+    'id', 'name', 'pin', 'admin_pin', 'tenant_uuid', 'preprocess_subroutine',
+))
+def _get_conference(conference_id):
+    return conference_dao.get(conference_id)
+
+
 agid.register(incoming_conference_set_features)
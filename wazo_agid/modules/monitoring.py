@@ -1,12 +1,24 @@
 # -*- coding: utf-8 -*-
-# Copyright 2009-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2009-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 from wazo_agid import agid
+from wazo_agid import cache
 
 
 def monitoring(agi, cursor, args):
-    agi.send_command("Status: OK")
+    if not agid.is_ready():
+        agi.send_command("Status: WARMING UP")
+        return
+
+    stale = cache.stale_snapshots() + cache.stale_lookups()
+    if not agid.is_database_available():
+        stale.insert(0, 'database')
+
+    if stale:
+        agi.send_command("Status: DEGRADED (%s)" % ', '.join(stale))
+    else:
+        agi.send_command("Status: OK")
 
 
 agid.register(monitoring)
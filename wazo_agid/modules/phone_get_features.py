@@ -4,7 +4,7 @@
 
 import logging
 
-from wazo_agid import agid, objects
+from wazo_agid import agid, objects, user_settings
 
 logger = logging.getLogger(__name__)
 
@@ -58,7 +58,7 @@ def _extract_and_format_destination(forward):
 def _get_forwards(agi, user_id):
     try:
         confd_client = agi.config['confd']['client']
-        return confd_client.users(user_id).list_forwards()
+        return user_settings.get_forwards(confd_client, user_id)
     except Exception as e:
         logger.error('Error during getting forwards: %s', e)
         return {'busy': {'enabled': False, 'destination': None},
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-# Copyright 2009-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2009-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 from xivo.xivo_helpers import split_extension
@@ -35,4 +35,4 @@ def phone_progfunckey(agi, cursor, args):
     agi.set_variable('XIVO_PHONE_PROGFUNCKEY_FEATURE', feature)
 
 
-agid.register(phone_progfunckey)
+agid.register(phone_progfunckey, memoize=('XIVO_USERID',))
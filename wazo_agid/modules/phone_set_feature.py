@@ -6,6 +6,7 @@ import logging
 
 from wazo_agid import agid
 from wazo_agid import objects
+from wazo_agid import user_settings
 
 logger = logging.getLogger(__name__)
 
@@ -30,12 +31,18 @@ def phone_set_feature(agi, cursor, args):
 
 def _phone_set_callrecord(agi, cursor, args):
     calling_user = _get_calling_user(agi, cursor)
-    calling_user.toggle_feature('callrecord')
+    _toggle_user_feature(agi, calling_user, 'callrecord')
 
     agi.set_variable('XIVO_CALLRECORDENABLED', int(calling_user.call_record_enabled))
     agi.set_variable('XIVO_USERID_OWNER', calling_user.id)
 
 
+def _toggle_user_feature(agi, user, feature):
+    if not agid.is_database_available():
+        agi.dp_break('Database unreachable, %s of user %s not changed' % (feature, user.id))
+    user.toggle_feature(feature)
+
+
 def _get_calling_user(agi, cursor):
     return objects.User(agi, cursor, _get_id_of_calling_user(agi))
 
@@ -77,7 +84,7 @@ def _phone_set_vm(agi, cursor, args):
     if vmbox.password and user.id != _get_id_of_calling_user(agi):
         agi.appexec('Authenticate', vmbox.password)
 
-    user.toggle_feature('enablevoicemail')
+    _toggle_user_feature(agi, user, 'enablevoicemail')
 
     agi.set_variable('XIVO_VMENABLED', user.enablevoicemail)
     agi.set_variable('XIVO_USERID_OWNER', user.id)
@@ -85,10 +92,7 @@ def _phone_set_vm(agi, cursor, args):
 
 def _user_set_service(agi, user_id, service_name):
     confd_client = agi.config['confd']['client']
-    response = confd_client.users(user_id).get_service(service_name)
-    new_value = {'enabled': not(response['enabled'])}
-    confd_client.users(user_id).update_service(service_name, new_value)
-    return new_value
+    return user_settings.toggle_service(confd_client, user_id, service_name)
 
 
 def _get_user_from_exten(agi, cursor, exten):
@@ -141,7 +145,7 @@ def _user_set_forward(agi, user_id, forward_name, args):
     body = {'enabled': enabled}
     if enabled:
         body['destination'] = destination
-    confd_client.users(user_id).update_forward(forward_name, body)
+    user_settings.update_forward(confd_client, user_id, forward_name, body)
     return body
 
 
@@ -4,6 +4,7 @@
 
 import logging
 from wazo_agid import agid
+from wazo_agid import dispatcher
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +18,9 @@ def _do_provision(client, provcode, ip):
     else:
         line = _get_line(client, provcode)
         client.lines(line).add_device(device)
-    client.devices.synchronize(device['id'])
+    # Synchronizing can take a while and the dialplan does not wait for the
+    # phone to be reconfigured
+    dispatcher.submit('synchronize device', client.devices.synchronize, device['id'])
 
 
 def _get_device(client, ip):
@@ -1,12 +1,23 @@
 # -*- coding: utf-8 -*-
-# Copyright 2018-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2018-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import json
 
-from xivo_dao.alchemy.queueskillrule import QueueSkillRule
-from xivo_dao.helpers.db_utils import session_scope
 from wazo_agid import agid
+from wazo_agid.cache import LRUCache, Snapshot
+
+SKILL_RULES_MAX_AGE = 60
+SKILL_RULE_KWARGS_SIZE = 1024
+
+
+def _load_skill_rule_ids(cursor):
+    cursor.query("SELECT ${columns} FROM queueskillrule", ('id',))
+    return frozenset(row['id'] for row in cursor.fetchall())
+
+
+_skill_rule_ids = Snapshot('queue skill rules', _load_skill_rule_ids, max_age=SKILL_RULES_MAX_AGE)
+_skill_rule_kwargs = LRUCache(SKILL_RULE_KWARGS_SIZE)
 
 
 def queue_skill_rule_set(agi, cursor, args):
@@ -32,26 +43,42 @@ def queue_skill_rule_set(agi, cursor, args):
         _set_variables(agi, call, timeout)
         return
 
-    with session_scope() as session:
-        skill_rule = session.query(QueueSkillRule).get(int(skill_rule_id))
-        if not skill_rule:
-            _set_variables(agi, call, timeout)
-            return
-
-        skill_rule_function = 'skillrule-{}'.format(skill_rule.id)
-        skill_rule_kwargs = []
-        if skill_rule_variables:
-            skill_rule_variables = skill_rule_variables.replace('|', ',')
-            skill_rule_variables = json.loads(skill_rule_variables)
-            skill_rule_kwargs = ['{}={}'.format(key, value) for key, value in skill_rule_variables.items()]
-        call = '{function}({kwargs})'.format(function=skill_rule_function, kwargs=','.join(skill_rule_kwargs))
+    skill_rule_id = int(skill_rule_id)
+    if not _skill_rule_exists(cursor, skill_rule_id):
+        _set_variables(agi, call, timeout)
+        return
 
+    call = 'skillrule-{function_id}({kwargs})'.format(
+        function_id=skill_rule_id,
+        kwargs=_get_skill_rule_kwargs(skill_rule_variables),
+    )
     _set_variables(agi, call, timeout)
 
 
+def _skill_rule_exists(cursor, skill_rule_id):
+    if skill_rule_id in _skill_rule_ids.get(cursor):
+        return True
+
+    # Not in the snapshot, e.g. created since the last load
+    cursor.query("SELECT ${columns} FROM queueskillrule WHERE id = %s", ('id',), (skill_rule_id,))
+    return cursor.fetchone() is not None
+
+
+def _get_skill_rule_kwargs(skill_rule_variables):
+    if not skill_rule_variables:
+        return ''
+
+    kwargs = _skill_rule_kwargs.get(skill_rule_variables)
+    if kwargs is None:
+        variables = json.loads(skill_rule_variables.replace('|', ','))
+        kwargs = ','.join('{}={}'.format(key, value) for key, value in variables.items())
+        _skill_rule_kwargs.set(skill_rule_variables, kwargs)
+    return kwargs
+
+
 def _set_variables(agi, call, timeout):
     agi.set_variable('XIVO_QUEUESKILLRULESET', call)
     agi.set_variable('ARG2_TIMEOUT', timeout)
 
 
-agid.register(queue_skill_rule_set)
+agid.register(queue_skill_rule_set, memoize=('ARG2', 'XIVO_QUEUESKILLRULESET'))
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-# Copyright 2013-2020 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2013-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import unittest
@@ -11,6 +11,7 @@ from mock import Mock
 from mock import patch
 from mock import sentinel
 from wazo_agid.fastagi import FastAGI
+from wazo_agid.modules import callerid_forphones as callerid_forphones_module
 from wazo_agid.modules.callerid_forphones import callerid_forphones, FAKE_XIVO_USER_UUID
 
 
@@ -21,6 +22,8 @@ class TestCallerIdForPhone(unittest.TestCase):
         self.dird_client = Mock()
         self.agi.config = {'dird': {'client': self.dird_client}}
         self.agi.get_variable.return_value = '42'
+        callerid_forphones_module._reverse_lookups.clear()
+        callerid_forphones_module._find_callee_infos.clear()
 
     def test_callerid_forphones_no_lookup(self):
         self.agi.env = {
@@ -128,3 +131,32 @@ class TestCallerIdForPhone(unittest.TestCase):
         self.dird_client.directories.reverse.side_effect = AssertionError('Should not raise')
 
         callerid_forphones(self.agi, Mock(), Mock())
+
+    @patch('wazo_agid.modules.callerid_forphones.directory_profile_dao')
+    def test_callerid_forphones_known_number_skips_dird(self, mock_dao):
+        self.agi.env = {
+            'agi_calleridname': '5555551234',
+            'agi_callerid': '5555551234',
+        }
+        self.dird_client.directories.reverse.return_value = {'display': 'Bob', 'fields': {}}
+        mock_dao.find_by_incall_id.return_value.xivo_user_uuid = 'user_uuid'
+
+        callerid_forphones(self.agi, Mock(), Mock())
+        callerid_forphones(self.agi, Mock(), Mock())
+
+        assert_that(self.dird_client.directories.reverse.call_count, equal_to(1))
+        assert_that(self.agi.set_callerid.call_count, equal_to(2))
+
+    @patch('wazo_agid.modules.callerid_forphones.directory_profile_dao')
+    def test_callerid_forphones_failed_lookup_is_not_cached(self, mock_dao):
+        self.agi.env = {
+            'agi_calleridname': '5555551234',
+            'agi_callerid': '5555551234',
+        }
+        self.dird_client.directories.reverse.side_effect = [Exception(), {'display': None}]
+        mock_dao.find_by_incall_id.return_value.xivo_user_uuid = 'user_uuid'
+
+        callerid_forphones(self.agi, Mock(), Mock())
+        callerid_forphones(self.agi, Mock(), Mock())
+
+        assert_that(self.dird_client.directories.reverse.call_count, equal_to(2))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from mock import Mock, patch, sentinel
+from psycopg2 import OperationalError
+from requests import RequestException
+
+from ..group_member import group_member_add
+
+
+@patch('wazo_agid.modules.group_member.routing')
+class TestGroupMemberAdd(unittest.TestCase):
+
+    def setUp(self):
+        self.confd_client = Mock()
+        self.agi = Mock()
+        self.agi.config = {'confd': {'client': self.confd_client}}
+        self.args = ['tenant', 'user-uuid', '3']
+
+    def test_group_name_from_routing(self, routing):
+        routing.find_group_name.return_value = 'sales'
+
+        group_member_add(self.agi, sentinel.cursor, self.args)
+
+        routing.find_group_name.assert_called_once_with(sentinel.cursor, 'tenant', 3)
+        self.confd_client.groups.get.assert_not_called()
+        self.agi.appexec.assert_called_once_with(
+            'AddQueueMember', 'sales,Local/user-uuid@usersharedlines,,,,hint:user-uuid@usersharedlines',
+        )
+
+    def test_group_name_from_confd_when_not_found(self, routing):
+        routing.find_group_name.return_value = None
+        self.confd_client.groups.get.return_value = {'name': 'sales'}
+
+        group_member_add(self.agi, sentinel.cursor, self.args)
+
+        self.confd_client.groups.get.assert_called_once_with(3, tenant_uuid='tenant')
+        self.agi.appexec.assert_called_once_with(
+            'AddQueueMember', 'sales,Local/user-uuid@usersharedlines,,,,hint:user-uuid@usersharedlines',
+        )
+
+    def test_group_name_from_confd_when_the_database_is_unreachable(self, routing):
+        routing.find_group_name.side_effect = OperationalError()
+        self.confd_client.groups.get.return_value = {'name': 'sales'}
+
+        group_member_add(self.agi, sentinel.cursor, self.args)
+
+        self.confd_client.groups.get.assert_called_once_with(3, tenant_uuid='tenant')
+        self.agi.appexec.assert_called_once_with(
+            'AddQueueMember', 'sales,Local/user-uuid@usersharedlines,,,,hint:user-uuid@usersharedlines',
+        )
+
+    def test_confd_error(self, routing):
+        routing.find_group_name.return_value = None
+        error = RequestException('unreachable')
+        self.confd_client.groups.get.side_effect = error
+
+        group_member_add(self.agi, sentinel.cursor, self.args)
+
+        self.agi.set_variable.assert_called_once_with('WAZO_GROUP_MEMBER_ERROR', error)
+        self.agi.appexec.assert_not_called()
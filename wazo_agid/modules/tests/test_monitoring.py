@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from mock import Mock, patch
+
+from wazo_agid.modules.monitoring import monitoring
+
+
+@patch('wazo_agid.modules.monitoring.cache')
+@patch('wazo_agid.modules.monitoring.agid')
+class TestMonitoring(unittest.TestCase):
+
+    def setUp(self):
+        self.agi = Mock()
+
+    def test_ok(self, agid, cache):
+        agid.is_ready.return_value = True
+        agid.is_database_available.return_value = True
+        cache.stale_snapshots.return_value = []
+        cache.stale_lookups.return_value = []
+
+        monitoring(self.agi, None, [])
+
+        self.agi.send_command.assert_called_once_with('Status: OK')
+
+    def test_warming_up(self, agid, cache):
+        agid.is_ready.return_value = False
+
+        monitoring(self.agi, None, [])
+
+        self.agi.send_command.assert_called_once_with('Status: WARMING UP')
+
+    def test_degraded_while_serving_stale_data(self, agid, cache):
+        agid.is_ready.return_value = True
+        agid.is_database_available.return_value = False
+        cache.stale_snapshots.return_value = ['routing']
+        cache.stale_lookups.return_value = ['dial actions']
+
+        monitoring(self.agi, None, [])
+
+        self.agi.send_command.assert_called_once_with('Status: DEGRADED (database, routing, dial actions)')
@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
-# Copyright 2016-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2016-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import unittest
 
-from mock import call, Mock
+from mock import call, Mock, patch
+from wazo_agid.circuit_breaker import CircuitBreakerOpen
 from wazo_agid.modules.phone_get_features import _set_current_forwards
 
 
@@ -50,3 +51,31 @@ class TestGetFeatures(unittest.TestCase):
             call('XIVO_DESTUNC', ''),
         ]
         self._agi.set_variable.assert_has_calls(expected_calls)
+
+    @patch('wazo_agid.user_settings.circuit_breaker')
+    def test_set_current_forwards_set_default_variables_when_confd_breaker_is_open(self, circuit_breaker):
+        circuit_breaker.guard.side_effect = CircuitBreakerOpen('confd')
+
+        _set_current_forwards(self._agi, self._user_id)
+
+        self._client.users(self._user_id).list_forwards.assert_not_called()
+        expected_calls = [
+            call('XIVO_ENABLEBUSY', 0),
+            call('XIVO_DESTBUSY', ''),
+            call('XIVO_ENABLERNA', 0),
+            call('XIVO_DESTRNA', ''),
+            call('XIVO_ENABLEUNC', 0),
+            call('XIVO_DESTUNC', ''),
+        ]
+        self._agi.set_variable.assert_has_calls(expected_calls)
+
+    def test_forwards_are_read_each_time(self):
+        self._client.users(self._user_id).list_forwards.return_value = {
+            'busy': {'enabled': True, 'destination': '1234'},
+            'noanswer': {'enabled': False, 'destination': None},
+            'unconditional': {'enabled': False, 'destination': None}}
+
+        _set_current_forwards(self._agi, self._user_id)
+        _set_current_forwards(self._agi, self._user_id)
+
+        self.assertEqual(self._client.users(self._user_id).list_forwards.call_count, 2)
@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
-# Copyright 2016-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2016-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import unittest
 
-from mock import call, Mock
+from mock import call, Mock, patch
+from wazo_agid.fastagi import FastAGIDialPlanBreak
 from wazo_agid.modules.phone_set_feature import (_phone_set_busy,
+                                                 _phone_set_callrecord,
                                                  _phone_set_dnd,
                                                  _phone_set_incallfilter,
                                                  _phone_set_rna,
@@ -34,6 +36,18 @@ class TestPhoneSetFeature(unittest.TestCase):
         ]
         self._agi.set_variable.assert_has_calls(expected_calls)
 
+    def test_phone_set_dnd_twice_reads_the_service_each_time(self):
+        self._client.users(self._user_id).get_service.side_effect = [{'enabled': True}, {'enabled': False}]
+
+        _phone_set_dnd(self._agi, None, None)
+        _phone_set_dnd(self._agi, None, None)
+
+        self._client.users(self._user_id).get_service.assert_has_calls([call('dnd'), call('dnd')])
+        self._client.users(self._user_id).update_service.assert_has_calls([
+            call('dnd', {'enabled': False}),
+            call('dnd', {'enabled': True}),
+        ])
+
     def test_phone_set_incallfilter(self):
         self._client.users(self._user_id).get_service.return_value = {'enabled': False}
 
@@ -109,3 +123,28 @@ class TestPhoneSetFeature(unittest.TestCase):
         _phone_set_unc(self._agi, None, args)
 
         self._agi.set_variable.assert_not_called()
+
+
+@patch('wazo_agid.modules.phone_set_feature.objects.User')
+class TestPhoneSetCallRecord(unittest.TestCase):
+
+    def setUp(self):
+        self._agi = Mock()
+        self._agi.get_variable.return_value = '2'
+        self._agi.dp_break.side_effect = FastAGIDialPlanBreak('break')
+
+    @patch('wazo_agid.modules.phone_set_feature.agid.is_database_available', Mock(return_value=True))
+    def test_callrecord_is_toggled(self, User):
+        User.return_value.call_record_enabled = True
+
+        _phone_set_callrecord(self._agi, None, None)
+
+        User.return_value.toggle_feature.assert_called_once_with('callrecord')
+        self._agi.set_variable.assert_any_call('XIVO_CALLRECORDENABLED', 1)
+
+    @patch('wazo_agid.modules.phone_set_feature.agid.is_database_available', Mock(return_value=False))
+    def test_toggle_is_skipped_without_database(self, User):
+        self.assertRaises(FastAGIDialPlanBreak, _phone_set_callrecord, self._agi, None, None)
+
+        User.return_value.toggle_feature.assert_not_called()
+        self._agi.set_variable.assert_not_called()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from mock import Mock, call, patch
+
+from wazo_agid.cache import LRUCache
+from wazo_agid.modules.queue_skill_rule_set import queue_skill_rule_set
+
+
+@patch('wazo_agid.modules.queue_skill_rule_set._skill_rule_ids')
+class TestQueueSkillRuleSet(unittest.TestCase):
+
+    def setUp(self):
+        self.cursor = Mock()
+        self.agi = Mock()
+        self.variables = {'XIVO_QUEUESKILLRULESET': 'previous'}
+        self.agi.get_variable.side_effect = lambda name: self.variables[name]
+        kwargs_patch = patch('wazo_agid.modules.queue_skill_rule_set._skill_rule_kwargs', LRUCache(10))
+        kwargs_patch.start()
+        self.addCleanup(kwargs_patch.stop)
+
+    def test_timeout_only(self, skill_rule_ids):
+        self.variables['ARG2'] = '30'
+
+        queue_skill_rule_set(self.agi, self.cursor, [])
+
+        self.agi.set_variable.assert_has_calls([
+            call('XIVO_QUEUESKILLRULESET', 'previous'),
+            call('ARG2_TIMEOUT', '30'),
+        ])
+
+    def test_known_skill_rule(self, skill_rule_ids):
+        skill_rule_ids.get.return_value = frozenset([4])
+        self.variables['ARG2'] = '30;4;{"opening": "1"}'
+
+        queue_skill_rule_set(self.agi, self.cursor, [])
+
+        self.cursor.query.assert_not_called()
+        self.agi.set_variable.assert_has_calls([
+            call('XIVO_QUEUESKILLRULESET', 'skillrule-4(opening=1)'),
+            call('ARG2_TIMEOUT', '30'),
+        ])
+
+    def test_variables_are_parsed_once(self, skill_rule_ids):
+        skill_rule_ids.get.return_value = frozenset([4])
+        self.variables['ARG2'] = '4;{"opening": "1"}'
+
+        with patch('wazo_agid.modules.queue_skill_rule_set.json') as json:
+            json.loads.return_value = {'opening': '1'}
+            queue_skill_rule_set(self.agi, self.cursor, [])
+            queue_skill_rule_set(self.agi, self.cursor, [])
+
+        json.loads.assert_called_once_with('{"opening": "1"}')
+
+    def test_skill_rule_not_in_snapshot(self, skill_rule_ids):
+        skill_rule_ids.get.return_value = frozenset()
+        self.cursor.fetchone.return_value = None
+        self.variables['ARG2'] = '30;4;'
+
+        queue_skill_rule_set(self.agi, self.cursor, [])
+
+        self.cursor.query.assert_called_once_with(
+            "SELECT ${columns} FROM queueskillrule WHERE id = %s", ('id',), (4,),
+        )
+        self.agi.set_variable.assert_has_calls([
+            call('XIVO_QUEUESKILLRULESET', 'previous'),
+            call('ARG2_TIMEOUT', '30'),
+        ])
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-# Copyright 2006-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2006-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import logging
@@ -7,15 +7,28 @@ import logging
 from wazo_agid import agid
 from wazo_agid import objects
 from wazo_agid import call_rights
+from wazo_agid.cache import Snapshot
 
 logger = logging.getLogger(__name__)
 
+CALL_RIGHTS_MAX_AGE = 30
+
+_call_rights = Snapshot('call rights', call_rights.CallRightsTable.load, CALL_RIGHTS_MAX_AGE)
+
 
 def _user_set_call_rights(agi, cursor, args):
     userid = agi.get_variable('XIVO_USERID')
     dstnum = agi.get_variable('XIVO_DSTNUM')
     outcallid = agi.get_variable('XIVO_OUTCALLID')
 
+    table = _call_rights.get(cursor)
+    user_id = _to_int(userid)
+    if user_id is None or table.has_user(user_id):
+        rightcall_ids = table.matching_rightcall_ids(dstnum)
+        decision = table.decide(user_id, _to_int(outcallid), rightcall_ids)
+        call_rights.apply_decision(agi, decision)
+
+    # Unknown to the precomputed table, e.g. a user created since the last load
     cursor.query("SELECT ${columns} FROM rightcallexten",
                  ('rightcallid', 'exten'))
     res = cursor.fetchall()
@@ -104,6 +117,13 @@ def _user_set_call_rights(agi, cursor, args):
     call_rights.allow(agi)
 
 
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
 def user_set_call_rights(agi, cursor, args):
     try:
         _user_set_call_rights(agi, cursor, args)
@@ -4,10 +4,13 @@
 
 import logging
 import re
+from wazo_agid import dao_cache
+from wazo_agid import routing
+from wazo_agid.cache import LastKnownResults, LRUCache, NegativeCache, Snapshot
 from wazo_agid.schedule import ScheduleAction, SchedulePeriodBuilder, Schedule, \
     AlwaysOpenedSchedule
 
-from xivo_dao import user_dao
+from xivo_dao import callfilter_dao, user_dao, user_line_dao
 
 logger = logging.getLogger(__name__)
 
@@ -57,54 +60,78 @@ class ExtenFeatures(object):
 
         self.featureslist = tuple(featureslist)
 
-        self.cursor.query("SELECT ${columns} FROM extensions "
-                          "WHERE typeval IN (" + ", ".join(["%s"] * len(self.featureslist)) + ") "
-                          "AND commented = 0",
-                          ('typeval',),
-                          self.featureslist)
-        res = self.cursor.fetchall()
-
-        if not res:
-            enabled_features = []
-        else:
-            enabled_features = [row['typeval'] for row in res]
+        self._index = _feature_extensions.get(cursor)
 
         for feature in self.featureslist:
-            setattr(self, feature, (feature in enabled_features))
+            setattr(self, feature, self._index.is_enabled(feature))
 
     def get_name_by_exten(self, exten):
-        self.cursor.query("SELECT ${columns} FROM extensions "
-                          "WHERE typeval IN (" + ", ".join(["%s"] * len(self.featureslist)) + ") "
-                          "AND (exten = %s "
-                          "OR (SUBSTR(exten,1,1) = '_' "
-                          "    AND SUBSTR(exten, 2, %s) LIKE %s)) "
-                          "AND commented = 0",
-                          ('typeval',),
-                          self.featureslist + (exten, len(exten), "%s%%" % exten))
+        name = self._index.find_name_by_exten(exten, self.featureslist)
 
-        res = self.cursor.fetchone()
-
-        if not res:
+        if not name:
             raise LookupError("Unable to find feature by exten (exten = %r)" % exten)
 
-        return res['typeval']
+        return name
 
     def get_exten_by_name(self, name, commented=None):
-        query = "SELECT ${columns} FROM extensions WHERE typeval = %s"
-        params = [name]
+        exten = self._index.find_exten_by_name(name, commented)
 
-        if commented is not None:
-            params.append(int(bool(commented)))
-            query += " AND commented = %s"
+        if exten is None:
+            raise LookupError("Unable to find feature by name (name = %r)" % name)
 
-        self.cursor.query(query, ('exten',), params)
+        return exten
 
-        res = self.cursor.fetchone()
 
-        if not res:
-            raise LookupError("Unable to find feature by name (name = %r)" % name)
+class FeatureExtensionIndex(object):
+    """Feature extensions indexed by name and by exten."""
+
+    def __init__(self, rows):
+        self._by_name = {}
+        self._by_exten = {}
+        self._patterns = []
+        self._enabled = set()
+
+        for name, exten, commented in rows:
+            self._by_name.setdefault(name, []).append((exten, commented))
+            if commented:
+                continue
+            self._enabled.add(name)
+            if exten.startswith('_'):
+                self._patterns.append((exten[1:], name))
+            else:
+                self._by_exten.setdefault(exten, []).append(name)
+
+    @classmethod
+    def load(cls, cursor):
+        cursor.query("SELECT ${columns} FROM extensions ORDER BY id",
+                     ('typeval', 'exten', 'commented'))
+        return cls((row['typeval'], row['exten'], row['commented']) for row in cursor.fetchall())
 
-        return res['exten']
+    def is_enabled(self, name):
+        return name in self._enabled
+
+    def find_name_by_exten(self, exten, names):
+        for name in self._by_exten.get(exten, ()):
+            if name in names:
+                return name
+
+        for prefix, name in self._patterns:
+            if name in names and prefix.startswith(exten):
+                return name
+
+        return None
+
+    def find_exten_by_name(self, name, commented=None):
+        for exten, exten_commented in self._by_name.get(name, ()):
+            if commented is None or bool(exten_commented) == bool(commented):
+                return exten
+
+        return None
+
+
+FEATURE_EXTENSIONS_MAX_AGE = 60
+
+_feature_extensions = Snapshot('feature extensions', FeatureExtensionIndex.load, FEATURE_EXTENSIONS_MAX_AGE)
 
 
 class VMBox(object):
@@ -112,44 +139,27 @@ class VMBox(object):
         self.agi = agi
         self.cursor = cursor
 
-        vm_columns = ('uniqueid', 'mailbox', 'context', 'password', 'email', 'commented', 'language', 'skipcheckpass')
-        columns = ["voicemail." + c for c in vm_columns]
-
-        if commentcond:
-            where_comment = "AND voicemail.commented = 0"
-        else:
-            where_comment = ""
-
         if xid:
-            cursor.query("SELECT ${columns} FROM voicemail "
-                         "WHERE voicemail.uniqueid = %s " +
-                         where_comment,
-                         columns,
-                         (xid,))
+            res = routing.find_voicemail(cursor, xid)
+            if res and commentcond and res.commented:
+                res = None
         elif mailbox and context:
             contextinclude = Context(agi, cursor, context).include
-            cursor.query("SELECT ${columns} FROM voicemail "
-                         "WHERE voicemail.mailbox = %s "
-                         "AND voicemail.context IN (" + ", ".join(["%s"] * len(contextinclude)) + ") " +
-                         where_comment,
-                         columns,
-                         [mailbox] + contextinclude)
+            res = routing.find_voicemail_by_mailbox(cursor, mailbox, contextinclude, commentcond)
         else:
             raise LookupError("id or mailbox@context must be provided to look up a voicemail entry")
 
-        res = cursor.fetchone()
-
         if not res:
             raise LookupError("Unable to find voicemail box (id: %s, mailbox: %s, context: %s)" % (xid, mailbox, context))
 
-        self.id = res['voicemail.uniqueid']
-        self.mailbox = res['voicemail.mailbox']
-        self.context = res['voicemail.context']
-        self.password = res['voicemail.password']
-        self.email = res['voicemail.email']
-        self.commented = res['voicemail.commented']
-        self.language = res['voicemail.language']
-        self.skipcheckpass = res['voicemail.skipcheckpass']
+        self.id = res.id
+        self.mailbox = res.mailbox
+        self.context = res.context
+        self.password = res.password
+        self.email = res.email
+        self.commented = res.commented
+        self.language = res.language
+        self.skipcheckpass = res.skipcheckpass
 
     def toggle_enable(self, enabled=None):
         if enabled is None:
@@ -166,6 +176,7 @@ class VMBox(object):
             raise DBUpdateException("Unable to perform the requested update")
         else:
             self.commented = enabled
+            routing.invalidate()
 
 
 class Paging(object):
@@ -175,76 +186,50 @@ class Paging(object):
         self.cursor = cursor
         self.lines = set()
 
-        columns = (
-            'id',
-            'number',
-            'duplex',
-            'ignore',
-            'record',
-            'quiet',
-            'timeout',
-            'announcement_file',
-            'announcement_play',
-            'announcement_caller',
-            'commented',
-            'tenant_uuid',
-        )
-
-        cursor.query("SELECT ${columns} FROM paging "
-                     "WHERE number = %s "
-                     "AND commented = 0",
-                     columns,
-                     (number,))
-        res = cursor.fetchone()
+        res, callers, members = routing.find_paging(cursor, number)
 
         if not res:
             raise LookupError("Unable to find paging entry (number: %s)" % (number,))
 
-        id = res['id']
-        self.tenant_uuid = res['tenant_uuid']
-        self.number = res['number']
-        self.duplex = res['duplex']
-        self.ignore = res['ignore']
-        self.record = res['record']
-        self.quiet = res['quiet']
-        self.timeout = res['timeout']
-        self.announcement_file = res['announcement_file']
-        self.announcement_play = res['announcement_play']
-        self.announcement_caller = res['announcement_caller']
-
-        columns = ('userfeaturesid',)
-
-        cursor.query("SELECT ${columns} FROM paginguser "
-                     "WHERE userfeaturesid = %s AND pagingid = %s "
-                     "AND caller = 1",
-                     columns,
-                     (userid, id))
-        res = cursor.fetchone()
-
-        if not res:
+        id = res.id
+        self.tenant_uuid = res.tenant_uuid
+        self.number = res.number
+        self.duplex = res.duplex
+        self.ignore = res.ignore
+        self.record = res.record
+        self.quiet = res.quiet
+        self.timeout = res.timeout
+        self.announcement_file = res.announcement_file
+        self.announcement_play = res.announcement_play
+        self.announcement_caller = res.announcement_caller
+
+        try:
+            is_caller = int(userid) in callers
+        except (TypeError, ValueError):
+            is_caller = False
+
+        if not is_caller:
+            # The caller may have been added since the routing snapshot was loaded
+            cursor.query("SELECT ${columns} FROM paginguser "
+                         "WHERE userfeaturesid = %s AND pagingid = %s "
+                         "AND caller = 1",
+                         ('userfeaturesid',),
+                         (userid, id))
+            is_caller = cursor.fetchone() is not None
+
+        if not is_caller:
             raise LookupError("Unable to find paging caller entry (userfeaturesid: %s)" % (userid,))
 
-        columns = ('endpoint_sip_uuid', 'endpoint_sccp_id', 'endpoint_custom_id', 'name')
-
-        cursor.query("SELECT ${columns} FROM paginguser "
-                     "JOIN user_line ON paginguser.userfeaturesid = user_line.user_id "
-                     "JOIN linefeatures ON user_line.line_id = linefeatures.id "
-                     "WHERE paginguser.pagingid = %s "
-                     "AND paginguser.caller = 0",
-                     columns,
-                     (id,))
-        res = cursor.fetchall()
-
-        if not res:
+        if not members:
             raise LookupError("Unable to find paging users entry (id: %s)" % (id,))
 
-        for line in res:
-            if line['endpoint_sip_uuid']:
-                line = 'SIP/{}'.format(line['name'])
-            elif line['endpoint_sccp_id']:
-                line = 'SCCP/{}/autoanswer'.format(line['name'])
-            elif line['endpoint_custom_id']:
-                line = 'CUSTOM/{}'.format(line['name'])
+        for member in members:
+            if member.endpoint_sip_uuid:
+                line = 'SIP/{}'.format(member.name)
+            elif member.endpoint_sccp_id:
+                line = 'SCCP/{}/autoanswer'.format(member.name)
+            elif member.endpoint_custom_id:
+                line = 'CUSTOM/{}'.format(member.name)
             else:
                 raise LookupError("Unable to find protocol for user (id: %s)" % (id,))
 
@@ -287,9 +272,9 @@ class User(object):
         self.cursor = cursor
 
         if xid:
-            user_row = user_dao.get(xid)
+            user_row = _get_user(xid)
         elif exten and context:
-            user_row = user_dao.get_user_by_number_context(exten, context)
+            user_row = _get_user_by_number_context(exten, context)
         else:
             raise LookupError("id or exten@context must be provided to look up an user entry")
 
@@ -385,68 +370,86 @@ class User(object):
             raise DBUpdateException("Unable to perform the requested update")
 
 
+UNKNOWN_USERS_MAX_SIZE = 4096
+UNKNOWN_USERS_TTL = 10
+LAST_KNOWN_USERS_SIZE = 4096
+
+_unknown_users = NegativeCache('users', UNKNOWN_USERS_MAX_SIZE, UNKNOWN_USERS_TTL)
+_last_known_users = LastKnownResults('users', LAST_KNOWN_USERS_SIZE)
+_freeze_user = dao_cache.frozen(
+    'id', 'uuid', 'tenant_uuid', 'firstname', 'lastname', 'language', 'userfield', 'callerid',
+    'mobilephonenumber', 'musiconhold', 'outcallerid', 'ringseconds', 'simultcalls',
+    'enablevoicemail', 'voicemailid', 'enablexfer', 'dtmf_hangup', 'enableonlinerec',
+    'incallfilter', 'enablednd', 'enableunc', 'destunc', 'enablerna', 'destrna', 'enablebusy',
+    'destbusy', 'preprocess_subroutine', 'bsfilter', 'rightcallcode',
+    'call_record_outgoing_external_enabled', 'call_record_outgoing_internal_enabled',
+    'call_record_incoming_external_enabled', 'call_record_incoming_internal_enabled',
+)
+
+
+def _get_user(xid):
+    if _unknown_users.is_missing('id', xid):
+        raise LookupError("Unable to find user (id: %s)" % (xid,))
+
+    try:
+        return _last_known_users.get(('id', xid), lambda: _freeze_user(user_dao.get(xid)))
+    except LookupError:
+        _unknown_users.add('id', xid)
+        raise
+
+
+def _get_user_by_number_context(exten, context):
+    if _unknown_users.is_missing('exten', (exten, context)):
+        raise LookupError("Unable to find user (exten: %s, context: %s)" % (exten, context))
+
+    try:
+        return _last_known_users.get(
+            ('exten', exten, context),
+            lambda: _freeze_user(user_dao.get_user_by_number_context(exten, context)),
+        )
+    except LookupError:
+        _unknown_users.add('exten', (exten, context))
+        raise
+
+
 class Queue(object):
     def __init__(self, agi, cursor, queue_id):
         self.agi = agi
         self.cursor = cursor
 
-        queuefeatures_columns = [
-            'id', 'tenant_uuid', 'number', 'context', 'name', 'data_quality',
-            'hitting_callee', 'hitting_caller', 'retries', 'ring',
-            'transfer_user', 'transfer_call', 'write_caller',
-            'write_calling', 'ignore_forward', 'url', 'announceoverride', 'timeout',
-            'preprocess_subroutine', 'announce_holdtime', 'waittime',
-            'waitratio', 'mark_answered_elsewhere'
-        ]
-        queuefeatures_columns = ["queuefeatures." + c for c in queuefeatures_columns]
-        queue_columns = ['queue.wrapuptime', 'queue.musicclass']
-
-        columns = queuefeatures_columns + queue_columns
-
         if not queue_id:
             raise LookupError("id must be provided to look up a queue")
 
-        cursor.query(
-            "SELECT ${columns} FROM queuefeatures "
-            "INNER JOIN queue "
-            "ON queuefeatures.name = queue.name "
-            "WHERE queuefeatures.id = %s "
-            "AND queue.commented = 0 "
-            "AND queue.category = 'queue'",
-            columns,
-            (queue_id,),
-        )
-
-        res = cursor.fetchone()
+        res = routing.find_queue(cursor, queue_id)
 
         if not res:
             raise LookupError("Unable to find queue (id: %s)" % (queue_id,))
 
-        self.id = res['queuefeatures.id']
-        self.tenant_uuid = res['queuefeatures.tenant_uuid']
-        self.number = res['queuefeatures.number']
-        self.context = res['queuefeatures.context']
-        self.name = res['queuefeatures.name']
-        self.data_quality = res['queuefeatures.data_quality']
-        self.hitting_callee = res['queuefeatures.hitting_callee']
-        self.hitting_caller = res['queuefeatures.hitting_caller']
-        self.retries = res['queuefeatures.retries']
-        self.ring = res['queuefeatures.ring']
-        self.transfer_user = res['queuefeatures.transfer_user']
-        self.transfer_call = res['queuefeatures.transfer_call']
-        self.write_caller = res['queuefeatures.write_caller']
-        self.write_calling = res['queuefeatures.write_calling']
-        self.ignore_forward = res['queuefeatures.ignore_forward']
-        self.url = res['queuefeatures.url']
-        self.announceoverride = res['queuefeatures.announceoverride']
-        self.timeout = res['queuefeatures.timeout']
-        self.preprocess_subroutine = res['queuefeatures.preprocess_subroutine']
-        self.announce_holdtime = res['queuefeatures.announce_holdtime']
-        self.waittime = res['queuefeatures.waittime']
-        self.waitratio = res['queuefeatures.waitratio']
-        self.wrapuptime = res['queue.wrapuptime']
-        self.musiconhold = res['queue.musicclass']
-        self.mark_answered_elsewhere = res['queuefeatures.mark_answered_elsewhere']
+        self.id = res.id
+        self.tenant_uuid = res.tenant_uuid
+        self.number = res.number
+        self.context = res.context
+        self.name = res.name
+        self.data_quality = res.data_quality
+        self.hitting_callee = res.hitting_callee
+        self.hitting_caller = res.hitting_caller
+        self.retries = res.retries
+        self.ring = res.ring
+        self.transfer_user = res.transfer_user
+        self.transfer_call = res.transfer_call
+        self.write_caller = res.write_caller
+        self.write_calling = res.write_calling
+        self.ignore_forward = res.ignore_forward
+        self.url = res.url
+        self.announceoverride = res.announceoverride
+        self.timeout = res.timeout
+        self.preprocess_subroutine = res.preprocess_subroutine
+        self.announce_holdtime = res.announce_holdtime
+        self.waittime = res.waittime
+        self.waitratio = res.waitratio
+        self.wrapuptime = res.wrapuptime
+        self.musiconhold = res.musiconhold
+        self.mark_answered_elsewhere = res.mark_answered_elsewhere
 
     def set_dial_actions(self):
         for event in ['congestion', 'busy', 'chanunavail', 'qwaittime', 'qwaitratio']:
@@ -482,34 +485,29 @@ class Agent(object):
         self.agi = agi
         self.cursor = cursor
 
-        columns = ('id', 'tenant_uuid', 'number', 'passwd', 'firstname', 'lastname', 'language', 'preprocess_subroutine')
-
         if xid:
-            cursor.query("SELECT ${columns} FROM agentfeatures "
-                         "WHERE id = %s ",
-                         columns,
-                         (xid,))
+            res = routing.find_agent(cursor, agent_id=xid)
         elif number:
-            cursor.query("SELECT ${columns} FROM agentfeatures "
-                         "WHERE number = %s ",
-                         columns,
-                         (number,))
+            res = routing.find_agent(cursor, number=number)
         else:
             raise LookupError("id or number must be provided to look up an agent")
 
-        res = cursor.fetchone()
-
         if not res:
             raise LookupError("Unable to find agent (id: %s, number: %s)" % (xid, number))
 
-        self.id = res['id']
-        self.tenant_uuid = res['tenant_uuid']
-        self.number = res['number']
-        self.passwd = res['passwd']
-        self.firstname = res['firstname']
-        self.lastname = res['lastname']
-        self.language = res['language']
-        self.preprocess_subroutine = res['preprocess_subroutine']
+        self.id = res.id
+        self.tenant_uuid = res.tenant_uuid
+        self.number = res.number
+        self.passwd = res.passwd
+        self.firstname = res.firstname
+        self.lastname = res.lastname
+        self.language = res.language
+        self.preprocess_subroutine = res.preprocess_subroutine
+
+
+LAST_KNOWN_DIAL_ACTIONS_SIZE = 4096
+
+_last_known_dial_actions = LastKnownResults('dial actions', LAST_KNOWN_DIAL_ACTIONS_SIZE)
 
 
 class DialAction(object):
@@ -545,6 +543,13 @@ class DialAction(object):
         self.event = event
         self.category = category
 
+        key = (event, category, categoryval)
+        self.action, self.actionarg1, self.actionarg2 = _last_known_dial_actions.get(
+            key, lambda: self._fetch(cursor, *key)
+        )
+
+    @staticmethod
+    def _fetch(cursor, event, category, categoryval):
         cursor.query("SELECT ${columns} FROM dialaction "
                      "WHERE event = %s "
                      "AND category = %s "
@@ -554,13 +559,8 @@ class DialAction(object):
         res = cursor.fetchone()
 
         if not res:
-            self.action = "none"
-            self.actionarg1 = None
-            self.actionarg2 = None
-        else:
-            self.action = res['action']
-            self.actionarg1 = res['actionarg1']
-            self.actionarg2 = res['actionarg2']
+            return "none", None, None
+        return res['action'], res['actionarg1'], res['actionarg2']
 
     def set_variables(self):
         category_no_isda = ('none',
@@ -614,34 +614,16 @@ class DID(object):
         if not incall_id:
             raise LookupError("id must be provided to look up a DID entry")
 
-        columns = (
-            'incall.id',
-            'incall.preprocess_subroutine',
-            'incall.greeting_sound',
-            'extensions.exten',
-            'extensions.context',
-        )
-
-        cursor.query(
-            "SELECT ${columns} FROM incall "
-            "JOIN extensions ON extensions.type = 'incall' "
-            "AND extensions.typeval = CAST(incall.id AS VARCHAR(255)) "
-            "WHERE incall.id = %s "
-            "AND incall.commented = 0 AND extensions.commented = 0",
-            columns,
-            (incall_id,),
-        )
-
-        res = cursor.fetchone()
+        res = routing.find_did(cursor, incall_id)
 
         if not res:
             raise LookupError("Unable to find DID entry (id: %s)" % (incall_id,))
 
-        self.id = res['incall.id']
-        self.exten = res['extensions.exten']
-        self.context = res['extensions.context']
-        self.preprocess_subroutine = res['incall.preprocess_subroutine']
-        self.greeting_sound = res['incall.greeting_sound']
+        self.id = res.id
+        self.exten = res.exten
+        self.context = res.context
+        self.preprocess_subroutine = res.preprocess_subroutine
+        self.greeting_sound = res.greeting_sound
 
     def set_dial_actions(self):
         DialAction(self.agi, self.cursor, "answer", "incall", self.id).set_variables()
@@ -768,39 +750,184 @@ class ScheduleDataMapper(object):
 
 
 class Context(object):
-    # TODO: Recursive inclusion
     def __init__(self, agi, cursor, context):
         self.agi = agi
         self.cursor = cursor
 
-        columns = ('context.name', 'context.displayname',
-                   'contextinclude.include')
-
-        cursor.query("SELECT ${columns} FROM context "
-                     "LEFT JOIN contextinclude "
-                     "ON context.name = contextinclude.context "
-                     "LEFT JOIN context AS contextinc "
-                     "ON contextinclude.include = contextinc.name "
-                     "AND context.commented = contextinc.commented "
-                     "WHERE context.name = %s "
-                     "AND context.commented = 0 "
-                     "AND (contextinclude.include IS NULL "
-                     "     OR contextinc.name IS NOT NULL) "
-                     "ORDER BY contextinclude.priority ASC",
-                     columns,
-                     (context,))
-        res = cursor.fetchall()
+        res = _context_graph.get(cursor).find(context)
 
         if not res:
             raise LookupError("Unable to find context entry (name: %s)" % (context,))
 
-        self.name = res[0]['context.name']
-        self.displayname = res[0]['context.displayname']
-        self.include = [self.name]
+        self.name, self.displayname, include = res
+        self.include = list(include)
 
-        for row in res:
-            if row['contextinclude.include']:
-                self.include.append(row['contextinclude.include'])
+    @staticmethod
+    def get_tenant_uuid(cursor, context):
+        return _context_graph.get(cursor).get_tenant_uuid(context)
+
+
+class ContextGraph(object):
+    """Contexts with the transitive closure of their inclusions.
+
+    The inclusions of a context are listed depth first in priority order,
+    each context appearing once. A context including itself, directly or
+    not, is an inclusion cycle: the inclusion closing the cycle is skipped
+    and the cycle is logged and kept in ``cycles``.
+    """
+
+    def __init__(self, contexts, includes):
+        self._tenant_uuids = dict((name, tenant_uuid) for name, _, tenant_uuid, _ in contexts)
+        self._displaynames = dict((name, displayname) for name, displayname, _, commented in contexts
+                                  if not commented)
+
+        self._includes = {}
+        for context, include, _ in sorted(includes, key=lambda include: include[2]):
+            if context in self._displaynames and include in self._displaynames:
+                self._includes.setdefault(context, []).append(include)
+
+        self.cycles = set()
+        self._closures = dict((name, self._build_closure(name)) for name in self._displaynames)
+        for cycle in sorted(self.cycles):
+            logger.warning('context inclusion cycle: %s', ' -> '.join(cycle + cycle[:1]))
+
+    @classmethod
+    def load(cls, cursor):
+        cursor.query("SELECT ${columns} FROM context",
+                     ('name', 'displayname', 'tenant_uuid', 'commented'))
+        contexts = [(row['name'], row['displayname'], row['tenant_uuid'], row['commented'])
+                    for row in cursor.fetchall()]
+
+        cursor.query("SELECT ${columns} FROM contextinclude",
+                     ('context', 'include', 'priority'))
+        includes = [(row['context'], row['include'], row['priority']) for row in cursor.fetchall()]
+
+        return cls(contexts, includes)
+
+    def find(self, name):
+        if name not in self._displaynames:
+            return None
+        return name, self._displaynames[name], self._closures[name]
+
+    def get_tenant_uuid(self, name):
+        return self._tenant_uuids.get(name)
+
+    def _build_closure(self, name):
+        closure = []
+        self._visit(name, [], set(), closure)
+        return tuple(closure)
+
+    def _visit(self, context, path, visited, closure):
+        if context in path:
+            self.cycles.add(_rotate_cycle(path[path.index(context):]))
+            return
+        if context in visited:
+            # Included from more than one context, e.g. a diamond
+            return
+
+        visited.add(context)
+        closure.append(context)
+        path.append(context)
+        for include in self._includes.get(context, ()):
+            self._visit(include, path, visited, closure)
+        path.pop()
+
+
+def _rotate_cycle(cycle):
+    # The same cycle is found from each of its contexts, starting it with
+    # its smallest context gives it a single representation
+    start = cycle.index(min(cycle))
+    return tuple(cycle[start:] + cycle[:start])
+
+
+CONTEXT_GRAPH_MAX_AGE = 60
+
+_context_graph = Snapshot('context graph', ContextGraph.load, CONTEXT_GRAPH_MAX_AGE)
+
+
+class BossCallFilter(object):
+    """Call filter of a boss, with the interfaces and ring times of the
+    active secretaries already resolved.
+
+    Most users are not bosses, the boss user ids are kept in a snapshot to
+    answer that without any query.
+    """
+
+    def __init__(self, callfilter, boss_ringseconds, active, secretaries):
+        self.callfilter = callfilter
+        self.boss_ringseconds = boss_ringseconds
+        self.active = active
+        self.secretaries = secretaries
+
+    @classmethod
+    def find(cls, cursor, user_id):
+        if str(user_id) not in _call_filter_bosses.get(cursor):
+            return None
+
+        # False is cached for users that are no longer bosses
+        boss_call_filter = _boss_call_filters.get(user_id)
+        if boss_call_filter is None:
+            boss_call_filter = cls.load(user_id)
+            _boss_call_filters.set(user_id, boss_call_filter)
+        return boss_call_filter or None
+
+    @classmethod
+    def load(cls, user_id):
+        boss_callfiltermember = callfilter_dao.find_boss(user_id)
+        if not boss_callfiltermember:
+            return False
+
+        callfilter_id = boss_callfiltermember.callfilterid
+        callfilter = callfilter_dao.find(callfilter_id)
+        if not callfilter:
+            logger.debug('no such callfilter: "%s"', callfilter_id)
+            return cls(None, boss_callfiltermember.ringseconds, 0, [])
+
+        active = callfilter_dao.is_activated_by_callfilter_id(callfilter_id)
+        secretaries = []
+        if active != 0:
+            for secretary, ringseconds in callfilter_dao.get_secretaries_by_callfiltermember_id(callfilter_id):
+                if secretary.active:
+                    iface = user_line_dao.get_line_identity_by_user_id(secretary.typeval)
+                    # TODO PJSIP migration
+                    if iface.startswith('SIP'):
+                        iface = 'PJ{}'.format(iface)
+                    if iface.startswith('sip'):
+                        iface = 'pj{}'.format(iface)
+                    secretaries.append((iface, ringseconds))
+
+        callfilter = CallFilterRecord(callfilter.id, callfilter.callfrom, callfilter.bosssecretary,
+                                      callfilter.ringseconds)
+        return cls(callfilter, boss_callfiltermember.ringseconds, active, secretaries)
+
+    @staticmethod
+    def load_bosses(cursor):
+        cursor.query("SELECT ${columns} FROM callfiltermember "
+                     "WHERE bstype = 'boss'",
+                     ('typeval',))
+        return frozenset(row['typeval'] for row in cursor.fetchall())
+
+    @staticmethod
+    def invalidate():
+        _call_filter_bosses.invalidate()
+        _boss_call_filters.clear()
+
+
+class CallFilterRecord(object):
+    __slots__ = ('id', 'callfrom', 'bosssecretary', 'ringseconds')
+
+    def __init__(self, id, callfrom, bosssecretary, ringseconds):
+        self.id = id
+        self.callfrom = callfrom
+        self.bosssecretary = bosssecretary
+        self.ringseconds = ringseconds
+
+
+CALL_FILTER_MAX_AGE = 30
+BOSS_CALL_FILTERS_SIZE = 1024
+
+_call_filter_bosses = Snapshot('call filter bosses', BossCallFilter.load_bosses, CALL_FILTER_MAX_AGE)
+_boss_call_filters = LRUCache(BOSS_CALL_FILTERS_SIZE, ttl=CALL_FILTER_MAX_AGE)
 
 
 CALLERID_MATCHER = re.compile('^(?:"(.+)"|([a-zA-Z0-9\-\.\!%\*_\+`\'\~]+)) ?(?:<(\+?[0-9\*#]+)>)?$').match
@@ -862,25 +989,14 @@ class CallerID(object):
         self.type = xtype
         self.typeval = typeval
 
-        cursor.query("SELECT ${columns} FROM callerid "
-                     "WHERE type = %s "
-                     "AND typeval = %s "
-                     "AND mode IS NOT NULL",
-                     ('mode', 'callerdisplay'),
-                     (xtype, typeval))
-        res = cursor.fetchone()
-
-        self.mode = None
-        self.calleridname = None
-        self.calleridnum = None
+        rule = _callerid_rules.get(cursor).find(xtype, typeval)
 
-        if res:
-            cid_parsed = self.parse(res['callerdisplay'])
-
-            if cid_parsed:
-                self.mode = res['mode']
-                self.calleridname, self.calleridnum = cid_parsed
-                self.calleridname = self.calleridname.encode('UTF-8')
+        if rule:
+            self.mode, self.calleridname, self.calleridnum = rule
+        else:
+            self.mode = None
+            self.calleridname = None
+            self.calleridnum = None
 
     def rewrite(self, force_rewrite):
         """
@@ -937,6 +1053,44 @@ class CallerID(object):
                 self.agi.set_variable('XIVO_CID_REWRITTEN', 1)
 
 
+class CallerIDRules(object):
+    """Parsed caller ID rewrite rules, indexed by (type, typeval).
+
+    An object without a rule, or with a rule that can not be parsed, has no
+    entry.
+    """
+
+    def __init__(self, rows):
+        self._rules = {}
+
+        for xtype, typeval, mode, callerdisplay in rows:
+            cid_parsed = CallerID.parse(callerdisplay)
+            if not cid_parsed:
+                continue
+
+            calleridname, calleridnum = cid_parsed
+            self._rules[(xtype, int(typeval))] = (mode, calleridname.encode('UTF-8'), calleridnum)
+
+    @classmethod
+    def load(cls, cursor):
+        cursor.query("SELECT ${columns} FROM callerid "
+                     "WHERE mode IS NOT NULL",
+                     ('type', 'typeval', 'mode', 'callerdisplay'))
+        return cls((row['type'], row['typeval'], row['mode'], row['callerdisplay'])
+                   for row in cursor.fetchall())
+
+    def find(self, xtype, typeval):
+        try:
+            return self._rules.get((xtype, int(typeval)))
+        except (TypeError, ValueError):
+            return None
+
+
+CALLERID_RULES_MAX_AGE = 60
+
+_callerid_rules = Snapshot('caller ID rules', CallerIDRules.load, CALLERID_RULES_MAX_AGE)
+
+
 class ChanSIP(object):
 
     @staticmethod
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import logging
+
+from wazo_agid.cache import LastKnownResults, NegativeCache, Snapshot
+
+logger = logging.getLogger(__name__)
+
+ROUTING_MAX_AGE = 60
+UNKNOWN_MAX_SIZE = 4096
+UNKNOWN_TTL = 10
+LAST_KNOWN_CALLEE_LINES_SIZE = 4096
+
+
+class Record(object):
+    """Read-only copy of a row, built from the (column, attribute) COLUMNS."""
+
+    __slots__ = ()
+    COLUMNS = ()
+
+    def __init__(self, row):
+        for column, attribute in self.COLUMNS:
+            setattr(self, attribute, row[column])
+
+    @classmethod
+    def columns(cls):
+        return [column for column, _ in cls.COLUMNS]
+
+
+class QueueRecord(Record):
+    COLUMNS = (
+        ('queuefeatures.id', 'id'),
+        ('queuefeatures.tenant_uuid', 'tenant_uuid'),
+        ('queuefeatures.number', 'number'),
+        ('queuefeatures.context', 'context'),
+        ('queuefeatures.name', 'name'),
+        ('queuefeatures.data_quality', 'data_quality'),
+        ('queuefeatures.hitting_callee', 'hitting_callee'),
+        ('queuefeatures.hitting_caller', 'hitting_caller'),
+        ('queuefeatures.retries', 'retries'),
+        ('queuefeatures.ring', 'ring'),
+        ('queuefeatures.transfer_user', 'transfer_user'),
+        ('queuefeatures.transfer_call', 'transfer_call'),
+        ('queuefeatures.write_caller', 'write_caller'),
+        ('queuefeatures.write_calling', 'write_calling'),
+        ('queuefeatures.ignore_forward', 'ignore_forward'),
+        ('queuefeatures.url', 'url'),
+        ('queuefeatures.announceoverride', 'announceoverride'),
+        ('queuefeatures.timeout', 'timeout'),
+        ('queuefeatures.preprocess_subroutine', 'preprocess_subroutine'),
+        ('queuefeatures.announce_holdtime', 'announce_holdtime'),
+        ('queuefeatures.waittime', 'waittime'),
+        ('queuefeatures.waitratio', 'waitratio'),
+        ('queuefeatures.mark_answered_elsewhere', 'mark_answered_elsewhere'),
+        ('queue.wrapuptime', 'wrapuptime'),
+        ('queue.musicclass', 'musiconhold'),
+    )
+    __slots__ = tuple(attribute for _, attribute in COLUMNS)
+
+    QUERY = ("SELECT ${columns} FROM queuefeatures "
+             "INNER JOIN queue "
+             "ON queuefeatures.name = queue.name "
+             "WHERE queue.commented = 0 "
+             "AND queue.category = 'queue' ")
+    KEY = 'queuefeatures.id'
+
+
+class GroupRecord(Record):
+    COLUMNS = (
+        ('groupfeatures.id', 'id'),
+        ('groupfeatures.tenant_uuid', 'tenant_uuid'),
+        ('groupfeatures.name', 'name'),
+        ('groupfeatures.timeout', 'timeout'),
+        ('groupfeatures.transfer_user', 'transfer_user'),
+        ('groupfeatures.transfer_call', 'transfer_call'),
+        ('groupfeatures.write_caller', 'write_caller'),
+        ('groupfeatures.write_calling', 'write_calling'),
+        ('groupfeatures.ignore_forward', 'ignore_forward'),
+        ('groupfeatures.preprocess_subroutine', 'preprocess_subroutine'),
+        ('groupfeatures.mark_answered_elsewhere', 'mark_answered_elsewhere'),
+        ('queue.musicclass', 'musicclass'),
+        ('extensions.exten', 'exten'),
+        ('extensions.context', 'context'),
+    )
+    __slots__ = tuple(attribute for _, attribute in COLUMNS)
+
+    QUERY = ("SELECT ${columns} FROM groupfeatures "
+             "INNER JOIN queue "
+             "ON groupfeatures.name = queue.name "
+             "LEFT JOIN extensions "
+             "ON groupfeatures.id::text = extensions.typeval "
+             "AND extensions.type = 'group' "
+             "WHERE queue.category = 'group' "
+             "AND queue.commented = 0 ")
+    KEY = 'groupfeatures.id'
+
+
+class DIDRecord(Record):
+    COLUMNS = (
+        ('incall.id', 'id'),
+        ('incall.preprocess_subroutine', 'preprocess_subroutine'),
+        ('incall.greeting_sound', 'greeting_sound'),
+        ('extensions.exten', 'exten'),
+        ('extensions.context', 'context'),
+    )
+    __slots__ = tuple(attribute for _, attribute in COLUMNS)
+
+    QUERY = ("SELECT ${columns} FROM incall "
+             "JOIN extensions ON extensions.type = 'incall' "
+             "AND extensions.typeval = CAST(incall.id AS VARCHAR(255)) "
+             "WHERE incall.commented = 0 AND extensions.commented = 0 ")
+    KEY = 'incall.id'
+
+
+class AgentRecord(Record):
+    COLUMNS = (
+        ('id', 'id'),
+        ('tenant_uuid', 'tenant_uuid'),
+        ('number', 'number'),
+        ('passwd', 'passwd'),
+        ('firstname', 'firstname'),
+        ('lastname', 'lastname'),
+        ('language', 'language'),
+        ('preprocess_subroutine', 'preprocess_subroutine'),
+    )
+    __slots__ = tuple(attribute for _, attribute in COLUMNS)
+
+    QUERY = "SELECT ${columns} FROM agentfeatures WHERE true "
+    KEY = 'id'
+
+
+class VoicemailRecord(Record):
+    COLUMNS = (
+        ('voicemail.uniqueid', 'id'),
+        ('voicemail.mailbox', 'mailbox'),
+        ('voicemail.context', 'context'),
+        ('voicemail.password', 'password'),
+        ('voicemail.email', 'email'),
+        ('voicemail.commented', 'commented'),
+        ('voicemail.language', 'language'),
+        ('voicemail.skipcheckpass', 'skipcheckpass'),
+    )
+    __slots__ = tuple(attribute for _, attribute in COLUMNS)
+
+    QUERY = "SELECT ${columns} FROM voicemail WHERE true "
+    KEY = 'voicemail.uniqueid'
+
+
+class PagingRecord(Record):
+    COLUMNS = (
+        ('id', 'id'),
+        ('number', 'number'),
+        ('duplex', 'duplex'),
+        ('ignore', 'ignore'),
+        ('record', 'record'),
+        ('quiet', 'quiet'),
+        ('timeout', 'timeout'),
+        ('announcement_file', 'announcement_file'),
+        ('announcement_play', 'announcement_play'),
+        ('announcement_caller', 'announcement_caller'),
+        ('tenant_uuid', 'tenant_uuid'),
+    )
+    __slots__ = tuple(attribute for _, attribute in COLUMNS)
+
+    QUERY = "SELECT ${columns} FROM paging WHERE commented = 0 "
+    KEY = 'number'
+
+
+class PagingMemberRecord(Record):
+    COLUMNS = (
+        ('paginguser.pagingid', 'paging_id'),
+        ('paginguser.userfeaturesid', 'user_id'),
+        ('linefeatures.endpoint_sip_uuid', 'endpoint_sip_uuid'),
+        ('linefeatures.endpoint_sccp_id', 'endpoint_sccp_id'),
+        ('linefeatures.endpoint_custom_id', 'endpoint_custom_id'),
+        ('linefeatures.name', 'name'),
+    )
+    __slots__ = tuple(attribute for _, attribute in COLUMNS)
+
+    QUERY = ("SELECT ${columns} FROM paginguser "
+             "JOIN user_line ON paginguser.userfeaturesid = user_line.user_id "
+             "JOIN linefeatures ON user_line.line_id = linefeatures.id "
+             "WHERE paginguser.caller = 0 ")
+    KEY = 'paginguser.pagingid'
+
+
+class LineRecord(Record):
+    COLUMNS = (
+        ('linefeatures.id', 'id'),
+        ('linefeatures.name', 'name'),
+        ('linefeatures.endpoint_sip_uuid', 'endpoint_sip_uuid'),
+        ('linefeatures.endpoint_sccp_id', 'endpoint_sccp_id'),
+        ('linefeatures.endpoint_custom_id', 'endpoint_custom_id'),
+    )
+    __slots__ = tuple(attribute for _, attribute in COLUMNS)
+
+    @property
+    def protocol(self):
+        if self.endpoint_sip_uuid:
+            return 'sip'
+        elif self.endpoint_sccp_id:
+            return 'sccp'
+        elif self.endpoint_custom_id:
+            return 'custom'
+
+
+class ExtensionRecord(Record):
+    COLUMNS = (
+        ('extensions.id', 'id'),
+        ('extensions.exten', 'exten'),
+        ('extensions.context', 'context'),
+    )
+    __slots__ = tuple(attribute for _, attribute in COLUMNS)
+
+
+class RoutingSnapshot(object):
+    """Read-only model of the queues, groups, DIDs, agents, voicemails and
+    paging groups, indexed by id and number."""
+
+    def __init__(self, queues, groups, dids, agents, voicemails, pagings, paging_callers, paging_members):
+        self.queues = _index(queues, 'id')
+        self.groups = _index(groups, 'id')
+        self.dids = _index(dids, 'id')
+        self.agents_by_id = _index(agents, 'id')
+        self.agents_by_number = _index(agents, 'number')
+        self.voicemails_by_id = _index(voicemails, 'id')
+        self.voicemails_by_mailbox = {}
+        for voicemail in voicemails:
+            self.voicemails_by_mailbox.setdefault((voicemail.mailbox, voicemail.context), voicemail)
+        self.pagings_by_number = _index(pagings, 'number')
+
+        self.paging_callers = {}
+        for paging_id, user_id in paging_callers:
+            self.paging_callers.setdefault(paging_id, set()).add(user_id)
+        self.paging_members = {}
+        for member in paging_members:
+            self.paging_members.setdefault(member.paging_id, []).append(member)
+
+    @classmethod
+    def load(cls, cursor):
+        cursor.query("SELECT ${columns} FROM paginguser WHERE caller = 1",
+                     ('pagingid', 'userfeaturesid'))
+        paging_callers = [(row['pagingid'], row['userfeaturesid']) for row in cursor.fetchall()]
+
+        snapshot = cls(
+            _fetch_all(cursor, QueueRecord),
+            _fetch_all(cursor, GroupRecord),
+            _fetch_all(cursor, DIDRecord),
+            _fetch_all(cursor, AgentRecord),
+            _fetch_all(cursor, VoicemailRecord),
+            _fetch_all(cursor, PagingRecord),
+            paging_callers,
+            _fetch_all(cursor, PagingMemberRecord),
+        )
+        logger.info('routing snapshot: %s queues, %s groups, %s DIDs, %s agents, %s voicemails, %s pagings',
+                    len(snapshot.queues), len(snapshot.groups), len(snapshot.dids),
+                    len(snapshot.agents_by_id), len(snapshot.voicemails_by_id),
+                    len(snapshot.pagings_by_number))
+        return snapshot
+
+
+_routing = Snapshot('routing', RoutingSnapshot.load, ROUTING_MAX_AGE)
+_unknown = NegativeCache('routing', UNKNOWN_MAX_SIZE, UNKNOWN_TTL)
+_last_known_callee_lines = LastKnownResults('callee lines', LAST_KNOWN_CALLEE_LINES_SIZE)
+
+
+def get_version():
+    return _routing.version
+
+
+def invalidate():
+    _routing.invalidate()
+
+
+def find_queue(cursor, queue_id):
+    queue = _routing.get(cursor).queues.get(_to_int(queue_id))
+    return queue or _fetch_one(cursor, 'queue', QueueRecord, QueueRecord.KEY, queue_id)
+
+
+def find_group(cursor, group_id):
+    group = _routing.get(cursor).groups.get(_to_int(group_id))
+    return group or _fetch_one(cursor, 'group', GroupRecord, GroupRecord.KEY, group_id)
+
+
+def find_group_name(cursor, tenant_uuid, group_id):
+    group = find_group(cursor, group_id)
+    if group is None or group.tenant_uuid != tenant_uuid:
+        return None
+    return group.name
+
+
+def find_did(cursor, incall_id):
+    did = _routing.get(cursor).dids.get(_to_int(incall_id))
+    return did or _fetch_one(cursor, 'did', DIDRecord, DIDRecord.KEY, incall_id)
+
+
+def find_agent(cursor, agent_id=None, number=None):
+    snapshot = _routing.get(cursor)
+    if agent_id:
+        agent = snapshot.agents_by_id.get(_to_int(agent_id))
+        return agent or _fetch_one(cursor, 'agent', AgentRecord, 'id', agent_id)
+
+    agent = snapshot.agents_by_number.get(number)
+    return agent or _fetch_one(cursor, 'agent number', AgentRecord, 'number', number)
+
+
+def find_voicemail(cursor, voicemail_id):
+    voicemail = _routing.get(cursor).voicemails_by_id.get(_to_int(voicemail_id))
+    return voicemail or _fetch_one(cursor, 'voicemail', VoicemailRecord, VoicemailRecord.KEY, voicemail_id)
+
+
+def find_voicemail_by_mailbox(cursor, mailbox, contexts, commentcond=True):
+    voicemails = _routing.get(cursor).voicemails_by_mailbox
+    for context in contexts:
+        voicemail = voicemails.get((mailbox, context))
+        if voicemail and not (commentcond and voicemail.commented):
+            return voicemail
+
+    key = (mailbox, tuple(contexts), commentcond)
+    if _unknown.is_missing('voicemail mailbox', key):
+        return None
+
+    cursor.query(VoicemailRecord.QUERY +
+                 "AND voicemail.mailbox = %s "
+                 "AND voicemail.context IN (" + ", ".join(["%s"] * len(contexts)) + ") " +
+                 ("AND voicemail.commented = 0" if commentcond else ""),
+                 VoicemailRecord.columns(),
+                 [mailbox] + list(contexts))
+    res = cursor.fetchone()
+    if not res:
+        _unknown.add('voicemail mailbox', key)
+        return None
+    return VoicemailRecord(res)
+
+
+def find_paging(cursor, number):
+    """Return the paging, the ids of its callers and its member lines."""
+    snapshot = _routing.get(cursor)
+    paging = snapshot.pagings_by_number.get(number)
+    if paging:
+        callers = snapshot.paging_callers.get(paging.id, frozenset())
+        members = snapshot.paging_members.get(paging.id, [])
+        return paging, callers, members
+
+    paging = _fetch_one(cursor, 'paging', PagingRecord, PagingRecord.KEY, number)
+    if not paging:
+        return None, frozenset(), []
+
+    cursor.query("SELECT ${columns} FROM paginguser "
+                 "WHERE pagingid = %s AND caller = 1",
+                 ('userfeaturesid',),
+                 (paging.id,))
+    callers = set(row['userfeaturesid'] for row in cursor.fetchall())
+    members = _fetch_all(cursor, PagingMemberRecord, PagingMemberRecord.KEY, paging.id)
+    return paging, callers, members
+
+
+def find_callee_lines(cursor, user_id, extension_id=None):
+    """Return the main line of a user, the extension to ring and the lines
+    sharing that extension.
+
+    Without extension_id (e.g. incoming call), only the main extension of
+    the main line is rung.
+    """
+    return _last_known_callee_lines.get(
+        (user_id, extension_id),
+        lambda: _fetch_callee_lines(cursor, user_id, extension_id),
+    )
+
+
+def _fetch_callee_lines(cursor, user_id, extension_id):
+    cursor.query("SELECT ${columns} FROM user_line "
+                 "JOIN linefeatures ON linefeatures.id = user_line.line_id "
+                 "LEFT JOIN line_extension ON line_extension.line_id = linefeatures.id "
+                 "WHERE user_line.user_id = %s "
+                 "AND user_line.main_line = true "
+                 "ORDER BY line_extension.main_extension DESC NULLS LAST "
+                 "LIMIT 1",
+                 LineRecord.columns() + ['line_extension.extension_id'],
+                 (user_id,))
+    res = cursor.fetchone()
+    if not res:
+        return None, None, []
+
+    main_line = LineRecord(res)
+    extension_id = extension_id or res['line_extension.extension_id']
+    if not extension_id:
+        return main_line, None, []
+
+    cursor.query("SELECT ${columns} FROM extensions "
+                 "LEFT JOIN line_extension ON line_extension.extension_id = extensions.id "
+                 "LEFT JOIN linefeatures ON linefeatures.id = line_extension.line_id "
+                 "WHERE extensions.id = %s",
+                 ExtensionRecord.columns() + LineRecord.columns(),
+                 (extension_id,))
+    res = cursor.fetchall()
+    if not res:
+        return main_line, None, []
+
+    extension = ExtensionRecord(res[0])
+    lines = [LineRecord(row) for row in res if row['linefeatures.id'] is not None]
+    return main_line, extension, lines
+
+
+def _fetch_one(cursor, kind, record_class, column, value):
+    # Not in the snapshot, e.g. created since the last load or a bogus
+    # number dialed repeatedly by a scanner
+    if _unknown.is_missing(kind, value):
+        return None
+
+    records = _fetch_all(cursor, record_class, column, value)
+    if not records:
+        _unknown.add(kind, value)
+        return None
+    return records[0]
+
+
+def _fetch_all(cursor, record_class, column=None, value=None):
+    query = record_class.QUERY
+    parameters = ()
+    if column:
+        query += "AND {} = %s".format(column)
+        parameters = (value,)
+
+    cursor.query(query, record_class.columns(), parameters)
+    return [record_class(row) for row in cursor.fetchall()]
+
+
+def _index(records, attribute):
+    index = {}
+    for record in records:
+        index.setdefault(getattr(record, attribute), record)
+    return index
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
@@ -1,18 +1,25 @@
 # -*- coding: utf-8 -*-
 # Copyright (C) 2010-2014 Avencall
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import datetime
 import pytz
 import re
 
+MINUTES_PER_DAY = 24 * 60
+_ALL_DAY_MINUTES = (1 << MINUTES_PER_DAY) - 1
+_ALL_VALUES = (1 << 32) - 1
+
 
 class Schedule(object):
     def __init__(self, opened_periods, closed_periods, default_action, timezone_name):
-        self._opened_periods = opened_periods
-        self._closed_periods = closed_periods
+        self._opened_periods = [period.compile() for period in opened_periods]
+        self._closed_periods = [period.compile() for period in closed_periods]
         self._default_action = default_action
         self._timezone_name = timezone_name
+        self._timezone = None
+        self._cached_state = None
 
     def compute_state(self, current_datetime):
         for closed_period in self._closed_periods:
@@ -24,13 +31,41 @@ class Schedule(object):
         return ScheduleState.new_closed_state(self._default_action)
 
     def compute_state_for_now(self):
-        current_datetime = self._get_current_localized_time()
-        return self.compute_state(current_datetime)
-
-    def _get_current_localized_time(self):
-        timezone = pytz.timezone(self._timezone_name)
+        # the state only changes at the next transition, keep it until then
+        cached_state = self._cached_state
         utc_now = pytz.utc.localize(datetime.datetime.utcnow())
-        return utc_now.astimezone(timezone)
+        if cached_state is not None and utc_now < cached_state[1]:
+            return cached_state[0]
+
+        current_datetime = utc_now.astimezone(self._get_timezone())
+        state = self.compute_state(current_datetime)
+        self._cached_state = (state, self.compute_next_transition(current_datetime))
+        return state
+
+    def compute_next_transition(self, current_datetime):
+        """Return the first UTC datetime, after the localized current_datetime,
+        at which the state of the schedule can change."""
+        weekday = current_datetime.isoweekday()
+        minute_of_day = current_datetime.hour * 60 + current_datetime.minute
+
+        # the days and months masks can only change at midnight
+        next_minute_of_day = MINUTES_PER_DAY
+        for period in self._closed_periods + self._opened_periods:
+            next_minute_of_day = min(next_minute_of_day,
+                                     period.next_change_in_day(weekday, minute_of_day))
+
+        midnight = current_datetime.replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+        transition = midnight + datetime.timedelta(minutes=next_minute_of_day)
+
+        # a transition in a DST gap or overlap is taken at its earliest occurrence
+        timezone = self._get_timezone()
+        return min(timezone.localize(transition, is_dst=is_dst).astimezone(pytz.utc)
+                   for is_dst in (True, False))
+
+    def _get_timezone(self):
+        if self._timezone is None:
+            self._timezone = pytz.timezone(self._timezone_name)
+        return self._timezone
 
 
 class AlwaysOpenedSchedule(object):
@@ -109,6 +144,67 @@ class SchedulePeriod(object):
                 return False
         return True
 
+    def compile(self):
+        return CompiledSchedulePeriod.from_checkers(self._checkers, self.action)
+
+
+class CompiledSchedulePeriod(object):
+    """Bitmap form of a SchedulePeriod.
+
+    week_minutes has one bit per minute of the week, starting on monday
+    at 00:00. days and months have one bit per day of the month and per
+    month.
+    """
+
+    __slots__ = ('week_minutes', 'days', 'months', 'action')
+
+    def __init__(self, week_minutes, days, months, action):
+        self.week_minutes = week_minutes
+        self.days = days
+        self.months = months
+        self.action = action
+
+    def is_in(self, tested_datetime):
+        minute_of_week = ((tested_datetime.isoweekday() - 1) * MINUTES_PER_DAY
+                          + tested_datetime.hour * 60
+                          + tested_datetime.minute)
+        return bool(self.week_minutes >> minute_of_week & 1
+                    and self.days >> tested_datetime.day & 1
+                    and self.months >> tested_datetime.month & 1)
+
+    def next_change_in_day(self, weekday, minute_of_day):
+        """Return the next minute of the day at which the hours and weekdays
+        stop or start matching, or MINUTES_PER_DAY if it does not change
+        before midnight."""
+        day_minutes = self.week_minutes >> ((weekday - 1) * MINUTES_PER_DAY) & _ALL_DAY_MINUTES
+        if day_minutes >> minute_of_day & 1:
+            changes = ~day_minutes & _ALL_DAY_MINUTES
+        else:
+            changes = day_minutes
+
+        changes >>= minute_of_day + 1
+        if not changes:
+            return MINUTES_PER_DAY
+        return minute_of_day + (changes & -changes).bit_length()
+
+    @classmethod
+    def from_checkers(cls, checkers, action):
+        masks = {
+            'day_minutes': _ALL_DAY_MINUTES,
+            'weekdays': _ALL_VALUES,
+            'days': _ALL_VALUES,
+            'months': _ALL_VALUES,
+        }
+        for checker in checkers:
+            masks[checker.MASK_NAME] &= checker.mask()
+
+        week_minutes = 0
+        for weekday in xrange(1, 8):
+            if masks['weekdays'] >> weekday & 1:
+                week_minutes |= masks['day_minutes'] << ((weekday - 1) * MINUTES_PER_DAY)
+
+        return cls(week_minutes, masks['days'], masks['months'], action)
+
 
 class SchedulePeriodBuilder(object):
     def __init__(self):
@@ -152,6 +248,9 @@ class SchedulePeriodBuilder(object):
 
 
 class HoursChecker(object):
+
+    MASK_NAME = 'day_minutes'
+
     def __init__(self, start_hour, start_minute, end_hour, end_minute):
         self._start_time = (start_hour, start_minute)
         self._end_time = (end_hour, end_minute)
@@ -160,6 +259,11 @@ class HoursChecker(object):
         tested_time = (tested_datetime.hour, tested_datetime.minute)
         return self._start_time <= tested_time <= self._end_time
 
+    def mask(self):
+        start = self._start_time[0] * 60 + self._start_time[1]
+        end = self._end_time[0] * 60 + self._end_time[1]
+        return ((1 << (end - start + 1)) - 1) << start
+
     _HOURS_VALUE_REGEX = re.compile(r'^(\d\d):([0-5]\d)-(\d\d):([0-5]\d)$')
 
     @classmethod
@@ -189,6 +293,12 @@ class _SimpleChecker(object):
         tested_value = self._extract_tested_value_from_datetime(tested_datetime)
         return tested_value in self._accepted_values
 
+    def mask(self):
+        mask = 0
+        for value in self._accepted_values:
+            mask |= 1 << value
+        return mask & _ALL_VALUES
+
     def _extract_tested_value_from_datetime(self, tested_datetime):
         raise NotImplementedError()
 
@@ -206,15 +316,24 @@ class _SimpleChecker(object):
 
 
 class WeekdaysChecker(_SimpleChecker):
+
+    MASK_NAME = 'weekdays'
+
     def _extract_tested_value_from_datetime(self, tested_datetime):
         return tested_datetime.isoweekday()
 
 
 class DaysChecker(_SimpleChecker):
+
+    MASK_NAME = 'days'
+
     def _extract_tested_value_from_datetime(self, tested_datetime):
         return tested_datetime.day
 
 
 class MonthsChecker(_SimpleChecker):
+
+    MASK_NAME = 'months'
+
     def _extract_tested_value_from_datetime(self, tested_datetime):
         return tested_datetime.month
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from hamcrest import assert_that, equal_to, none
+from mock import Mock, patch
+
+from .. import agent_status
+
+
+@patch('wazo_agid.agent_status._login_status')
+class TestFindStateInterface(unittest.TestCase):
+
+    def setUp(self):
+        self.cursor = Mock()
+
+    def test_logged_agent_from_snapshot(self, login_status):
+        login_status.get.return_value = {11: 'PJSIP/abcd'}
+
+        result = agent_status.find_state_interface(self.cursor, '11')
+
+        assert_that(result, equal_to('PJSIP/abcd'))
+        assert_that(self.cursor.query.called, equal_to(False))
+
+    def test_agent_logged_since_the_last_refresh(self, login_status):
+        login_status.get.return_value = {}
+        self.cursor.fetchone.return_value = {'state_interface': 'PJSIP/abcd'}
+
+        result = agent_status.find_state_interface(self.cursor, '11')
+
+        assert_that(result, equal_to('PJSIP/abcd'))
+        self.cursor.query.assert_called_once_with(
+            "SELECT ${columns} FROM agent_login_status WHERE agent_id = %s", ('state_interface',), (11,),
+        )
+
+    def test_logged_off_agent(self, login_status):
+        login_status.get.return_value = {}
+        self.cursor.fetchone.return_value = None
+
+        assert_that(agent_status.find_state_interface(self.cursor, 11), none())
@@ -1,10 +1,25 @@
 # -*- coding: utf-8 -*-
-# Copyright 2013-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2013-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import mock
 import unittest
-from wazo_agid.agid import Handler
+from psycopg2 import OperationalError
+from wazo_agid import agid
+from wazo_agid.agid import FastAGIRequestHandler, Handler
+
+
+def _set_language(agi, cursor, args):
+    agi.set_variable('CHANNEL(language)', agi.get_variable('XIVO_LANGUAGE'))
+
+
+def _set_caller_name(agi, cursor, args):
+    agi.set_variable('XIVO_CALLERNAME', agi.env['agi_calleridname'])
+
+
+def _answer(agi, cursor, args):
+    agi.answer()
+    agi.set_variable('XIVO_ANSWERED', 1)
 
 
 class TestHandler(unittest.TestCase):
@@ -16,3 +31,147 @@ class TestHandler(unittest.TestCase):
         handler.setup(fake_cursor)
 
         setup_function.assert_called_once_with(fake_cursor)
+
+
+@mock.patch('wazo_agid.agid.session_scope', mock.MagicMock())
+class TestMemoizedHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.agi = mock.Mock()
+        self.agi.get_variable.return_value = 'fr_FR'
+        self.cursor = mock.Mock()
+
+    def test_outputs_are_replayed(self):
+        handle_function = mock.Mock(side_effect=_set_language)
+        handler = Handler('foo', None, handle_function, memoize=('XIVO_LANGUAGE',))
+
+        handler.handle(self.agi, self.cursor, ['1'])
+        handler.handle(self.agi, self.cursor, ['1'])
+
+        self.assertEqual(handle_function.call_count, 1)
+        self.assertEqual(self.agi.set_variable.call_args_list,
+                         [mock.call('CHANNEL(language)', 'fr_FR')] * 2)
+        self.assertEqual(handler.results.hits, 1)
+
+    def test_inputs_are_part_of_the_key(self):
+        handle_function = mock.Mock(side_effect=_set_language)
+        handler = Handler('foo', None, handle_function, memoize=('XIVO_LANGUAGE',))
+
+        handler.handle(self.agi, self.cursor, ['1'])
+        self.agi.get_variable.return_value = 'en_US'
+        handler.handle(self.agi, self.cursor, ['1'])
+
+        self.assertEqual(handle_function.call_count, 2)
+
+    def test_undeclared_input_is_not_memoized(self):
+        handle_function = mock.Mock(side_effect=_set_language)
+        handler = Handler('foo', None, handle_function, memoize=())
+
+        handler.handle(self.agi, self.cursor, ['1'])
+        handler.handle(self.agi, self.cursor, ['1'])
+
+        self.assertEqual(handle_function.call_count, 2)
+
+    def test_other_commands_are_not_memoized(self):
+        handle_function = mock.Mock(side_effect=_answer)
+        handler = Handler('foo', None, handle_function, memoize=())
+
+        handler.handle(self.agi, self.cursor, [])
+        handler.handle(self.agi, self.cursor, [])
+
+        self.assertEqual(handle_function.call_count, 2)
+
+    def test_environment_is_not_memoized(self):
+        handle_function = mock.Mock(side_effect=_set_caller_name)
+        handler = Handler('foo', None, handle_function, memoize=())
+
+        self.agi.env = {'agi_calleridname': 'Alice'}
+        handler.handle(self.agi, self.cursor, [])
+        self.agi.env = {'agi_calleridname': 'Bob'}
+        handler.handle(self.agi, self.cursor, [])
+
+        self.assertEqual(handle_function.call_count, 2)
+        self.assertEqual(self.agi.set_variable.call_args_list,
+                         [mock.call('XIVO_CALLERNAME', 'Alice'), mock.call('XIVO_CALLERNAME', 'Bob')])
+
+
+class _RequestHandler(FastAGIRequestHandler):
+
+    config = {}
+
+    def __init__(self, server):
+        # Not connected, handle is called by the tests
+        self.server = server
+        self.rfile = self.wfile = None
+
+
+@mock.patch('wazo_agid.agid.agitb', mock.Mock())
+@mock.patch('wazo_agid.agid.fastagi.FastAGI')
+class TestFastAGIRequestHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = mock.Mock()
+        handlers_patch = mock.patch.dict('wazo_agid.agid._handlers', {'foo': self.handler})
+        handlers_patch.start()
+        self.addCleanup(handlers_patch.stop)
+
+        self.pool = mock.Mock()
+        self.request_handler = _RequestHandler(mock.Mock(db_conn_pool=self.pool))
+
+    def test_handled_without_database_when_unreachable(self, FastAGI):
+        FastAGI.return_value.env = {'agi_network_script': 'foo'}
+        self.pool.acquire.side_effect = OperationalError()
+        self.handler.handle.side_effect = self._assert_database_unavailable
+
+        self.request_handler.handle()
+
+        self.assertEqual(self.handler.handle.call_count, 1)
+        self.pool.release.assert_not_called()
+        self.assertTrue(agid.is_database_available())
+        FastAGI.return_value.appexec.assert_not_called()
+
+    def test_connection_is_discarded_after_a_connection_error(self, FastAGI):
+        FastAGI.return_value.env = {'agi_network_script': 'foo'}
+        conn = self.pool.acquire.return_value
+        conn.cursor.return_value.query.side_effect = OperationalError()
+        self.handler.handle.side_effect = self._query_stale_snapshot
+
+        self.request_handler.handle()
+
+        self.pool.discard.assert_called_once_with(conn)
+        self.pool.release.assert_not_called()
+
+    def test_not_committed_after_a_handled_connection_error(self, FastAGI):
+        FastAGI.return_value.env = {'agi_network_script': 'foo'}
+        conn = self.pool.acquire.return_value
+        conn.cursor.return_value.query.side_effect = OperationalError()
+        conn.commit.side_effect = OperationalError()
+        self.handler.handle.side_effect = self._query_stale_snapshot
+
+        self.request_handler.handle()
+
+        conn.commit.assert_not_called()
+        FastAGI.return_value.appexec.assert_not_called()
+        FastAGI.return_value.verbose.assert_called_once_with("AGI handler 'foo' successfully executed")
+        self.pool.discard.assert_called_once_with(conn)
+
+    def test_commit_error_is_raised(self, FastAGI):
+        FastAGI.return_value.env = {'agi_network_script': 'foo'}
+        conn = self.pool.acquire.return_value
+        conn.commit.side_effect = Exception()
+
+        self.request_handler.handle()
+
+        FastAGI.return_value.appexec.assert_called_once_with('Goto', 'agi_fail,s,1')
+        self.pool.release.assert_called_once_with(conn)
+
+    def _assert_database_unavailable(self, agi, cursor, args):
+        self.assertFalse(agid.is_database_available())
+        self.assertRaises(OperationalError, getattr, cursor, 'query')
+
+    def _query_stale_snapshot(self, agi, cursor, args):
+        # The error is handled, e.g. by serving a stale snapshot
+        try:
+            cursor.query('SELECT 1')
+        except OperationalError:
+            pass
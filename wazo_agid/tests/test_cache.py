@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from threading import Event, Thread
+
+from hamcrest import assert_that, calling, equal_to, none, raises
+from mock import Mock, patch, sentinel
+from psycopg2 import OperationalError
+
+from ..cache import (
+    MAX_STALE_AGE,
+    LastKnownResults,
+    LRUCache,
+    NegativeCache,
+    SingleFlight,
+    Snapshot,
+    warm_up,
+)
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_get_missing(self):
+        cache = LRUCache(2)
+
+        assert_that(cache.get('key'), none())
+        assert_that(cache.get('key', sentinel.default), equal_to(sentinel.default))
+        assert_that(cache.misses, equal_to(2))
+
+    def test_get_hit(self):
+        cache = LRUCache(2)
+        cache.set('key', sentinel.value)
+
+        assert_that(cache.get('key'), equal_to(sentinel.value))
+        assert_that(cache.hits, equal_to(1))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        assert_that(cache.get('a'), equal_to(1))
+        assert_that(cache.get('b'), none())
+        assert_that(cache.get('c'), equal_to(3))
+
+    @patch('wazo_agid.cache.time')
+    def test_expired_entries_are_not_returned(self, time):
+        time.time.return_value = 100
+        cache = LRUCache(2, ttl=10)
+        cache.set('key', sentinel.value)
+
+        time.time.return_value = 109
+        assert_that(cache.get('key'), equal_to(sentinel.value))
+
+        time.time.return_value = 110
+        assert_that(cache.get('key'), none())
+
+    def test_invalidate(self):
+        cache = LRUCache(2)
+        cache.set('key', sentinel.value)
+
+        cache.invalidate('key')
+
+        assert_that(cache.get('key'), none())
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls_share_the_result(self):
+        single_flight = SingleFlight()
+        started, release = Event(), Event()
+        fn = Mock(return_value=sentinel.result)
+
+        def slow():
+            started.set()
+            release.wait()
+            return fn()
+
+        results = []
+        owner = Thread(target=lambda: results.append(single_flight.call('key', slow)))
+        owner.start()
+        started.wait()
+        waiter = Thread(target=lambda: results.append(single_flight.call('key', fn)))
+        waiter.start()
+        waiter.join(0.1)  # let the waiter block on the pending call
+        release.set()
+        owner.join()
+        waiter.join()
+
+        assert_that(results, equal_to([sentinel.result, sentinel.result]))
+        assert_that(fn.call_count, equal_to(1))
+
+    def test_error_is_raised(self):
+        single_flight = SingleFlight()
+
+        assert_that(calling(single_flight.call).with_args('key', Mock(side_effect=ValueError())),
+                    raises(ValueError))
+
+    def test_key_is_released_after_the_call(self):
+        single_flight = SingleFlight()
+        single_flight.call('key', Mock())
+
+        result = single_flight.call('key', Mock(return_value=sentinel.second))
+
+        assert_that(result, equal_to(sentinel.second))
+
+
+class TestNegativeCache(unittest.TestCase):
+
+    def test_unknown_key_is_not_missing(self):
+        negative_cache = NegativeCache('test', 2, 10)
+
+        assert_that(negative_cache.is_missing('user', 42), equal_to(False))
+
+    def test_kinds_are_independent(self):
+        negative_cache = NegativeCache('test', 2, 10)
+        negative_cache.add('user', 42)
+
+        assert_that(negative_cache.is_missing('user', 42), equal_to(True))
+        assert_that(negative_cache.is_missing('queue', 42), equal_to(False))
+
+    def test_suppressions_are_counted_per_kind(self):
+        negative_cache = NegativeCache('test', 2, 10)
+        negative_cache.add('user', 42)
+
+        negative_cache.is_missing('user', 42)
+        negative_cache.is_missing('user', 42)
+        negative_cache.is_missing('queue', 42)
+
+        assert_that(negative_cache.statistics(), equal_to({'user': 2, 'queue': 0}))
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.load_fn = Mock()
+        self.cursor = Mock()
+
+    def test_loaded_on_first_get(self):
+        snapshot = Snapshot('test', self.load_fn)
+
+        result = snapshot.get(self.cursor)
+
+        assert_that(result, equal_to(self.load_fn.return_value))
+        self.load_fn.assert_called_once_with(self.cursor)
+
+    def test_not_reloaded_while_fresh(self):
+        snapshot = Snapshot('test', self.load_fn)
+        snapshot.get(self.cursor)
+
+        snapshot.get(self.cursor)
+
+        assert_that(self.load_fn.call_count, equal_to(1))
+
+    @patch('wazo_agid.cache.time')
+    def test_reloaded_when_too_old(self, time):
+        time.time.return_value = 100
+        snapshot = Snapshot('test', self.load_fn, max_age=30)
+        snapshot.get(self.cursor)
+
+        time.time.return_value = 130
+        snapshot.get(self.cursor)
+
+        assert_that(self.load_fn.call_count, equal_to(2))
+
+    def test_reloaded_after_invalidate(self):
+        snapshot = Snapshot('test', self.load_fn)
+        snapshot.get(self.cursor)
+
+        snapshot.invalidate()
+        snapshot.get(self.cursor)
+
+        assert_that(self.load_fn.call_count, equal_to(2))
+
+    def test_version_is_incremented_on_each_load(self):
+        snapshot = Snapshot('test', self.load_fn)
+        snapshot.get(self.cursor)
+
+        snapshot.reload(self.cursor)
+
+        assert_that(snapshot.version, equal_to(2))
+
+    @patch('wazo_agid.cache.time')
+    def test_previous_content_served_when_refresh_fails(self, time):
+        time.time.return_value = 100
+        snapshot = Snapshot('test', self.load_fn, max_age=30)
+        snapshot.get(self.cursor)
+
+        time.time.return_value = 130
+        self.load_fn.side_effect = OperationalError()
+        result = snapshot.get(self.cursor)
+
+        assert_that(result, equal_to(self.load_fn.return_value))
+        assert_that(snapshot.stale, equal_to(True))
+
+    @patch('wazo_agid.cache.time')
+    def test_refresh_is_not_retried_immediately(self, time):
+        time.time.return_value = 100
+        snapshot = Snapshot('test', self.load_fn, max_age=30)
+        snapshot.get(self.cursor)
+        time.time.return_value = 130
+        self.load_fn.side_effect = OperationalError()
+        snapshot.get(self.cursor)
+
+        snapshot.get(self.cursor)
+
+        assert_that(self.load_fn.call_count, equal_to(2))
+
+    @patch('wazo_agid.cache.time')
+    def test_no_longer_stale_once_refreshed(self, time):
+        time.time.return_value = 100
+        snapshot = Snapshot('test', self.load_fn, max_age=30)
+        snapshot.get(self.cursor)
+        time.time.return_value = 130
+        self.load_fn.side_effect = OperationalError()
+        snapshot.get(self.cursor)
+
+        time.time.return_value = 135
+        self.load_fn.side_effect = None
+        snapshot.get(self.cursor)
+
+        assert_that(snapshot.stale, equal_to(False))
+        assert_that(self.load_fn.call_count, equal_to(3))
+
+    @patch('wazo_agid.cache.time')
+    def test_refresh_error_raised_when_content_is_too_old(self, time):
+        time.time.return_value = 100
+        snapshot = Snapshot('test', self.load_fn, max_age=30)
+        snapshot.get(self.cursor)
+
+        time.time.return_value = 100 + MAX_STALE_AGE
+        self.load_fn.side_effect = OperationalError()
+
+        assert_that(calling(snapshot.get).with_args(self.cursor), raises(OperationalError))
+
+    @patch('wazo_agid.cache.time')
+    def test_errors_other_than_connection_errors_are_raised(self, time):
+        time.time.return_value = 100
+        snapshot = Snapshot('test', self.load_fn, max_age=30)
+        snapshot.get(self.cursor)
+
+        time.time.return_value = 130
+        self.load_fn.side_effect = KeyError('column')
+
+        assert_that(calling(snapshot.get).with_args(self.cursor), raises(KeyError))
+        assert_that(snapshot.stale, equal_to(False))
+
+
+class TestLastKnownResults(unittest.TestCase):
+
+    def setUp(self):
+        self.results = LastKnownResults('test', 10)
+
+    def test_result_is_fetched_every_time(self):
+        fetch_fn = Mock(return_value=sentinel.result)
+
+        self.results.get('key', fetch_fn)
+        result = self.results.get('key', fetch_fn)
+
+        assert_that(result, equal_to(sentinel.result))
+        assert_that(fetch_fn.call_count, equal_to(2))
+
+    def test_last_result_served_while_the_database_is_unreachable(self):
+        self.results.get('key', Mock(return_value=sentinel.result))
+
+        result = self.results.get('key', Mock(side_effect=OperationalError()))
+
+        assert_that(result, equal_to(sentinel.result))
+        assert_that(self.results.stale, equal_to(True))
+
+    def test_connection_error_raised_without_a_last_result(self):
+        self.results.get('key', Mock(return_value=sentinel.result))
+
+        assert_that(calling(self.results.get).with_args('other', Mock(side_effect=OperationalError())),
+                    raises(OperationalError))
+
+    def test_other_errors_are_raised(self):
+        self.results.get('key', Mock(return_value=sentinel.result))
+
+        assert_that(calling(self.results.get).with_args('key', Mock(side_effect=LookupError())),
+                    raises(LookupError))
+        assert_that(self.results.stale, equal_to(False))
+
+    def test_no_longer_stale_once_fetched(self):
+        self.results.get('key', Mock(return_value=sentinel.result))
+        self.results.get('key', Mock(side_effect=OperationalError()))
+
+        self.results.get('key', Mock(return_value=sentinel.result))
+
+        assert_that(self.results.stale, equal_to(False))
+
+
+class TestWarmUp(unittest.TestCase):
+
+    def test_every_snapshot_is_loaded(self):
+        cursor = Mock()
+        snapshots = [Mock(), Mock()]
+
+        with patch('wazo_agid.cache._snapshots', snapshots):
+            warm_up(cursor)
+
+        for snapshot in snapshots:
+            snapshot.reload.assert_called_once_with(cursor)
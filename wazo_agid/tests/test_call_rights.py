@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from hamcrest import assert_that, equal_to
+
+from ..call_rights import CallRightsTable
+
+ALLOW = ('ALLOW', None)
+
+
+class TestCallRightsTable(unittest.TestCase):
+
+    def setUp(self):
+        extens = [(1, '_1XXX'), (2, '_NXXNXXXXXX'), (3, '_1234')]
+        rightcalls = {1: (0, 'pass1'), 2: (1, ''), 3: (0, '')}
+        members = {
+            ('user', '42'): {1},
+            ('group', '7'): {2},
+            ('outcall', '5'): {3},
+        }
+        user_groups = {42: [7]}
+        user_rightcallcodes = {42: None, 43: 'code'}
+        outcall_ids = {5}
+        self.table = CallRightsTable(extens, rightcalls, members, user_groups, user_rightcallcodes, outcall_ids)
+
+    def decide(self, user_id, outcall_id, number):
+        rightcall_ids = self.table.matching_rightcall_ids(number)
+        return self.table.decide(user_id, outcall_id, rightcall_ids)
+
+    def test_matching_rightcall_ids(self):
+        assert_that(self.table.matching_rightcall_ids('1234'), equal_to(frozenset([1, 3])))
+        assert_that(self.table.matching_rightcall_ids('4185551234'), equal_to(frozenset([2])))
+        assert_that(self.table.matching_rightcall_ids('911'), equal_to(frozenset()))
+
+    def test_no_matching_rightcall_is_allowed(self):
+        assert_that(self.decide(42, None, '911'), equal_to(ALLOW))
+
+    def test_user_rule_denies_with_password(self):
+        assert_that(self.decide(42, None, '1000'), equal_to(('DENY', 'pass1')))
+
+    def test_group_rule_allows(self):
+        assert_that(self.decide(42, None, '4185551234'), equal_to(ALLOW))
+
+    def test_user_without_rule_is_allowed(self):
+        assert_that(self.decide(43, None, '1000'), equal_to(ALLOW))
+
+    def test_outcall_rule_applies_without_user(self):
+        assert_that(self.decide(None, 5, '1234'), equal_to(('DENY', '')))
+
+    def test_unknown_outcall_is_allowed(self):
+        assert_that(self.decide(None, 6, '1234'), equal_to(ALLOW))
+
+    def test_user_rightcallcode_overrides_password(self):
+        self.table._members[('user', '43')] = {1}
+
+        assert_that(self.decide(43, None, '1000'), equal_to(('DENY', 'code')))
+
+    def test_decision_is_memoized(self):
+        self.decide(42, None, '1000')
+        self.table._rightcalls[1] = (1, '')
+
+        assert_that(self.decide(42, None, '1000'), equal_to(('DENY', 'pass1')))
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from hamcrest import assert_that, calling, equal_to, raises
+from mock import Mock, patch
+from requests import ConnectionError, ConnectTimeout, HTTPError, ReadTimeout
+from requests.packages.urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from .. import circuit_breaker
+from ..circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitBreakerOpen,
+    is_connection_failure,
+)
+
+
+def call(breaker, error=None):
+    with breaker.guard():
+        if error is not None:
+            raise error
+
+
+def http_error(status_code):
+    return HTTPError(response=Mock(status_code=status_code))
+
+
+@patch('wazo_agid.circuit_breaker.time')
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker('confd', error_threshold=2, latency_threshold=1, reset_timeout=30)
+
+    def test_opens_after_consecutive_failures(self, time):
+        time.time.return_value = 100
+
+        assert_that(calling(call).with_args(self.breaker, ConnectionError()), raises(ConnectionError))
+        assert_that(self.breaker.state, equal_to(CLOSED))
+        assert_that(calling(call).with_args(self.breaker, http_error(503)), raises(HTTPError))
+
+        assert_that(self.breaker.state, equal_to(OPEN))
+        assert_that(calling(call).with_args(self.breaker), raises(CircuitBreakerOpen))
+        assert_that(self.breaker.statistics()['rejected'], equal_to(1))
+
+    def test_success_resets_failures(self, time):
+        time.time.return_value = 100
+
+        assert_that(calling(call).with_args(self.breaker, ConnectionError()), raises(ConnectionError))
+        call(self.breaker)
+        assert_that(calling(call).with_args(self.breaker, ConnectionError()), raises(ConnectionError))
+
+        assert_that(self.breaker.state, equal_to(CLOSED))
+
+    def test_client_errors_are_not_failures(self, time):
+        time.time.return_value = 100
+
+        for _ in range(3):
+            assert_that(calling(call).with_args(self.breaker, http_error(404)), raises(HTTPError))
+            assert_that(calling(call).with_args(self.breaker, ValueError()), raises(ValueError))
+
+        assert_that(self.breaker.state, equal_to(CLOSED))
+
+    def test_failures_can_be_classified_by_the_caller(self, time):
+        time.time.return_value = 100
+
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                with self.breaker.guard(is_failure=lambda e: isinstance(e, ValueError)):
+                    raise ValueError()
+
+        assert_that(self.breaker.state, equal_to(OPEN))
+
+    def test_slow_calls_are_failures(self, time):
+        time.time.side_effect = [100, 102, 102, 104]
+
+        call(self.breaker)
+        call(self.breaker)
+
+        assert_that(self.breaker.state, equal_to(OPEN))
+        assert_that(self.breaker.statistics()['slow_calls'], equal_to(2))
+
+    def test_half_open_probe_closes_the_breaker(self, time):
+        self._open(time)
+        time.time.return_value = 130
+
+        with self.breaker.guard():
+            assert_that(self.breaker.state, equal_to(HALF_OPEN))
+            assert_that(calling(call).with_args(self.breaker), raises(CircuitBreakerOpen))
+
+        assert_that(self.breaker.state, equal_to(CLOSED))
+        call(self.breaker)
+
+    def test_failed_probe_opens_the_breaker_again(self, time):
+        self._open(time)
+        time.time.return_value = 130
+
+        assert_that(calling(call).with_args(self.breaker, ConnectionError()), raises(ConnectionError))
+
+        assert_that(self.breaker.state, equal_to(OPEN))
+        time.time.return_value = 159
+        assert_that(calling(call).with_args(self.breaker), raises(CircuitBreakerOpen))
+        assert_that(self.breaker.statistics()['opened'], equal_to(2))
+
+    def _open(self, time):
+        time.time.return_value = 100
+        for _ in range(2):
+            assert_that(calling(call).with_args(self.breaker, ConnectionError()), raises(ConnectionError))
+        assert_that(self.breaker.state, equal_to(OPEN))
+
+
+class TestIsConnectionFailure(unittest.TestCase):
+
+    def test_request_not_sent(self):
+        refused = MaxRetryError(None, '/', NewConnectionError(None, 'Connection refused'))
+
+        assert_that(is_connection_failure(ConnectionError(refused)), equal_to(True))
+        assert_that(is_connection_failure(ConnectTimeout()), equal_to(True))
+        assert_that(is_connection_failure(CircuitBreakerOpen('calld')), equal_to(True))
+
+    def test_request_may_have_reached_the_service(self):
+        aborted = ProtocolError('Connection aborted.')
+
+        assert_that(is_connection_failure(ConnectionError(aborted)), equal_to(False))
+        assert_that(is_connection_failure(ReadTimeout()), equal_to(False))
+        assert_that(is_connection_failure(HTTPError(response=Mock(status_code=503))), equal_to(False))
+
+
+class TestConfigure(unittest.TestCase):
+
+    def tearDown(self):
+        circuit_breaker.configure({})
+
+    def test_service_section_overrides_defaults(self):
+        circuit_breaker.configure({
+            'error_threshold': 3,
+            'latency_threshold': 2,
+            'dird': {'latency_threshold': 0.5},
+        })
+
+        dird = circuit_breaker.get('dird')
+        confd = circuit_breaker.get('confd')
+
+        assert_that(dird.error_threshold, equal_to(3))
+        assert_that(dird.latency_threshold, equal_to(0.5))
+        assert_that(confd.latency_threshold, equal_to(2))
+        assert_that(circuit_breaker.get('dird'), equal_to(dird))
+        assert_that(circuit_breaker.statistics()['dird']['state'], equal_to(CLOSED))
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from hamcrest import assert_that, calling, equal_to, none, raises
+from mock import Mock
+
+from .. import dao_cache
+
+
+def _conference(id, name):
+    conference = Mock(id=id, pin='1234')
+    conference.name = name
+    return conference
+
+
+class TestCachedFunction(unittest.TestCase):
+
+    def setUp(self):
+        self.dao = Mock(__name__='get')
+        self.get = dao_cache.cached(10, 30, freeze=dao_cache.frozen('id', 'name'))(self.dao)
+        dao_cache.start_request()
+
+    def test_result_is_frozen_and_cached(self):
+        self.dao.return_value = _conference(1, 'conference')
+
+        first = self.get(1)
+        second = self.get(1)
+
+        assert_that(first, equal_to((1, 'conference')))
+        assert_that(second.name, equal_to('conference'))
+        assert_that(calling(setattr).with_args(second, 'name', 'other'), raises(AttributeError))
+        self.dao.assert_called_once_with(1)
+        assert_that(dao_cache.request_statistics(), equal_to({'calls': 1, 'hits': 1}))
+
+    def test_none_is_cached(self):
+        self.dao.return_value = None
+
+        self.get(1)
+
+        assert_that(self.get(1), none())
+        assert_that(self.dao.call_count, equal_to(1))
+
+    def test_exceptions_are_not_cached(self):
+        self.dao.side_effect = [LookupError(), _conference(1, 'conference')]
+
+        assert_that(calling(self.get).with_args(1), raises(LookupError))
+
+        assert_that(self.get(1).id, equal_to(1))
+
+    def test_invalidate(self):
+        self.dao.return_value = None
+        self.get(1)
+
+        self.get.invalidate(1)
+        self.get(1)
+
+        assert_that(self.dao.call_count, equal_to(2))
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from hamcrest import assert_that, equal_to, has_entries
+from mock import Mock, call, patch
+from requests import ConnectionError, HTTPError, ReadTimeout
+
+from .. import dispatcher
+from ..circuit_breaker import is_transient_error
+from ..dispatcher import Dispatcher
+
+
+@patch('wazo_agid.dispatcher.time')
+class TestDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = Dispatcher(workers=1, queue_size=1, max_attempts=3, backoff=1)
+
+    def test_transient_errors_are_retried_with_backoff(self, time):
+        fn = Mock(side_effect=[ConnectionError(), ConnectionError(), None])
+
+        self.dispatcher.submit('job', fn, 'arg')
+        self.dispatcher._run(self.dispatcher._queues[0].get(), self.dispatcher.max_attempts)
+
+        assert_that(fn.call_args_list, equal_to([call('arg')] * 3))
+        time.sleep.assert_has_calls([call(1), call(2)])
+        assert_that(self.dispatcher.statistics(), has_entries(completed=1, retried=2, failed=0, queued=0))
+
+    @patch('wazo_agid.dispatcher.dead_letter_logger')
+    def test_job_failing_every_attempt_is_dead_lettered(self, dead_letter_logger, time):
+        fn = Mock(side_effect=ConnectionError())
+
+        self.dispatcher._run(('job', fn, (), {}, is_transient_error), self.dispatcher.max_attempts)
+
+        assert_that(fn.call_count, equal_to(3))
+        assert_that(dead_letter_logger.error.call_count, equal_to(1))
+        assert_that(self.dispatcher.statistics(), has_entries(failed=1))
+
+    def test_client_errors_are_not_retried(self, time):
+        fn = Mock(side_effect=HTTPError(response=Mock(status_code=404)))
+
+        self.dispatcher._run(('job', fn, (), {}, is_transient_error), self.dispatcher.max_attempts)
+
+        assert_that(fn.call_count, equal_to(1))
+        time.sleep.assert_not_called()
+
+    def test_job_is_run_inline_when_the_queue_is_full(self, time):
+        fn = Mock()
+
+        self.dispatcher.submit('first', Mock())
+        self.dispatcher.submit('second', fn)
+
+        fn.assert_called_once_with()
+        assert_that(self.dispatcher.statistics(), has_entries(submitted=2, run_inline=1, queued=1))
+
+    def test_ordered_jobs_sharing_a_key_go_to_the_same_worker(self, time):
+        dispatcher = Dispatcher(workers=4, queue_size=8)
+
+        dispatcher.submit_ordered('channel', 'start', Mock())
+        dispatcher.submit_ordered('channel', 'stop', Mock())
+
+        queues = [queue for queue in dispatcher._queues if queue.qsize()]
+        assert_that(len(queues), equal_to(1))
+        assert_that([queues[0].get()[0], queues[0].get()[0]], equal_to(['start', 'stop']))
+
+    def test_ordered_jobs_are_not_retried_after_a_read_timeout(self, time):
+        fn = Mock(side_effect=ReadTimeout())
+
+        self.dispatcher.submit_ordered('channel', 'job', fn)
+        self.dispatcher._run(self.dispatcher._queues[0].get(), self.dispatcher.max_attempts)
+
+        assert_that(fn.call_count, equal_to(1))
+        assert_that(self.dispatcher.statistics(), has_entries(failed=1, retried=0))
+
+
+class TestSubmit(unittest.TestCase):
+
+    def test_job_is_run_inline_until_started(self):
+        fn = Mock()
+
+        with patch('wazo_agid.dispatcher._dispatcher', None):
+            dispatcher.submit('job', fn, 1, key='value')
+
+        fn.assert_called_once_with(1, key='value')
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+import requests
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+
+from hamcrest import assert_that, equal_to, has_entry, has_key, is_not, not_, same_instance
+from mock import Mock
+
+from .. import http_pools
+
+
+def _closing_session():
+    # Like the sessions of the Wazo REST clients
+    session = requests.Session()
+    session.headers['Connection'] = 'close'
+    return session
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.clients.add(self.client_address)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        if self.headers.get('Connection') == 'close':
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write('{}')
+
+    def log_message(self, *args):
+        pass
+
+
+class TestUseSharedPool(unittest.TestCase):
+
+    def setUp(self):
+        http_pools._adapters.clear()
+
+    def tearDown(self):
+        http_pools._adapters.clear()
+
+    def test_sessions_share_the_service_pool(self):
+        client = Mock(session=requests.Session)
+
+        http_pools.use_shared_pool(client, 'confd', 10, connect_retries=2, backoff_factor=0.1)
+        first = client.session()
+        second = client.session()
+
+        adapter = first.get_adapter('http://localhost:9486/1.1/users')
+        assert_that(second.get_adapter('https://localhost:9486/1.1/users'), same_instance(adapter))
+        assert_that(adapter._pool_maxsize, equal_to(10))
+        assert_that(adapter.max_retries.connect, equal_to(2))
+        assert_that(adapter.max_retries.read, equal_to(0))
+
+    def test_each_service_has_its_own_pool(self):
+        confd = http_pools.use_shared_pool(Mock(session=requests.Session), 'confd', 10)
+        dird = http_pools.use_shared_pool(Mock(session=requests.Session), 'dird', 10)
+
+        url = 'http://localhost/'
+        assert_that(confd.session().get_adapter(url), is_not(same_instance(dird.session().get_adapter(url))))
+
+    def test_closing_a_session_keeps_the_pool(self):
+        client = http_pools.use_shared_pool(Mock(session=requests.Session), 'confd', 10)
+        session = client.session()
+        pool = session.get_adapter('http://localhost:9486/').get_connection('http://localhost:9486/')
+
+        session.close()
+
+        assert_that(client.session().get_adapter('http://localhost:9486/').get_connection('http://localhost:9486/'),
+                    same_instance(pool))
+
+    def test_connection_close_header_is_dropped(self):
+        client = http_pools.use_shared_pool(Mock(session=_closing_session), 'confd', 10)
+
+        assert_that(client.session().headers, not_(has_key('Connection')))
+
+
+class TestStatistics(unittest.TestCase):
+
+    def setUp(self):
+        http_pools._adapters.clear()
+        self.server = HTTPServer(('127.0.0.1', 0), _KeepAliveHandler)
+        self.server.clients = set()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        thread = Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        # The server handles a single connection at a time, until it is closed
+        for adapter in http_pools._adapters.values():
+            adapter.poolmanager.clear()
+        http_pools._adapters.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_is_reused(self):
+        client = http_pools.use_shared_pool(Mock(session=_closing_session), 'confd', 10)
+
+        client.session().get(self.url)
+        client.session().get(self.url)
+
+        assert_that(len(self.server.clients), equal_to(1))
+        assert_that(http_pools.statistics(), has_entry('confd', {
+            'connections_opened': 1,
+            'requests': 2,
+            'idle_connections': 1,
+        }))
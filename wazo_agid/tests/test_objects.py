@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from hamcrest import assert_that, calling, equal_to, none, raises
+from mock import Mock, patch
+from psycopg2 import OperationalError
+
+from ..cache import LastKnownResults, NegativeCache
+from ..objects import BossCallFilter, CallerIDRules, ContextGraph, DialAction, FeatureExtensionIndex, User
+
+NAMES = ('fwdbusy', 'fwdunc', 'enablednd')
+
+
+class TestFeatureExtensionIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = FeatureExtensionIndex([
+            ('phoneprogfunckey', '_*735.', 0),
+            ('fwdbusy', '_*23.', 0),
+            ('fwdunc', '_*21.', 1),
+            ('enablednd', '*25', 0),
+        ])
+
+    def test_is_enabled(self):
+        assert_that(self.index.is_enabled('fwdbusy'), equal_to(True))
+        assert_that(self.index.is_enabled('fwdunc'), equal_to(False))
+        assert_that(self.index.is_enabled('unknown'), equal_to(False))
+
+    def test_find_name_by_exact_exten(self):
+        assert_that(self.index.find_name_by_exten('*25', NAMES), equal_to('enablednd'))
+
+    def test_find_name_by_pattern(self):
+        assert_that(self.index.find_name_by_exten('*23', NAMES), equal_to('fwdbusy'))
+
+    def test_find_name_ignores_commented_and_other_names(self):
+        assert_that(self.index.find_name_by_exten('*21', NAMES), none())
+        assert_that(self.index.find_name_by_exten('*735', NAMES), none())
+
+    def test_find_exten_by_name(self):
+        assert_that(self.index.find_exten_by_name('phoneprogfunckey'), equal_to('_*735.'))
+        assert_that(self.index.find_exten_by_name('fwdunc'), equal_to('_*21.'))
+        assert_that(self.index.find_exten_by_name('fwdunc', commented=False), none())
+        assert_that(self.index.find_exten_by_name('unknown'), none())
+
+    def test_load_keeps_every_extension(self):
+        cursor = Mock()
+        cursor.fetchall.return_value = [
+            {'typeval': 'enablednd', 'exten': '*25', 'commented': 0},
+            {'typeval': 'vmusermsg', 'exten': '*98', 'commented': 0},
+        ]
+
+        index = FeatureExtensionIndex.load(cursor)
+
+        cursor.query.assert_called_once_with("SELECT ${columns} FROM extensions ORDER BY id",
+                                             ('typeval', 'exten', 'commented'))
+        assert_that(index.find_exten_by_name('enablednd'), equal_to('*25'))
+        assert_that(index.find_exten_by_name('vmusermsg'), equal_to('*98'))
+
+
+class TestCallerIDRules(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = CallerIDRules([
+            ('incall', 1, 'prepend', '"Sales" <1234>'),
+            ('queue', 2, 'overwrite', 'Support'),
+            ('group', 3, 'append', '<>'),
+        ])
+
+    def test_find_parsed_rule(self):
+        assert_that(self.rules.find('incall', 1), equal_to(('prepend', 'Sales', '1234')))
+        assert_that(self.rules.find('queue', '2'), equal_to(('overwrite', 'Support', None)))
+
+    def test_find_without_rule(self):
+        assert_that(self.rules.find('incall', 2), none())
+        assert_that(self.rules.find('callfilter', 1), none())
+        assert_that(self.rules.find('incall', None), none())
+
+    def test_unparsable_rule_is_ignored(self):
+        assert_that(self.rules.find('group', 3), none())
+
+
+class TestContextGraph(unittest.TestCase):
+
+    def setUp(self):
+        contexts = [
+            ('default', 'Default', 'tenant-1', 0),
+            ('internal', 'Internal', 'tenant-1', 0),
+            ('services', 'Services', 'tenant-1', 0),
+            ('disabled', 'Disabled', 'tenant-2', 1),
+        ]
+        includes = [
+            ('default', 'services', 2),
+            ('default', 'internal', 1),
+            ('default', 'disabled', 3),
+            ('internal', 'services', 1),
+            ('services', 'default', 1),
+        ]
+        self.graph = ContextGraph(contexts, includes)
+
+    def test_find_includes_recursively_in_priority_order(self):
+        assert_that(self.graph.find('default'),
+                    equal_to(('default', 'Default', ('default', 'internal', 'services'))))
+
+    def test_find_breaks_cycles(self):
+        assert_that(self.graph.find('services'),
+                    equal_to(('services', 'Services', ('services', 'default', 'internal'))))
+        assert_that(self.graph.cycles, equal_to(set([
+            ('default', 'internal', 'services'),
+            ('default', 'services'),
+        ])))
+
+    @patch('wazo_agid.objects.logger')
+    def test_cycles_are_reported(self, logger):
+        graph = ContextGraph(
+            [('a', 'A', 'tenant', 0), ('b', 'B', 'tenant', 0), ('c', 'C', 'tenant', 0)],
+            [('a', 'b', 1), ('b', 'c', 1), ('c', 'a', 1)],
+        )
+
+        assert_that(graph.cycles, equal_to(set([('a', 'b', 'c')])))
+        logger.warning.assert_called_once_with('context inclusion cycle: %s', 'a -> b -> c -> a')
+
+    @patch('wazo_agid.objects.logger')
+    def test_diamonds_are_not_cycles(self, logger):
+        graph = ContextGraph(
+            [('a', 'A', 'tenant', 0), ('b', 'B', 'tenant', 0), ('c', 'C', 'tenant', 0), ('d', 'D', 'tenant', 0)],
+            [('a', 'b', 1), ('a', 'c', 2), ('b', 'd', 1), ('c', 'd', 1)],
+        )
+
+        assert_that(graph.find('a'), equal_to(('a', 'A', ('a', 'b', 'd', 'c'))))
+        assert_that(graph.cycles, equal_to(set()))
+        logger.warning.assert_not_called()
+
+    def test_find_commented_or_unknown_context(self):
+        assert_that(self.graph.find('disabled'), none())
+        assert_that(self.graph.find('unknown'), none())
+
+    def test_get_tenant_uuid(self):
+        assert_that(self.graph.get_tenant_uuid('internal'), equal_to('tenant-1'))
+        assert_that(self.graph.get_tenant_uuid('disabled'), equal_to('tenant-2'))
+        assert_that(self.graph.get_tenant_uuid('unknown'), none())
+
+
+@patch('wazo_agid.objects._unknown_users', NegativeCache('test', 10, 10))
+@patch('wazo_agid.objects.user_dao')
+class TestUnknownUser(unittest.TestCase):
+
+    def test_unknown_user_is_not_looked_up_again(self, user_dao):
+        user_dao.get.side_effect = LookupError()
+
+        assert_that(calling(User).with_args(Mock(), Mock(), xid=42), raises(LookupError))
+        assert_that(calling(User).with_args(Mock(), Mock(), xid=42), raises(LookupError))
+
+        user_dao.get.assert_called_once_with(42)
+
+    def test_unknown_exten_is_not_looked_up_again(self, user_dao):
+        user_dao.get_user_by_number_context.side_effect = LookupError()
+
+        assert_that(calling(User).with_args(Mock(), Mock(), exten='666', context='default'), raises(LookupError))
+        assert_that(calling(User).with_args(Mock(), Mock(), exten='666', context='default'), raises(LookupError))
+
+        user_dao.get_user_by_number_context.assert_called_once_with('666', 'default')
+
+
+@patch('wazo_agid.objects._last_known_users', LastKnownResults('test', 10))
+@patch('wazo_agid.objects.user_dao')
+class TestLastKnownUser(unittest.TestCase):
+
+    def test_last_known_user_served_while_the_database_is_unreachable(self, user_dao):
+        user_dao.get.return_value = Mock(id=42, ringseconds='30', enablevoicemail=0, firstname='Alice')
+        User(Mock(), Mock(), xid=42)
+        user_dao.get.side_effect = OperationalError()
+
+        user = User(Mock(), Mock(), xid=42)
+
+        assert_that(user.firstname, equal_to('Alice'))
+        assert_that(user_dao.get.call_count, equal_to(2))
+
+
+@patch('wazo_agid.objects._last_known_dial_actions', LastKnownResults('test', 10))
+class TestDialAction(unittest.TestCase):
+
+    def setUp(self):
+        self.cursor = Mock()
+        self.cursor.cast.return_value = 'categoryval::int'
+
+    def test_no_dial_action(self):
+        self.cursor.fetchone.return_value = None
+
+        action = DialAction(Mock(), self.cursor, 'noanswer', 'user', 2)
+
+        assert_that((action.action, action.actionarg1, action.actionarg2), equal_to(('none', None, None)))
+
+    def test_last_known_action_served_while_the_database_is_unreachable(self):
+        self.cursor.fetchone.return_value = {'action': 'voicemail', 'actionarg1': '1', 'actionarg2': ''}
+        DialAction(Mock(), self.cursor, 'noanswer', 'user', 2)
+        self.cursor.query.side_effect = OperationalError()
+
+        action = DialAction(Mock(), self.cursor, 'noanswer', 'user', 2)
+
+        assert_that((action.action, action.actionarg1, action.actionarg2), equal_to(('voicemail', '1', '')))
+
+
+@patch('wazo_agid.objects.user_line_dao')
+@patch('wazo_agid.objects.callfilter_dao')
+class TestBossCallFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.cursor = Mock()
+        bosses_patch = patch('wazo_agid.objects._call_filter_bosses')
+        self.bosses = bosses_patch.start()
+        self.bosses.get.return_value = frozenset(['42'])
+        self.addCleanup(bosses_patch.stop)
+        BossCallFilter.invalidate()
+
+    def test_not_a_boss(self, callfilter_dao, user_line_dao):
+        result = BossCallFilter.find(self.cursor, 12)
+
+        assert_that(result, none())
+        assert_that(callfilter_dao.find_boss.called, equal_to(False))
+
+    def test_boss_is_loaded_once(self, callfilter_dao, user_line_dao):
+        callfilter_dao.find_boss.return_value = Mock(callfilterid=1, ringseconds=10)
+        callfilter_dao.find.return_value = Mock(id=1, callfrom='all', bosssecretary='all', ringseconds=20)
+        callfilter_dao.is_activated_by_callfilter_id.return_value = 1
+        callfilter_dao.get_secretaries_by_callfiltermember_id.return_value = [
+            (Mock(active=1, typeval='43'), 5),
+            (Mock(active=0, typeval='44'), 5),
+        ]
+        user_line_dao.get_line_identity_by_user_id.return_value = 'sip/abcd'
+
+        BossCallFilter.find(self.cursor, 42)
+        result = BossCallFilter.find(self.cursor, 42)
+
+        assert_that(result.callfilter.bosssecretary, equal_to('all'))
+        assert_that(result.boss_ringseconds, equal_to(10))
+        assert_that(result.secretaries, equal_to([('pjsip/abcd', 5)]))
+        callfilter_dao.find_boss.assert_called_once_with(42)
+
+    def test_no_longer_a_boss(self, callfilter_dao, user_line_dao):
+        callfilter_dao.find_boss.return_value = None
+
+        BossCallFilter.find(self.cursor, 42)
+        result = BossCallFilter.find(self.cursor, 42)
+
+        assert_that(result, none())
+        callfilter_dao.find_boss.assert_called_once_with(42)
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from hamcrest import assert_that, contains, equal_to, none, same_instance
+from mock import Mock, patch
+
+from .. import routing
+from ..cache import NegativeCache
+from ..routing import (
+    AgentRecord,
+    GroupRecord,
+    LineRecord,
+    PagingMemberRecord,
+    PagingRecord,
+    QueueRecord,
+    RoutingSnapshot,
+    VoicemailRecord,
+)
+
+
+def _agent(id, number):
+    return AgentRecord({
+        'id': id, 'tenant_uuid': 'tenant', 'number': number, 'passwd': '',
+        'firstname': 'first', 'lastname': 'last', 'language': 'en_US', 'preprocess_subroutine': None,
+    })
+
+
+def _queue(id):
+    row = dict((column, None) for column in QueueRecord.columns())
+    row['queuefeatures.id'] = id
+    row['queue.musicclass'] = 'default'
+    return QueueRecord(row)
+
+
+def _group(id, tenant_uuid, name):
+    row = dict((column, None) for column in GroupRecord.columns())
+    row.update({
+        'groupfeatures.id': id,
+        'groupfeatures.tenant_uuid': tenant_uuid,
+        'groupfeatures.name': name,
+    })
+    return GroupRecord(row)
+
+
+def _voicemail(id, mailbox, context, commented=0):
+    row = dict((column, None) for column in VoicemailRecord.columns())
+    row.update({
+        'voicemail.uniqueid': id,
+        'voicemail.mailbox': mailbox,
+        'voicemail.context': context,
+        'voicemail.commented': commented,
+    })
+    return VoicemailRecord(row)
+
+
+def _snapshot(queues=(), groups=(), agents=(), voicemails=(), pagings=(), paging_callers=(), paging_members=()):
+    return RoutingSnapshot(list(queues), list(groups), [], list(agents), list(voicemails),
+                           list(pagings), list(paging_callers), list(paging_members))
+
+
+class TestRecord(unittest.TestCase):
+
+    def test_attributes_are_renamed(self):
+        queue = _queue(42)
+
+        assert_that(queue.id, equal_to(42))
+        assert_that(queue.musiconhold, equal_to('default'))
+
+    def test_no_instance_dict(self):
+        self.assertRaises(AttributeError, setattr, _queue(42), 'unknown', 1)
+
+
+class TestRoutingSnapshot(unittest.TestCase):
+
+    def test_agents_are_indexed_by_id_and_number(self):
+        agent = _agent(1, '1001')
+
+        snapshot = _snapshot(agents=[agent])
+
+        assert_that(snapshot.agents_by_id[1], same_instance(agent))
+        assert_that(snapshot.agents_by_number['1001'], same_instance(agent))
+
+    def test_paging_callers_and_members_are_grouped_by_paging(self):
+        member = PagingMemberRecord({
+            'paginguser.pagingid': 3,
+            'paginguser.userfeaturesid': 12,
+            'linefeatures.endpoint_sip_uuid': 'uuid',
+            'linefeatures.endpoint_sccp_id': None,
+            'linefeatures.endpoint_custom_id': None,
+            'linefeatures.name': 'abcdef',
+        })
+
+        snapshot = _snapshot(paging_callers=[(3, 10), (3, 11)], paging_members=[member])
+
+        assert_that(snapshot.paging_callers[3], equal_to(set([10, 11])))
+        assert_that(snapshot.paging_members[3], contains(member))
+
+
+@patch('wazo_agid.routing._routing')
+class TestFind(unittest.TestCase):
+
+    def setUp(self):
+        self.cursor = Mock()
+        self.cursor.fetchall.return_value = []
+        unknown_patch = patch('wazo_agid.routing._unknown', NegativeCache('test', 10, 10))
+        unknown_patch.start()
+        self.addCleanup(unknown_patch.stop)
+
+    def test_find_queue_from_snapshot(self, _routing):
+        queue = _queue(42)
+        _routing.get.return_value = _snapshot(queues=[queue])
+
+        result = routing.find_queue(self.cursor, '42')
+
+        assert_that(result, same_instance(queue))
+        assert_that(self.cursor.query.called, equal_to(False))
+
+    def test_find_queue_not_in_snapshot(self, _routing):
+        _routing.get.return_value = _snapshot()
+        row = dict((column, None) for column in QueueRecord.columns())
+        row['queuefeatures.id'] = 42
+        self.cursor.fetchall.return_value = [row]
+
+        result = routing.find_queue(self.cursor, '42')
+
+        assert_that(result.id, equal_to(42))
+        self.cursor.query.assert_called_once_with(
+            QueueRecord.QUERY + 'AND queuefeatures.id = %s', QueueRecord.columns(), ('42',),
+        )
+
+    def test_find_queue_unknown_is_not_queried_again(self, _routing):
+        _routing.get.return_value = _snapshot()
+
+        routing.find_queue(self.cursor, '666')
+        result = routing.find_queue(self.cursor, '666')
+
+        assert_that(result, none())
+        assert_that(self.cursor.query.call_count, equal_to(1))
+
+    def test_find_group_name(self, _routing):
+        _routing.get.return_value = _snapshot(groups=[_group(3, 'tenant', 'sales')])
+
+        assert_that(routing.find_group_name(self.cursor, 'tenant', '3'), equal_to('sales'))
+        assert_that(self.cursor.query.called, equal_to(False))
+
+    def test_find_group_name_of_another_tenant(self, _routing):
+        _routing.get.return_value = _snapshot(groups=[_group(3, 'tenant', 'sales')])
+
+        assert_that(routing.find_group_name(self.cursor, 'other-tenant', '3'), none())
+
+    def test_find_agent_by_number(self, _routing):
+        agent = _agent(1, '1001')
+        _routing.get.return_value = _snapshot(agents=[agent])
+
+        assert_that(routing.find_agent(self.cursor, number='1001'), same_instance(agent))
+
+    def test_find_agent_unknown(self, _routing):
+        _routing.get.return_value = _snapshot()
+
+        assert_that(routing.find_agent(self.cursor, agent_id=1), none())
+
+    def test_find_voicemail_by_mailbox_follows_context_order(self, _routing):
+        first = _voicemail(1, '1001', 'ctx-a')
+        second = _voicemail(2, '1001', 'ctx-b')
+        _routing.get.return_value = _snapshot(voicemails=[first, second])
+
+        result = routing.find_voicemail_by_mailbox(self.cursor, '1001', ['ctx-b', 'ctx-a'])
+
+        assert_that(result, same_instance(second))
+
+    def test_find_voicemail_by_mailbox_skips_commented(self, _routing):
+        commented = _voicemail(1, '1001', 'ctx-a', commented=1)
+        enabled = _voicemail(2, '1001', 'ctx-b')
+        _routing.get.return_value = _snapshot(voicemails=[commented, enabled])
+
+        result = routing.find_voicemail_by_mailbox(self.cursor, '1001', ['ctx-a', 'ctx-b'])
+
+        assert_that(result, same_instance(enabled))
+
+    def test_find_paging_from_snapshot(self, _routing):
+        paging = PagingRecord(dict((column, None) for column in PagingRecord.columns()))
+        paging.id, paging.number = 3, '800'
+        _routing.get.return_value = _snapshot(pagings=[paging], paging_callers=[(3, 10)])
+
+        result = routing.find_paging(self.cursor, '800')
+
+        assert_that(result, contains(same_instance(paging), set([10]), []))
+
+
+class TestFindCalleeLines(unittest.TestCase):
+
+    def setUp(self):
+        self.cursor = Mock()
+        self.main_line = {
+            'linefeatures.id': 10,
+            'linefeatures.name': 'abcd',
+            'linefeatures.endpoint_sip_uuid': 'uuid',
+            'linefeatures.endpoint_sccp_id': None,
+            'linefeatures.endpoint_custom_id': None,
+            'line_extension.extension_id': 100,
+        }
+        self.extension = {
+            'extensions.id': 100,
+            'extensions.exten': '1001',
+            'extensions.context': 'default',
+        }
+
+    def _line(self, id, name):
+        row = dict(self.extension)
+        row.update({
+            'linefeatures.id': id,
+            'linefeatures.name': name,
+            'linefeatures.endpoint_sip_uuid': None,
+            'linefeatures.endpoint_sccp_id': 1,
+            'linefeatures.endpoint_custom_id': None,
+        })
+        return row
+
+    def test_two_queries_per_call(self):
+        self.cursor.fetchone.return_value = self.main_line
+        self.cursor.fetchall.return_value = [self._line(10, 'abcd'), self._line(11, 'efgh')]
+
+        main_line, extension, lines = routing.find_callee_lines(self.cursor, 42)
+
+        assert_that(self.cursor.query.call_count, equal_to(2))
+        assert_that(main_line.protocol, equal_to('sip'))
+        assert_that(extension.exten, equal_to('1001'))
+        assert_that([(line.name, line.protocol) for line in lines],
+                    contains(('abcd', 'sccp'), ('efgh', 'sccp')))
+
+    def test_destination_extension_is_used(self):
+        self.cursor.fetchone.return_value = self.main_line
+        self.cursor.fetchall.return_value = [self._line(10, 'abcd')]
+
+        routing.find_callee_lines(self.cursor, 42, 200)
+
+        assert_that(self.cursor.query.call_args[0][2], equal_to((200,)))
+
+    def test_extension_without_line(self):
+        row = dict((column, None) for column in LineRecord.columns())
+        row.update(self.extension)
+        self.cursor.fetchone.return_value = self.main_line
+        self.cursor.fetchall.return_value = [row]
+
+        _, extension, lines = routing.find_callee_lines(self.cursor, 42)
+
+        assert_that(extension.id, equal_to(100))
+        assert_that(lines, equal_to([]))
+
+    def test_no_main_line(self):
+        self.cursor.fetchone.return_value = None
+
+        result = routing.find_callee_lines(self.cursor, 42)
+
+        assert_that(result, equal_to((None, None, [])))
+        assert_that(self.cursor.query.call_count, equal_to(1))
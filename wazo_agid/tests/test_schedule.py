@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
-# Copyright 2013-2019 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2013-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import datetime
+import pytz
 import unittest
-from mock import Mock, call
+from mock import Mock, call, patch
 from wazo_agid.schedule import ScheduleBuilder, SchedulePeriodBuilder, \
     HoursChecker, WeekdaysChecker, DaysChecker, MonthsChecker, SchedulePeriod, \
     ScheduleAction
@@ -260,6 +261,82 @@ class TestSchedule(unittest.TestCase):
         self._assert_schedule_is_in_state(schedule, current_time, 'opened')
 
 
+class TestScheduleTransition(unittest.TestCase):
+    def setUp(self):
+        self.timezone = pytz.timezone('America/Montreal')
+        self.schedule = (_a_schedule()
+                         .opened(_a_period()
+                                 .hours('08:00-17:00')
+                                 .weekdays('1-5').build())
+                         .closed(_a_period()
+                                 .hours('12:00-12:59')
+                                 .days('24')
+                                 .action(1).build())
+                         .timezone_name('America/Montreal')
+                         .build())
+
+    def _localize(self, *args):
+        return self.timezone.localize(datetime.datetime(*args))
+
+    def test_next_transition_is_end_of_period(self):
+        # friday 2021-09-17
+        current_time = self._localize(2021, 9, 17, 13, 0)
+
+        result = self.schedule.compute_next_transition(current_time)
+
+        self.assertEqual(result, self._localize(2021, 9, 17, 17, 1))
+
+    def test_next_transition_is_start_of_period(self):
+        current_time = self._localize(2021, 9, 17, 6, 30)
+
+        result = self.schedule.compute_next_transition(current_time)
+
+        self.assertEqual(result, self._localize(2021, 9, 17, 8, 0))
+
+    def test_next_transition_of_a_closed_period(self):
+        current_time = self._localize(2021, 9, 17, 11, 0)
+
+        result = self.schedule.compute_next_transition(current_time)
+
+        self.assertEqual(result, self._localize(2021, 9, 17, 12, 0))
+
+    def test_next_transition_is_midnight_without_change_in_day(self):
+        current_time = self._localize(2021, 9, 18, 13, 30)
+
+        result = self.schedule.compute_next_transition(current_time)
+
+        self.assertEqual(result, self._localize(2021, 9, 19, 0, 0))
+
+    def test_next_transition_in_dst_gap_is_not_late(self):
+        schedule = (_a_schedule()
+                    .opened(_a_period()
+                            .hours('02:30-05:00').build())
+                    .timezone_name('America/Montreal')
+                    .build())
+        # DST starts on 2021-03-14 at 02:00, 02:30 does not exist
+        current_time = self._localize(2021, 3, 14, 1, 0)
+
+        result = schedule.compute_next_transition(current_time)
+
+        self.assertTrue(result <= self.timezone.localize(datetime.datetime(2021, 3, 14, 3, 0), is_dst=True))
+
+    @patch('wazo_agid.schedule.datetime')
+    def test_state_is_kept_until_next_transition(self, mock_datetime):
+        mock_datetime.timedelta = datetime.timedelta
+        mock_datetime.datetime.utcnow.return_value = datetime.datetime(2021, 9, 17, 17, 0)  # 13:00 local
+        schedule = self.schedule
+        schedule.compute_state = Mock(wraps=schedule.compute_state)
+
+        self.assertEqual(schedule.compute_state_for_now().state, 'opened')
+        mock_datetime.datetime.utcnow.return_value = datetime.datetime(2021, 9, 17, 21, 0)  # 17:00 local
+        self.assertEqual(schedule.compute_state_for_now().state, 'opened')
+        self.assertEqual(schedule.compute_state.call_count, 1)
+
+        mock_datetime.datetime.utcnow.return_value = datetime.datetime(2021, 9, 17, 21, 1)  # 17:01 local
+        self.assertEqual(schedule.compute_state_for_now().state, 'closed')
+        self.assertEqual(schedule.compute_state.call_count, 2)
+
+
 def _a_schedule():
     return ScheduleBuilder()
 
@@ -317,3 +394,25 @@ class TestScheduleAction(unittest.TestCase):
         expected_call_args = [call('XIVO_FWD_SCHEDULE_OUT_ACTION', 'foo'),
                               call('XIVO_FWD_SCHEDULE_OUT_ACTIONARG1', 'bar')]
         self.assertEqual(expected_call_args, agi.set_variable.call_args_list)
+
+
+class TestCompiledSchedulePeriod(unittest.TestCase):
+    def test_matches_uncompiled_period(self):
+        period = (_a_period()
+                  .hours('08:30-17:15')
+                  .weekdays('1-3,5')
+                  .days('1-15')
+                  .months('2,4')
+                  .build())
+        compiled = period.compile()
+
+        start = datetime.datetime(2021, 1, 1)
+        for minutes in xrange(0, 200 * 24 * 60, 7):
+            current_time = start + datetime.timedelta(minutes=minutes)
+            self.assertEqual(period.is_in(current_time), compiled.is_in(current_time), current_time)
+
+    def test_period_without_checker_is_always_in(self):
+        compiled = _a_period().build().compile()
+
+        self.assertTrue(compiled.is_in(datetime.datetime(2021, 12, 31, 23, 59)))
+        self.assertTrue(compiled.is_in(datetime.datetime(2021, 1, 4, 0, 0)))
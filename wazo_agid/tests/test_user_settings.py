@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from hamcrest import assert_that, equal_to
+from mock import Mock, sentinel
+
+from .. import user_settings
+
+
+class TestUserSettings(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Mock()
+        self.user = self.client.users.return_value
+
+    def test_forwards_see_changes_made_outside_agid(self):
+        self.user.list_forwards.side_effect = [sentinel.forwards, sentinel.changed_forwards]
+        user_settings.get_forwards(self.client, 2)
+
+        result = user_settings.get_forwards(self.client, 2)
+
+        assert_that(result, equal_to(sentinel.changed_forwards))
+
+    def test_toggle_service_sees_changes_made_outside_agid(self):
+        self.user.get_service.return_value = {'enabled': False}
+        user_settings.toggle_service(self.client, 2, 'dnd')
+        self.user.get_service.return_value = {'enabled': False}
+
+        result = user_settings.toggle_service(self.client, 2, 'dnd')
+
+        assert_that(result, equal_to({'enabled': True}))
+        assert_that(self.user.get_service.call_count, equal_to(2))
+        self.user.update_service.assert_called_with('dnd', {'enabled': True})
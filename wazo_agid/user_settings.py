@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from wazo_agid import circuit_breaker
+
+# Forwards and services of the users are read from confd on every use: agid
+# is not notified of the changes made from the Wazo app or the web UI, so a
+# cached value could be stale and a toggle computed from it would do
+# nothing.
+
+
+def get_forwards(confd_client, user_id):
+    with circuit_breaker.guard('confd'):
+        return confd_client.users(user_id).list_forwards()
+
+
+def update_forward(confd_client, user_id, forward_name, body):
+    with circuit_breaker.guard('confd'):
+        confd_client.users(user_id).update_forward(forward_name, body)
+
+
+def update_forwards(confd_client, user_id, body):
+    with circuit_breaker.guard('confd'):
+        confd_client.users(user_id).update_forwards(body)
+
+
+def toggle_service(confd_client, user_id, service_name):
+    with circuit_breaker.guard('confd'):
+        service = confd_client.users(user_id).get_service(service_name)
+
+    new_value = {'enabled': not service['enabled']}
+    with circuit_breaker.guard('confd'):
+        confd_client.users(user_id).update_service(service_name, new_value)
+    return new_value